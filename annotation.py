@@ -1,12 +1,27 @@
+import itertools
 import logging
+import multiprocessing
 import os
+import pickle
+import queue
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pprint import pprint, pformat
 
 import psycopg2
 from dotenv import load_dotenv
-from mo_sql_parsing import parse, format
-
+from mo_sql_parsing import parse
+
+from cache import default_ast_cache, default_plan_cache
+from catalog import default_catalog
+from condition import column_comparisons, comparison_key, condition_keys
+from emitter import clause, sql
+from match_stats import MatchStats, default_coverage
+from metrics import default_metrics
+from plan_json import register_plan_decoder
+from pool import ConnectionPools
 from preprocessing import preprocess_query_string, preprocess_query_tree
+from query_index import COMPARISON_OPERATORS, QueryIndex, comparison_operands
 
 
 def import_config():
@@ -18,141 +33,216 @@ def import_config():
     return  db_uname, db_pass, db_host, db_port
 
 
-def open_db(db_name, db_uname, db_pass, db_host, db_port):
+def open_db(db_name, db_uname, db_pass, db_host, db_port, matched_plans=False, pause_gc=False):
+    """
+    :param matched_plans: decode EXPLAIN output down to the keys matching reads, see plan_json.py
+    :param pause_gc: pause the garbage collector while decoding EXPLAIN output, see plan_json.gc_paused
+    """
     conn = psycopg2.connect(database=db_name, user=db_uname, password=db_pass, host=db_host, port=db_port)
     conn.set_session(readonly=True, autocommit=True)
+    register_plan_decoder(conn, matched_plans, pause_gc)
     return conn
 
 
 def get_query_execution_plan(cursor, sql_query):
-    cursor.execute(f"EXPLAIN  (VERBOSE TRUE, COSTS FALSE, FORMAT JSON) {sql_query}")
-    return cursor.fetchone()
-
-
-def transverse_plan(plan):
-    logging.debug(f"now in {plan['Node Type']}")
-    if plan['Node Type'] == 'Nested Loop':
-        assert len(plan['Plans']) == 2, "Length of Plans is more than two."
-        if 'Join Filter' in plan:
-            yield {
-                'Type': 'Join',
-                'Subtype': plan['Node Type'],
-                'Filter': plan['Join Filter'],
-            }
-        else:  # else can try heuristic to recover join condition IF both children are scan
-            yield {
-                'Type': 'Join',
-                'Subtype': plan['Node Type'],
-                'Filter': '',  # can also not include
-                'Possible LHS': plan['Plans'][0]['Output'],
-                'Possible RHS': plan['Plans'][1]['Output'],
-            }
-        yield from transverse_plan(plan['Plans'][0])
-        yield from transverse_plan(plan['Plans'][1])
-    elif plan['Node Type'] == 'Hash Join':
-        yield {
-            'Type': 'Join',
-            'Subtype': plan['Node Type'],
-            'Filter': plan['Hash Cond'],
-        }
-        assert len(plan['Plans']) == 2, "Length of Plans is more than two."
-        yield from transverse_plan(plan['Plans'][0])
-        yield from transverse_plan(plan['Plans'][1])
-    elif plan['Node Type'] == 'Merge Join':
-        yield {
-            'Type': 'Join',
-            'Subtype': plan['Node Type'],
-            'Filter': plan['Merge Cond'],
-        }
-
-        for p in plan['Plans']:
-            yield from transverse_plan(p)
-    elif plan['Node Type'] == 'Seq Scan':
-        yield {
-            'Type': 'Scan',
-            'Subtype': plan['Node Type'],
-            'Name': plan['Relation Name'],
-            'Alias': plan['Alias'],
-            'Filter': plan.get('Filter', ''),
-        }
-    elif plan['Node Type'] in ['Index Scan', 'Index Only Scan']:
-        def _f():
-            if 'Index Cond' in plan:
-                yield plan['Index Cond']
-            if 'Filter' in plan:
-                yield plan['Filter']
-
-        yield {
-            'Type': 'Scan',
-            'Subtype': plan['Node Type'],
-            'Name': plan['Relation Name'],
-            'Alias': plan['Alias'],
-            'Filter': ' AND '.join(_f()),
-            # 'Filter': ' AND'.join([plan.get('Index Cond', None), plan.get('Filter', None)]),
-        }
-
-    elif plan['Node Type'] == 'Bitmap Index Scan':
-        yield {
-            'Type': 'Scan',
-            'Subtype': plan['Node Type'],
-            'Name': plan['Index Name'],
-            'Alias': '',
-            'Filter': plan.get('Index Cond', ''),
-        }
-    elif plan['Node Type'] == 'Bitmap Heap Scan':
-        yield {
-            'Type': 'Scan',
-            'Subtype': plan['Node Type'],
-            'Name': plan['Relation Name'],
-            'Alias': plan['Alias'],
-            'Filter': plan.get('Filter', ''),
-        }
-        for p in plan['Plans']:
-            yield from transverse_plan(p)
-    else:
-        logging.warning(f"WARNING: Unimplemented Node Type {plan['Node Type']}")
-        for p in plan['Plans']:
-            yield from transverse_plan(p)
+    with default_metrics.span('db.explain'):
+        cursor.execute(f"EXPLAIN  (VERBOSE TRUE, COSTS FALSE, FORMAT JSON) {sql_query}")
+        return cursor.fetchone()
+
+
+def get_cached_execution_plan(cursor, sql_query, plan_cache=None):
+    return (plan_cache or default_plan_cache).get_plan(cursor, sql_query, get_query_execution_plan)
+
+
+def parameterized_conditions(outer: dict, inner: dict):
+    """
+    Join conditions pushed into a parameterized scan on the inner side of a Nested Loop,
+    e.g. Index Cond (lineitem.l_orderkey = orders.o_orderkey) with orders scanned on the outer side
+    """
+    outer_columns = set(outer.get('Output', []))
+    conds = []
+    nodes = [inner]
+    while nodes:
+        node = nodes.pop()
+        if 'Index Cond' in node:
+            for left, op, right in column_comparisons(node['Index Cond']):
+                if left in outer_columns or right in outer_columns:
+                    conds.append(f'{left} {op} {right}')
+        nodes.extend(node.get('Plans', []))
+    return conds
+
+
+class Annotations:
+    """
+    What matching found, kept beside the parse tree instead of in it, so a tree can be shared.
+    Nodes are keyed by identity and held on to, so a key cannot be reused by another node. A bare
+    relation name has no identity of its own and is keyed by its container and position in it.
+    """
+    def __init__(self):
+        self._notes = {}
+        self._expanded = {}
+
+    def annotate(self, node, text, position=None):
+        self._notes[id(node) if position is None else (id(node), position)] = (node, text)
+
+    def note(self, node, position=None):
+        entry = self._notes.get(id(node) if position is None else (id(node), position))
+        return '' if entry is None else entry[1]
+
+    def has_note(self, node, position=None):
+        return (id(node) if position is None else (id(node), position)) in self._notes
+
+    def expand(self, node):
+        self._expanded[id(node)] = node
+
+    def is_expanded(self, node):
+        return id(node) in self._expanded
 
+    def copy(self):
+        annotations = Annotations()
+        annotations._notes = dict(self._notes)
+        annotations._expanded = dict(self._expanded)
+        return annotations
 
-def format_ann(result: dict, use_alias=False):
-    if result['Type'] == 'Join':
-        return f"{result['Subtype']} on {result['Filter']}"
-    elif result['Type'] == 'Scan':
-        return f"Filtered on {result['Subtype']} of {result['Name']}"
+    def __len__(self):
+        return len(self._notes)
 
 
-def parse_expr_node(query: dict, result: dict) -> bool:
+NO_ANNOTATIONS = Annotations()
+
+
+_UNPARSED = object()
+
+
+class PlanNode:
+    """
+    A plan node as matching sees it. Built once per node by transverse_plan and only read afterwards,
+    so every query node it is tried against sees the same record.
+    :param kind: 'Join' or 'Scan'
+    :param lhs, rhs: output columns of the two sides of a Nested Loop without a Join Filter, else None
+    :param parameterized: join conditions of its parameterized inner scan, for such a Nested Loop
+    """
+    __slots__ = ('kind', 'subtype', 'filter', 'name', 'alias', 'lhs', 'rhs', 'parameterized', '_keys')
+
+    def __init__(self, kind, subtype, filter='', name='', alias='', lhs=None, rhs=None, parameterized=None):
+        self.kind = kind
+        self.subtype = subtype
+        self.filter = filter
+        self.name = name
+        self.alias = alias
+        self.lhs = lhs
+        self.rhs = rhs
+        self.parameterized = parameterized
+        self._keys = _UNPARSED
+
+    def keys(self):
+        """
+        Canonical keys of the comparisons in filter, parsed on first use (see condition.py)
+        """
+        if self._keys is _UNPARSED:
+            self._keys = condition_keys(self.filter)
+        return self._keys
+
+    def with_filter(self, filter):
+        """
+        The same node tried with a guessed join condition
+        """
+        return PlanNode(self.kind, self.subtype, filter, self.name, self.alias, self.lhs, self.rhs, self.parameterized)
+
+    def __repr__(self):
+        return f'PlanNode({self.kind!r}, {self.subtype!r}, {self.filter!r}, {self.name!r}, {self.alias!r})'
+
+
+def transverse_plan(plan, stats: MatchStats = None):
+    """
+    The plan nodes find_query_node can match, in pre-order. The walk keeps its own stack,
+    so it costs the same per node at any depth.
+    :return: generator of PlanNode
+    """
+    stack = [plan]
+    while stack:
+        plan = stack.pop()
+        node_type = plan['Node Type']
+        logging.debug("now in %s", node_type)
+        children = ()
+        if node_type == 'Nested Loop':
+            assert len(plan['Plans']) == 2, "Length of Plans is more than two."
+            if 'Join Filter' in plan:
+                yield PlanNode('Join', node_type, plan['Join Filter'])
+            else:  # else can try heuristic to recover join condition IF both children are scan
+                outer, inner = plan['Plans']
+                yield PlanNode('Join', node_type, lhs=outer['Output'], rhs=inner['Output'],
+                               parameterized=parameterized_conditions(outer, inner))
+            children = plan['Plans']
+        elif node_type == 'Hash Join':
+            yield PlanNode('Join', node_type, plan['Hash Cond'])
+            assert len(plan['Plans']) == 2, "Length of Plans is more than two."
+            children = plan['Plans']
+        elif node_type == 'Merge Join':
+            yield PlanNode('Join', node_type, plan['Merge Cond'])
+            children = plan['Plans']
+        elif node_type == 'Seq Scan':
+            yield PlanNode('Scan', node_type, plan.get('Filter', ''), plan['Relation Name'], plan['Alias'])
+        elif node_type in ['Index Scan', 'Index Only Scan']:
+            conds = [plan[key] for key in ['Index Cond', 'Filter'] if key in plan]
+            yield PlanNode('Scan', node_type, ' AND '.join(conds), plan['Relation Name'], plan['Alias'])
+        elif node_type == 'Bitmap Index Scan':
+            yield PlanNode('Scan', node_type, plan.get('Index Cond', ''), plan['Index Name'], '')
+        elif node_type == 'Bitmap Heap Scan':
+            yield PlanNode('Scan', node_type, plan.get('Filter', ''), plan['Relation Name'], plan['Alias'])
+            children = plan['Plans']
+        else:
+            logging.warning("WARNING: Unimplemented Node Type %s", node_type)
+            default_metrics.count('unimplemented_node')
+            if stats is not None:
+                stats.unimplemented_node(node_type)
+            # leaves such as Result or Function Scan have no Plans
+            children = plan.get('Plans', ())
+        stack.extend(reversed(children))
+
+
+def format_ann(result: PlanNode, use_alias=False):
+    if result.kind == 'Join':
+        return f"{result.subtype} on {result.filter}"
+    elif result.kind == 'Scan':
+        return f"Filtered on {result.subtype} of {result.name}"
+
+
+def match_comparison(query: dict, op: str, result: PlanNode, index: QueryIndex = None) -> bool:
+    if index is not None:
+        return index.is_match(query, result.filter)
+    key, keys = comparison_key(op, query[op]), result.keys()
+    if key is not None and keys is not None:
+        return key in keys
+    default_metrics.count('text_match_fallback')
+    arr = comparison_operands(query[op])
+    exp = (COMPARISON_OPERATORS[op][0].join(arr), COMPARISON_OPERATORS[op][1].join(reversed(arr)))
+    return any(x in result.filter for x in exp)
+
+
+def parse_expr_node(query: dict, result: PlanNode, annotations: Annotations, index: QueryIndex = None) -> bool:
     # logging.info(f'query={query}, result={result}')
     """
     :param query:
     :param result:
+    :param annotations: where matches are recorded, the query itself is not written to
+    :param index: when given, only nodes on a path to a match of result are visited
     :return:
     """
-    if 'ann' in query.keys():
+    if index is not None and id(query) not in index.hot:
         return False
-    comp_ops = {
-        'gt': (' > ', ' < '),
-        'lt': (' < ', ' > '),
-        'eq': (' = ', ' = '),
-        'neq': (' <> ', ' <> '),
-        'gte': (' >= ', ' <= '),
-        'lte': (' <= ', ' >= '),
-        'like': (' ~~ ', ' ~~ '),
-        'not_like': (' !~~ ', ' !~~ '),
-    }
     op = list(query.keys())[0]
     if op == 'and' or op == 'or':
         res = False
         for subq in query[op]:
             if type(subq) is dict:
-                res |= parse_expr_node(subq, result)
+                res |= parse_expr_node(subq, result, annotations, index)
             else:
                 raise NotImplementedError(f'{subq}')
         if res:
-            query['expand'] = True
+            annotations.expand(query)
         return res
-    elif op in comp_ops:
+    elif op in COMPARISON_OPERATORS:
         """
         ((lineitem.l_shipdate >= '1994-01-01'::date) 
         (lineitem.l_shipdate < '1995-01-01 00:00:00'::timestamp without time zone)
@@ -160,30 +250,15 @@ def parse_expr_node(query: dict, result: dict) -> bool:
         {'gte': ['lineitem.l_shipdate', {'literal': '1994-01-01'}]}
         {'lt': ['lineitem.l_shipdate', {'add': [{'date': {'literal': '1994-01-01'}}, {'interval': [1, 'year']}]}]}
         """
-        arr = []
         annotated = False
         for subq in query[op]:
-            if type(subq) is str:
-                arr.append(subq)
-            elif type(subq) in [int, float]:
-                arr.append(str(subq))
-            elif type(subq) is dict:
-                if 'literal' in subq:
-                    arr.append(f"'{subq['literal']}'")
-                elif 'date' in subq:
-                    arr.append(f"'{subq['date']['literal']}'")
-                elif len(subq.keys() & {'sub', 'add'}) > 0:
-                    arr.append('$')
-                else:
-                    arr.append('$')
-                    if find_query_node(subq, result):
-                        query['expand'] = True
-                        annotated = True
-            else:
-                raise NotImplementedError(f'{subq}')
-        exp = (comp_ops[op][0].join(arr), comp_ops[op][1].join(reversed(arr)))
-        if any(x in result['Filter'] for x in exp):
-            query['ann'] = format_ann(result)
+            if type(subq) is dict and not subq.keys() & {'literal', 'date', 'sub', 'add'}:
+                if find_query_node(subq, result, annotations, index):
+                    annotations.expand(query)
+                    annotated = True
+        # an annotated comparison keeps its first match, but subqueries inside it can still match
+        if not annotations.has_note(query) and match_comparison(query, op, result, index):
+            annotations.annotate(query, format_ann(result))
             return True
         else:
             return annotated
@@ -194,13 +269,13 @@ def parse_expr_node(query: dict, result: dict) -> bool:
         """
         return False
     elif op == 'exists':
-        if find_query_node(query[op], result):
-            query['expand'] = True
+        if find_query_node(query[op], result, annotations, index):
+            annotations.expand(query)
             return True
         return False
     elif op == 'not':
-        if parse_expr_node(query[op], result):
-            query['expand'] = True
+        if parse_expr_node(query[op], result, annotations, index):
+            annotations.expand(query)
             return True
         return False
     elif op in ['in', 'nin']:
@@ -211,8 +286,8 @@ def parse_expr_node(query: dict, result: dict) -> bool:
                 pass
             else:
                 # If with subquery, become equijoin
-                if find_query_node(query[op][1], result):
-                    query['expand'] = True
+                if find_query_node(query[op][1], result, annotations, index):
+                    annotations.expand(query)
                     return True
         elif type(query[op][1]) is list:
             assert type(query[op][1][0]) in [str, int, float]
@@ -222,123 +297,484 @@ def parse_expr_node(query: dict, result: dict) -> bool:
         raise NotImplementedError(f'{op}')
 
 
-def find_query_node(query: dict, result: dict) -> bool:
+def join_conditions(result: PlanNode, index: QueryIndex = None):
+    """
+    Candidate conditions of a Nested Loop without a Join Filter: the join conditions of its
+    parameterized inner scan if there is one, else equalities between an outer and an inner output column
+    """
+    if result.parameterized:
+        return result.parameterized
+    if index is not None:
+        default_metrics.count('join_output_guess')
+        return index.join_candidates(result.lhs, result.rhs)
+    default_metrics.count('join_cartesian_guess')
+    return [f'{x} = {y}' for x in result.lhs for y in result.rhs]
+
+
+def find_query_node(query: dict, result: PlanNode, annotations: Annotations, index: QueryIndex = None) -> bool:
     # logging.info(f'query={query}, result={result}')
-    if result['Type'] == 'Join':  # look at WHERE
+    if index is not None and id(query) not in index.hot:
+        return False
+    if result.kind == 'Join':  # look at WHERE
         if 'where' in query:
-            if result['Filter'] == '':
+            if result.filter == '':
                 # For Nested Loop without explicit Filter, we try to find the condition by matching column names
                 possible_cond = []
-                for cond in [f'{x} = {y}' for x in result['Possible LHS'] for y in result['Possible RHS']]:
-                    result['Filter'] = cond
-                    if parse_expr_node(query['where'], result):
+                for cond in join_conditions(result, index):
+                    candidate = result.with_filter(cond)
+                    if index is not None:
+                        index.prepare(candidate)
+                    if parse_expr_node(query['where'], candidate, annotations, index):
                         possible_cond.append(cond)
-                assert len(possible_cond) <= 1, "MORE THAN ONE POSSIBLE CONDITION"
-                if len(possible_cond) == 1:
+                if index is not None:
+                    index.prepare(result)
+                # a parameterized inner scan may join on several columns, a guess from output columns may not
+                assert len(possible_cond) <= 1 or result.parameterized, "MORE THAN ONE POSSIBLE CONDITION"
+                if len(possible_cond) > 0:
                     return True
             else:
-                if parse_expr_node(query['where'], result):
+                if parse_expr_node(query['where'], result, annotations, index):
                     return True
         if type(query['from']) is dict and type(query['from']['value']) is dict:
-            if find_query_node(query['from']['value'], result):
+            if find_query_node(query['from']['value'], result, annotations, index):
                 return True
         if type(query['from']) is list:
             for v in query['from']:
                 if type(v) is dict and type(v['value']) is dict:
-                    if find_query_node(v['value'], result):
+                    if find_query_node(v['value'], result, annotations, index):
                         return True
-    elif result['Type'] == 'Scan':  # look at FROM
+    elif result.kind == 'Scan':  # look at FROM
         # goto from
+        # a bare relation name is annotated at most once, its slot in the query has no name to match again
         annotated = False
         if type(query['from']) is str:
-            if query['from'] == result['Name'] and query['from'] == result['Alias']:
-                query['from'] = {
-                    'value': query['from'],
-                    'ann': f"{result['Subtype']} {result['Name']}"
-                }
+            if query['from'] == result.name and query['from'] == result.alias and \
+                    not annotations.has_note(query, 'from'):
+                annotations.annotate(query, f"{result.subtype} {result.name}", 'from')
                 annotated = True
         elif type(query['from']) is dict:
             if type(query['from']['value']) is dict:
-                if find_query_node(query['from']['value'], result):
-                    query['from']['expand'] = True
+                if find_query_node(query['from']['value'], result, annotations, index):
+                    annotations.expand(query['from'])
                     annotated = True
-            elif type(query['from']['value']) is str and query['from']['value'] == result['Name'] and query['from'].get(
-                    'name', '') == result['Alias']:
+            elif type(query['from']['value']) is str and query['from']['value'] == result.name and query['from'].get(
+                    'name', '') == result.alias:
                 annotated = True
-                query['from']['ann'] = f"{result['Subtype']} {result['Name']} as {result['Alias']}"
+                annotations.annotate(query['from'], f"{result.subtype} {result.name} as {result.alias}")
         elif type(query['from']) is list:
             for i, rel in enumerate(query['from']):
                 if type(rel) is str:
-                    if rel == result['Name'] and rel == result['Alias']:
-                        query['from'][i] = {
-                            'value': rel,
-                            'ann': f"{result['Subtype']} {result['Name']}"
-                        }
+                    if rel == result.name and rel == result.alias and not annotations.has_note(query['from'], i):
+                        annotations.annotate(query['from'], f"{result.subtype} {result.name}", i)
                         annotated = True
                         break
                 else:
                     if type(rel['value']) is dict:
-                        if find_query_node(rel['value'], result):
-                            rel['expand'] = True
+                        if find_query_node(rel['value'], result, annotations, index):
+                            annotations.expand(rel)
                             annotated = True
                         continue
                     assert type(rel['value']) is str
-                    if rel['value'] == result['Name'] and rel.get('name', '') == result['Alias']:
-                        rel['ann'] = f"{result['Subtype']} {result['Name']} as {result['Alias']}"
+                    if rel['value'] == result.name and rel.get('name', '') == result.alias:
+                        annotations.annotate(rel, f"{result.subtype} {result.name} as {result.alias}")
                         annotated = True
                         break
         # if filter exist, goto where
-        if result['Filter'] != '' and 'where' in query:
-            parse_expr_node(query['where'], result)
+        if result.filter != '' and 'where' in query:
+            parse_expr_node(query['where'], result, annotations, index)
         return annotated
     return False
 
-def transverse_query(query: dict, plan: dict):
-    for result in transverse_plan(plan):  # iterate over node in root
-        find_query_node(query, result)
+
+def transverse_query(query: dict, plan: dict, stats: MatchStats = None, annotations: Annotations = None):
+    """
+    Match every node of plan to query, recording the matches in annotations
+    :return: the QueryIndex of query
+    """
+    annotations = Annotations() if annotations is None else annotations
+    index = QueryIndex(query)
+    for result in transverse_plan(plan, stats):  # iterate over node in root
+        index.prepare(result)
+        matched = find_query_node(query, result, annotations, index)
+        if default_metrics.enabled:
+            default_metrics.count('plan_nodes')
+            default_metrics.count('matches' if matched else 'misses')
+        if stats is not None:
+            stats.plan_node(result.subtype, matched)
+    if stats is not None:
+        for node, annotated in annotatable_nodes(query, annotations):
+            stats.query_node(annotated)
+    return index
+
+
+def annotatable_nodes(query: dict, annotations: Annotations):
+    """
+    Relations in FROM and comparisons in WHERE, the query nodes find_query_node can annotate
+    :return: generator of (node, whether it has an annotation)
+    """
+    stack = [query]
+    while stack:
+        node = stack.pop()
+        if type(node) is list:
+            stack.extend(node)
+        elif type(node) is not dict:
+            continue
+        elif 'from' in node:
+            if type(node['from']) is str:
+                yield node['from'], annotations.has_note(node, 'from')
+            for i, rel in enumerate(node['from'] if type(node['from']) is list else [node['from']]):
+                if type(rel) is str:
+                    if type(node['from']) is list:
+                        yield rel, annotations.has_note(node['from'], i)
+                elif type(rel) is dict and type(rel.get('value')) is str:
+                    yield rel, annotations.has_note(rel)
+                elif type(rel) is dict:
+                    stack.append(rel.get('value'))
+            if 'where' in node:
+                stack.append(node['where'])
+        elif len(node) > 0:
+            op = next(iter(node))
+            if op in COMPARISON_OPERATORS:
+                yield node, annotations.has_note(node)
+            stack.append(node[op])
+
+
+def connect_db(db_name, matched_plans=False, pause_gc=False):
+    db_uname, db_pass, db_host, db_port = import_config()
+    return open_db(db_name, db_uname, db_pass, db_host, db_port, matched_plans, pause_gc)
+
+
+default_pools = ConnectionPools(connect_db)
 
 
 def init_conn(db_name):
-    db_uname, db_pass, db_host, db_port = import_config()
-    conn = open_db(db_name, db_uname, db_pass, db_host, db_port)
-    return conn
+    """
+    A new connection to db_name, owned by the caller
+    """
+    return connect_db(db_name)
+
+
+def checkout_conn(db_name):
+    """
+    Check a connection to db_name out of its pool; hand it back with release_conn
+    """
+    return default_pools.get(db_name).getconn()
+
+
+def release_conn(conn):
+    default_pools.get(conn.info.dbname).putconn(conn)
+
+
+def db_connection(db_name):
+    """
+    Pooled connection to db_name for the duration of a with block
+    """
+    return default_pools.get(db_name).connection()
+
+
+class Annotator:
+    """
+    The caches and catalog annotation reads from, and the histograms its coverage is added to.
+    Matches of a query go to an Annotations table of their own and parse trees are never written
+    to past their copy-on-write view, so one Annotator can serve any number of threads.
+    """
+    def __init__(self, plan_cache=None, ast_cache=None, catalog=None, coverage=None):
+        self.plan_cache = default_plan_cache if plan_cache is None else plan_cache
+        self.ast_cache = default_ast_cache if ast_cache is None else ast_cache
+        self.catalog = default_catalog if catalog is None else catalog
+        self.coverage = default_coverage if coverage is None else coverage
+
+    def process(self, conn, query, stats: MatchStats = None):
+        """
+        :param stats: filled with the coverage of the annotation, which is also added to self.coverage
+        :return: formatted_query, annotation
+        """
+        stats = MatchStats() if stats is None else stats
+        with default_metrics.span('process'):
+            query = preprocess_query_string(query)
+            plan, relation_columns = self.explain(conn.cursor(), query)
+            result = self.annotate(query, plan, relation_columns, stats)
+        self.coverage.add(stats)
+        return result
+
+    def explain(self, cur, query):
+        """
+        Database stage: the execution plan of a preprocessed query and the columns of every relation
+        """
+        with default_metrics.span('explain'):
+            return get_cached_execution_plan(cur, query, self.plan_cache), self.catalog.relations(cur)
+
+    def annotate(self, query, plan, relation_columns, stats: MatchStats = None, annotations: Annotations = None):
+        """
+        CPU stage, needs no connection
+        :param stats: filled with the coverage of the annotation when given
+        :param annotations: filled with the matches when given
+        :return: formatted_query, annotation
+        """
+        annotations = Annotations() if annotations is None else annotations
+        parsed_query = self.match(query, plan, relation_columns, stats, annotations)
+        result = []
+        with default_metrics.span('reparse'):
+            reparse_query(result, parsed_query, annotations)
+        return [q['statement'] for q in result], [q['annotation'] for q in result]
+
+    def annotate_lines(self, query, plan, relation_columns, stats: MatchStats = None):
+        """
+        annotate for rendering as the output is produced: the query is matched before this returns,
+        formatting happens as the lines are consumed
+        :return: generator of (statement, annotation)
+        """
+        annotations = Annotations()
+        return reparse_lines(self.match(query, plan, relation_columns, stats, annotations), annotations)
+
+    def match(self, query, plan, relation_columns, stats: MatchStats, annotations: Annotations):
+        """
+        :return: the parse tree of query, its matches to plan recorded in annotations
+        """
+        with default_metrics.span('parse'):
+            parsed_query = self.ast_cache.parse(query)
+        with default_metrics.span('preprocess'):
+            preprocess_query_tree(None, parsed_query, relation_columns=relation_columns)
+        with default_metrics.span('match'):
+            transverse_query(parsed_query, plan[0][0]['Plan'], stats, annotations)
+        return parsed_query
+
+
+default_annotator = Annotator()
 
 
-def process(conn, query):
+def process(conn, query, stats: MatchStats = None):
     """
     process given query, returned formatted query with its annotation
     :param conn:
     :param query:
+    :param stats: filled with the coverage of the annotation, which is also added to default_coverage
+    :return: formatted_query, annotation
+    """
+    stats = MatchStats() if stats is None else stats
+    with default_metrics.span('process'):
+        cur = conn.cursor()
+        query = preprocess_query_string(query)
+        plan, relation_columns = explain_query(cur, query)
+        result = annotate_plan(query, plan, relation_columns, stats)
+    default_coverage.add(stats)
+    return result
+
+
+def explain_query(cur, query):
+    """
+    Database stage of process, see Annotator.explain
+    """
+    return default_annotator.explain(cur, query)
+
+
+def explain_chunk(pool, chunk):
+    """
+    Run the database stage for a chunk of (index, query) on one pooled connection
+    :return: (item, (plan, relation_columns)) per query, the second part None if the query failed
+    """
+    explained = []
+    with pool.connection() as conn:
+        cur = conn.cursor()
+        for index, query in chunk:
+            item = {'index': index, 'query': query, 'statements': None, 'annotations': None, 'error': None,
+                    'stats': None}
+            try:
+                explained.append((item, explain_query(cur, query)))
+            except Exception as e:
+                item['error'] = e
+                explained.append((item, None))
+    return explained
+
+
+def annotate_plan(query, plan, relation_columns, stats: MatchStats = None):
+    """
+    CPU stage of process, see Annotator.annotate
+    """
+    return default_annotator.annotate(query, plan, relation_columns, stats)
+
+
+def annotate_lines(query, plan, relation_columns, stats: MatchStats = None):
+    """
+    annotate_plan as a generator of (statement, annotation), see Annotator.annotate_lines
+    """
+    return default_annotator.annotate_lines(query, plan, relation_columns, stats)
+
+
+def annotate_chunk(jobs):
+    """
+    Run annotate_plan over a list of (query, plan, relation_columns); safe to ship to another process
+    :return: (statements, annotations, error, MatchStats) per job
+    """
+    results = []
+    for query, plan, relation_columns in jobs:
+        stats = MatchStats()
+        try:
+            results.append(annotate_plan(query, plan, relation_columns, stats) + (None, stats))
+        except Exception as e:
+            results.append((None, None, picklable_error(e), stats))
+    return results
+
+
+def annotate_chunk_traced(jobs):
+    """
+    annotate_chunk in a worker process, which has metrics of its own
+    :return: annotate_chunk's results and the record of the spans and counters they took
+    """
+    default_metrics.enable()
+    with default_metrics.trace('annotate_chunk') as trace:
+        results = annotate_chunk(jobs)
+    return results, trace.record()
+
+
+def submit_chunk(executor, jobs, processes=False):
+    """
+    Submit annotate_chunk to a cpu_executor. While metrics are enabled, what worker processes
+    record comes back with their results and is merged into default_metrics.
+    :return: Future of annotate_chunk's results
+    """
+    if not (processes and default_metrics.enabled):
+        return executor.submit(annotate_chunk, jobs)
+    done = Future()
+
+    def merged(future):
+        if future.exception() is not None:
+            done.set_exception(future.exception())
+            return
+        results, record = future.result()
+        default_metrics.merge(record)
+        done.set_result(results)
+
+    executor.submit(annotate_chunk_traced, jobs).add_done_callback(merged)
+    return done
+
+
+def picklable_error(e):
+    try:
+        pickle.loads(pickle.dumps(e))
+        return e
+    except Exception:
+        return RuntimeError(f'{type(e).__name__}: {e}')
+
+
+def warm_up_worker(log_level=logging.WARNING):
+    """
+    Runs once in every worker process, so mo_sql_parsing builds its grammar before the first real query
+    """
+    logging.getLogger().setLevel(log_level)
+    parse('SELECT a FROM t WHERE a = 1')
+
+
+def load_plan(document):
+    """
+    Accept EXPLAIN (VERBOSE, FORMAT JSON) output, an auto_explain JSON entry or a bare plan node
+    :return: the plan in the shape get_query_execution_plan returns it
+    """
+    if type(document) is list and len(document) > 0:
+        document = document[0]
+    if type(document) is dict and type(document.get('Plan')) is dict:
+        return [[{'Plan': document['Plan']}]]
+    if type(document) is dict and 'Node Type' in document:
+        return [[{'Plan': document}]]
+    raise ValueError('not an EXPLAIN (FORMAT JSON) document')
+
+
+def process_offline(query, plan_document, relation_columns, stats: MatchStats = None):
+    """
+    Annotate with a saved plan and a schema snapshot (see catalog.load_snapshot), no database needed.
+    The plan should come from EXPLAIN VERBOSE (or auto_explain.log_verbose) so its columns are qualified.
     :return: formatted_query, annotation
     """
-    cur = conn.cursor()
     query = preprocess_query_string(query)
-    plan = get_query_execution_plan(cur, query)
-    parsed_query = parse(query)
-    preprocess_query_tree(cur, parsed_query)
-    transverse_query(parsed_query, plan[0][0]['Plan'])
-    result = []
-    reparse_query(result, parsed_query)
-    return [q['statement'] for q in result], [q['annotation'] for q in result]
+    return annotate_plan(query, load_plan(plan_document), relation_columns, stats)
 
 
-def reparse_without_expand(statement_dict):
-    temp = []
-    annotation = get_annotation(statement_dict)
-    if 'ann' in statement_dict.keys():
-        del statement_dict['ann']
-    statement = format(statement_dict)
-    temp.append(format_query(statement, annotation))
-    return temp
+def cpu_executor(jobs, processes=False):
+    """
+    Executor for annotate_chunk: worker threads, or worker processes with the grammar built up front
+    """
+    if processes:
+        # spawn rather than fork, the caller may have threads holding locks
+        return ProcessPoolExecutor(jobs, multiprocessing.get_context('spawn'),
+                                   initializer=warm_up_worker, initargs=(logging.getLogger().level,))
+    return ThreadPoolExecutor(jobs)
 
 
-def format_keyword_special(statement_dict):
-    formatted = format(statement_dict)
-    return formatted.split('""', 1)[1].strip()
+def process_many(db_name, queries, jobs=4, connections=4, ordered=True, pools=None, processes=False, chunksize=1):
+    """
+    Annotate an iterable of queries against db_name. EXPLAIN and catalog lookups run on up to
+    `connections` pooled connections while parsing and matching run on `jobs` workers,
+    so the stages of consecutive chunks overlap. At most 2 * (jobs + connections) chunks are in flight.
+    :param ordered: yield results in input order, else as their chunk completes
+    :param processes: run the CPU stage in worker processes instead of threads; only plans and
+        catalog data are sent to them, so larger chunks amortize the pickling
+    :param chunksize: number of queries explained and annotated together
+    :return: generator of dicts with index, query, statements, annotations, error (None on success) and
+        stats, the MatchStats of the annotation (None if it never ran); stats are also added to default_coverage
+    """
+    pool = (pools or default_pools).get(db_name)
+    window = 2 * (jobs + connections)
+    completed = queue.Queue()
+    # db_workers shuts down first, its callbacks may still hand work to cpu_workers
+    with cpu_executor(jobs, processes) as cpu_workers, ThreadPoolExecutor(connections) as db_workers:
+        def start(chunk):
+            done = Future()
+            if not ordered:
+                done.add_done_callback(completed.put)
+
+            def explained(future):
+                if future.exception() is not None:
+                    items = [{'index': index, 'query': query, 'statements': None, 'annotations': None,
+                              'error': future.exception(), 'stats': None} for index, query in chunk]
+                    done.set_result(items)
+                    return
+                items = [item for item, _ in future.result()]
+                pending = [item for item, result in future.result() if result is not None]
+                work = [(item['query'],) + result for item, result in future.result() if result is not None]
+
+                def annotated(future):
+                    if future.exception() is not None:
+                        for item in pending:
+                            item['error'] = future.exception()
+                    else:
+                        for item, (statements, annotations, error, stats) in zip(pending, future.result()):
+                            item['statements'], item['annotations'], item['error'] = statements, annotations, error
+                            item['stats'] = stats
+                            default_coverage.add(stats)
+                    done.set_result(items)
+
+                submit_chunk(cpu_workers, work, processes).add_done_callback(annotated)
+
+            if not processes:
+                for _, query in chunk:
+                    cpu_workers.submit(default_ast_cache.parse, query)  # parse while EXPLAIN is in flight
+            db_workers.submit(explain_chunk, pool, chunk).add_done_callback(explained)
+            return done
+
+        in_flight = deque()
+        indexed = ((index, preprocess_query_string(query)) for index, query in enumerate(queries))
+        for chunk in iter(lambda: list(itertools.islice(indexed, chunksize)), []):
+            in_flight.append(start(chunk))
+            while len(in_flight) >= window:
+                yield from _next_done(in_flight, completed, ordered)
+        while in_flight:
+            yield from _next_done(in_flight, completed, ordered)
+
+
+def _next_done(in_flight, completed, ordered):
+    if ordered:
+        yield from in_flight.popleft().result()
+    else:
+        done = completed.get()
+        in_flight.remove(done)
+        yield from done.result()
 
 
-def get_annotation(statement_dict):
-    return '' if 'ann' not in statement_dict.keys() else statement_dict['ann']
+def reparse_without_expand(statement_dict, annotations: Annotations = NO_ANNOTATIONS):
+    temp = []
+    annotation = annotations.note(statement_dict)
+    temp.append(format_query(sql(statement_dict), annotation))
+    return temp
 
 
 def get_name(statement_dict):
@@ -400,23 +836,16 @@ def reparse_literal(value: any):
     if type(value) is str:
         return "'" + value + "'"
     elif type(value) is list:
-        res = '('
-        for i, v in enumerate(value):
-            res += "'" + v + "'"
-            if i < len(value) - 1:
-                res += ', '
-            else:
-                res += ')'
-        return res
+        return '(' + ', '.join("'" + v + "'" for v in value) + ')'
     else:
         raise NotImplementedError(f"literal type - {value}")
 
 
-def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str):
+def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     symbol_ops = {'mul': '*', 'sub': '-', 'add': '+', 'div': '/', 'mod': '%'}
@@ -431,7 +860,7 @@ def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str):
                 arithmetic_op = find_arithmetic_operation(operand)
                 datetime_op = find_datetime_operation(operand)
                 if arithmetic_op is not None:
-                    subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+                    subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
                     if len(subquery) > 1:
                         statement += '('
                         temp.append(format_query(statement))
@@ -443,7 +872,7 @@ def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str):
 
                     statement = ''
                 elif datetime_op is not None:
-                    subquery = reparse_datetime_operation(operand, datetime_op)
+                    subquery = reparse_datetime_operation(operand, datetime_op, annotations)
                     statement += '('
                     if len(subquery) == 1:
                         statement += subquery[0]['statement']
@@ -455,7 +884,7 @@ def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str):
                         temp.append(format_query(')'))
                     statement = ''
                 else:
-                    subquery = reparse_other_operations(operand)
+                    subquery = reparse_other_operations(operand, annotations)
                     statement += '(' + subquery + ')'
                     temp.append(format_query(statement))
                     statement = ''
@@ -471,11 +900,11 @@ def reparse_arithmetic_operation(statement_dict: dict, symbol_op: str):
     return temp
 
 
-def reparse_keyword_operation(statement_dict: dict, op: str, comma: bool = False):
+def reparse_keyword_operation(statement_dict: dict, op: str, comma: bool = False, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     operand = statement_dict[op]
@@ -490,10 +919,10 @@ def reparse_keyword_operation(statement_dict: dict, op: str, comma: bool = False
         temp.append(format_query(op.upper() + ' ('))
 
         if arithmetic_op is not None:
-            subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+            subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
             temp.extend(subquery)
         else:
-            subquery = reparse_other_operations(operand)
+            subquery = reparse_other_operations(operand, annotations)
             temp.append(format_query(subquery))
 
         end_statement = ')'
@@ -504,33 +933,45 @@ def reparse_keyword_operation(statement_dict: dict, op: str, comma: bool = False
     return temp
 
 
-def reparse_conjunction_operation(statement_dict: dict, conj_op: str):
+def reparse_conjunction_operation(statement_dict: dict, conj_op: str, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
+    for subquery in reparse_conjuncts(statement_dict, conj_op, annotations):
+        temp.extend(subquery)
+
+    return temp
+
+
+def reparse_conjuncts(statement_dict: dict, conj_op: str, annotations: Annotations = NO_ANNOTATIONS):
+    """
+    :return: generator of the formatted lines of each operand of an expanded AND or OR,
+        the conjunction following all but the last
+    """
     operands = statement_dict[conj_op]
     assert type(operands) is list
 
     for i, operand in enumerate(operands):
+        temp = []
         arithmetic_op = find_arithmetic_operation(operand)
         conjunction_op = find_conjunction_operation(operand)
         comparison_op = find_comparison_operation(operand)
 
         if arithmetic_op is not None:
             temp.append(format_query('('))
-            subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+            subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
             temp.extend(subquery)
             temp.append(format_query(')'))
         elif conjunction_op is not None:
             temp.append(format_query('('))
-            subquery = reparse_conjunction_operation(operand, conjunction_op)
+            subquery = reparse_conjunction_operation(operand, conjunction_op, annotations)
             temp.extend(subquery)
             temp.append(format_query(')'))
         elif comparison_op is not None:
-            subquery = reparse_comparison_operation(operand, comparison_op)
+            subquery = reparse_comparison_operation(operand, comparison_op, annotations)
             if len(subquery) > 1:
                 temp.append(format_query('('))
                 temp.extend(subquery)
@@ -539,31 +980,30 @@ def reparse_conjunction_operation(statement_dict: dict, conj_op: str):
                 temp.extend(subquery)
         elif 'exists' in operand.keys():
             temp.append(format_query('('))
-            subquery = reparse_exists_keyword(operand)
+            subquery = reparse_exists_keyword(operand, annotations)
             temp.extend(subquery)
             temp.append(format_query(')'))
         elif 'not' in operand.keys():
             temp.append(format_query('('))
-            subquery = reparse_not_operation(operand)
+            subquery = reparse_not_operation(operand, annotations)
             temp.extend(subquery)
             temp.append(format_query(')'))
         else:
             temp.append(format_query('('))
-            subquery = reparse_other_operations(operand)
+            subquery = reparse_other_operations(operand, annotations)
             temp.append(format_query(subquery))
             temp.append(format_query(')'))
 
         if i < len(operands) - 1:
             temp.append(format_query(conj_op.upper()))
-
-    return temp
+        yield temp
 
 
-def reparse_not_operation(statement_dict: dict):
+def reparse_not_operation(statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     operand = statement_dict['not']
@@ -574,30 +1014,30 @@ def reparse_not_operation(statement_dict: dict):
 
     temp.append(format_query('NOT ('))
     if arithmetic_op is not None:
-        subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+        subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
         temp.extend(subquery)
     elif conjunction_op is not None:
-        subquery = reparse_conjunction_operation(operand, conjunction_op)
+        subquery = reparse_conjunction_operation(operand, conjunction_op, annotations)
         temp.extend(subquery)
     elif comparison_op is not None:
-        subquery = reparse_comparison_operation(operand, comparison_op)
+        subquery = reparse_comparison_operation(operand, comparison_op, annotations)
         temp.extend(subquery)
     elif 'exists' in operand.keys():
-        subquery = reparse_exists_keyword(operand)
+        subquery = reparse_exists_keyword(operand, annotations)
         temp.extend(subquery)
     else:
-        subquery = reparse_other_operations(operand)
+        subquery = reparse_other_operations(operand, annotations)
         temp.append(format_query(subquery))
 
     temp.append(format_query(')'))
     return temp
 
 
-def reparse_comparison_operation(statement_dict: dict, comp_op: str):
+def reparse_comparison_operation(statement_dict: dict, comp_op: str, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     comp_ops = {
@@ -613,7 +1053,7 @@ def reparse_comparison_operation(statement_dict: dict, comp_op: str):
         'nin': 'NOT IN'
     }
 
-    annotation = get_annotation(statement_dict)
+    annotation = annotations.note(statement_dict)
     operands = statement_dict[comp_op]
 
     # size of list must be 2
@@ -638,15 +1078,15 @@ def reparse_comparison_operation(statement_dict: dict, comp_op: str):
                     statement = ''
 
                     if 'select' in operand.keys():
-                        reparse_query(temp, operand)
+                        reparse_query(temp, operand, annotations)
                     elif arithmetic_op is not None:
-                        subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+                        subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
                         temp.extend(subquery)
                     elif datetime_op is not None:
-                        subquery = reparse_datetime_operation(operand, datetime_op)
+                        subquery = reparse_datetime_operation(operand, datetime_op, annotations)
                         temp.extend(subquery)
                     else:
-                        subquery = reparse_other_operations(operand)
+                        subquery = reparse_other_operations(operand, annotations)
                         temp.append(format_query(subquery))
 
                     temp.append(format_query(')'))
@@ -665,11 +1105,11 @@ def reparse_comparison_operation(statement_dict: dict, comp_op: str):
     return temp
 
 
-def reparse_datetime_operation(statement_dict: dict, datetime_op: str):
+def reparse_datetime_operation(statement_dict: dict, datetime_op: str, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     operand = statement_dict[datetime_op]
@@ -685,35 +1125,35 @@ def reparse_datetime_operation(statement_dict: dict, datetime_op: str):
     return temp
 
 
-def reparse_other_operations(statement_dict: dict):
-    if 'expand' in statement_dict.keys():
+def reparse_other_operations(statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
+    if annotations.is_expanded(statement_dict):
         raise NotImplementedError(f"operation - {statement_dict}")
     else:
-        return format(statement_dict)
+        return sql(statement_dict)
 
 
-def reparse_exists_keyword(statement_dict: dict):
+def reparse_exists_keyword(statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     operand = statement_dict['exists']
 
     if type(operand) is dict:
         temp.append(format_query('EXISTS ('))
-        reparse_query(temp, operand)
+        reparse_query(temp, operand, annotations)
         temp.append(format_query(')'))
 
     return temp
 
 
-def reparse_between_keyword(statement_dict: dict):
+def reparse_between_keyword(statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
-    if 'expand' not in statement_dict.keys():
-        temp.extend(reparse_without_expand(statement_dict))
+    if not annotations.is_expanded(statement_dict):
+        temp.extend(reparse_without_expand(statement_dict, annotations))
         return temp
 
     operand = statement_dict['between']
@@ -727,7 +1167,7 @@ def reparse_between_keyword(statement_dict: dict):
 
             if arithmetic_op is not None:
                 temp.append(format_query('('))
-                subquery = reparse_arithmetic_operation(operand, arithmetic_op)
+                subquery = reparse_arithmetic_operation(operand, arithmetic_op, annotations)
                 temp.extend(subquery)
                 temp.append(format_query(')'))
             elif 'literal' in op:
@@ -743,19 +1183,23 @@ def format_query(statement: str, annotation: str = ''):
     return {'statement': statement, 'annotation': annotation}
 
 
-def reparse_from_keyword(formatted_query: list, identifier: any, last_identifier: bool = True):
+def reparse_from_keyword(formatted_query: list, identifier: any, last_identifier: bool = True,
+                         annotations: Annotations = NO_ANNOTATIONS, slot: tuple = None):
+    """
+    :param slot: (container, key) holding identifier, where the annotation of a bare relation name is kept
+    """
     temp = []
 
     if type(identifier) is dict:
         name = get_name(identifier)
-        annotation = get_annotation(identifier)
+        annotation = annotations.note(identifier)
         end_statement = ''
 
         if type(identifier['value']) is str:
             end_statement = identifier['value']
         elif type(identifier['value']) is dict:
             temp.append(format_query('('))
-            reparse_query(temp, identifier['value'])
+            reparse_query(temp, identifier['value'], annotations)
             end_statement = ')'
 
         if name is not None:
@@ -770,15 +1214,15 @@ def reparse_from_keyword(formatted_query: list, identifier: any, last_identifier
         if not last_identifier:
             statement += ','
 
-        temp.append(format_query(statement))
+        temp.append(format_query(statement, '' if slot is None else annotations.note(*slot)))
     elif type(identifier) is list:
         for i, single_identifier in enumerate(identifier):
-            reparse_from_keyword(temp, single_identifier, i == len(identifier) - 1)
+            reparse_from_keyword(temp, single_identifier, i == len(identifier) - 1, annotations, (identifier, i))
 
     formatted_query.extend(temp)
 
 
-def reparse_where_keyword(formatted_query: list, identifier: any):
+def reparse_where_keyword(formatted_query: list, identifier: any, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
     assert type(identifier) is dict
 
@@ -786,69 +1230,86 @@ def reparse_where_keyword(formatted_query: list, identifier: any):
     comparison_op = find_comparison_operation(identifier)
 
     if conjunction_op is not None:
-        subquery = reparse_conjunction_operation(identifier, conjunction_op)
+        subquery = reparse_conjunction_operation(identifier, conjunction_op, annotations)
         temp.extend(subquery)
     elif comparison_op is not None:
-        subquery = reparse_comparison_operation(identifier, comparison_op)
+        subquery = reparse_comparison_operation(identifier, comparison_op, annotations)
         temp.extend(subquery)
     elif 'exists' in identifier.keys():
-        subquery = reparse_exists_keyword(identifier)
+        subquery = reparse_exists_keyword(identifier, annotations)
         temp.extend(subquery)
     elif 'not' in identifier.keys():
-        subquery = reparse_not_operation(identifier)
+        subquery = reparse_not_operation(identifier, annotations)
         temp.extend(subquery)
     else:
-        subquery = reparse_other_operations(identifier)
+        subquery = reparse_other_operations(identifier, annotations)
         temp.append(format_query(subquery))
 
     formatted_query.extend(temp)
 
 
-def reparse_keyword_without_annotation(formatted_query: list, identifier: any):
-    formatted_query.append(format_query(format_keyword_special(identifier)))
+def reparse_keyword_without_annotation(formatted_query: list, keyword: str, identifier: any):
+    formatted_query.append(format_query(clause(keyword, identifier)))
 
 
-def reparse_query(formatted_query: list, statement_dict: dict):
+def reparse_query(formatted_query: list, statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
     temp = []
 
     for keyword, identifier in statement_dict.items():
-        if keyword.startswith('select'):
-            appended_identifier = {keyword: identifier}
-            if 'distinct_on' in statement_dict.keys():
-                appended_identifier['distinct_on'] = statement_dict['distinct_on']
-            temp.append(format_query(format(appended_identifier)))
-        elif keyword == 'from':
-            temp.append(format_query('FROM'))
-            reparse_from_keyword(temp, identifier)
-        elif keyword == 'where':
-            temp.append(format_query('WHERE'))
-            reparse_where_keyword(temp, identifier)
-        elif keyword == 'having':
-            temp.append(format_query('HAVING'))
-            reparse_where_keyword(temp, identifier)
-        elif keyword == 'groupby':
-            appended_identifier = {'groupby': identifier, 'from': ''}
-            reparse_keyword_without_annotation(temp, appended_identifier)
-        elif keyword == 'orderby':
-            appended_identifier = {'orderby': identifier, 'from': ''}
-            reparse_keyword_without_annotation(temp, appended_identifier)
-        elif keyword == 'limit':
-            appended_identifier = {'limit': identifier, 'from': ''}
-            reparse_keyword_without_annotation(temp, appended_identifier)
+        for subquery in reparse_clause(statement_dict, keyword, identifier, annotations):
+            temp.extend(subquery)
 
     formatted_query.extend(temp)
 
 
-def annotate_query(parsed_query: dict):
+def reparse_clause(statement_dict: dict, keyword: str, identifier: any, annotations: Annotations = NO_ANNOTATIONS):
+    """
+    :return: generator of the formatted lines of one clause of statement_dict, a FROM list a relation
+        at a time and an expanded AND or OR an operand at a time
+    """
+    temp = []
+    if keyword.startswith('select'):
+        temp.append(format_query(clause(keyword, identifier, statement_dict.get('distinct_on'))))
+    elif keyword == 'from':
+        yield [format_query('FROM')]
+        if type(identifier) is list:
+            for i, single_identifier in enumerate(identifier):
+                temp = []
+                reparse_from_keyword(temp, single_identifier, i == len(identifier) - 1, annotations, (identifier, i))
+                yield temp
+            return
+        reparse_from_keyword(temp, identifier, True, annotations, (statement_dict, 'from'))
+    elif keyword in ['where', 'having']:
+        yield [format_query(keyword.upper())]
+        conjunction_op = find_conjunction_operation(identifier) if type(identifier) is dict else None
+        if conjunction_op is not None and annotations.is_expanded(identifier):
+            yield from reparse_conjuncts(identifier, conjunction_op, annotations)
+            return
+        reparse_where_keyword(temp, identifier, annotations)
+    elif keyword in ['groupby', 'orderby', 'limit']:
+        reparse_keyword_without_annotation(temp, keyword, identifier)
+    yield temp
+
+
+def reparse_lines(statement_dict: dict, annotations: Annotations = NO_ANNOTATIONS):
+    """
+    reparse_query as a generator of (statement, annotation), holding one clause, FROM relation
+    or top-level condition at a time
+    """
+    for keyword, identifier in statement_dict.items():
+        for subquery in reparse_clause(statement_dict, keyword, identifier, annotations):
+            for line in subquery:
+                yield line['statement'], line['annotation']
+
+
+def annotate_query(parsed_query: dict, annotations: Annotations = NO_ANNOTATIONS):
     formatted_query = []
-    reparse_query(formatted_query, parsed_query)
+    reparse_query(formatted_query, parsed_query, annotations)
     return formatted_query
 
 
 def main():
     logging.basicConfig(filename='log/debug.log', filemode='w', level=logging.DEBUG)
-    conn = init_conn("TPC-H")
-    cur = conn.cursor()
 
     queries = [
         # Test cases
@@ -890,30 +1351,16 @@ ORDER BY S_ACCTBAL DESC, N_NAME, S_NAME, P_PARTKEY
 LIMIT 100;""",
     ]
 
-    for query in queries:
+    for item in process_many("TPC-H", queries):
         print("==========================")
-        query = preprocess_query_string(query)  # assume all queries are case insensitive
-        logging.debug(query)
-        plan = get_query_execution_plan(cur, query)
-        parsed_query = parse(query)
-        try:
-            preprocess_query_tree(cur, parsed_query)
-            transverse_query(parsed_query, plan[0][0]['Plan'])
-            result = []
-            reparse_query(result, parsed_query)
-        except Exception as e:
-            logging.error(e, exc_info=True)
-            logging.debug(pformat(query))
-            logging.debug(pformat(parsed_query))
-            logging.debug(pformat(plan))
-            raise e
-        else:
-            pprint(parsed_query, sort_dicts=False)
-            pprint(result)
+        if item['error'] is not None:
+            logging.error(item['error'], exc_info=item['error'])
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(pformat(item['query']))
+            raise item['error']
+        pprint(list(zip(item['statements'], item['annotations'])))
         print()
 
-    cur.close()
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,139 @@
+import logging
+import time
+
+from mo_sql_parsing import parse
+
+from catalog import database_key
+from metrics import default_metrics
+from plan_json import plan_decoder
+from util import LRUCache
+
+# Hash of the settings that steer the planner, and the newest ANALYZE across user tables
+PLANNER_STATE_QUERY = """
+SELECT
+(SELECT md5(string_agg(name || '=' || setting, ',' ORDER BY name)) FROM pg_catalog.pg_settings
+ WHERE category LIKE 'Query Tuning%'),
+(SELECT max(greatest(last_analyze, last_autoanalyze))::text FROM pg_catalog.pg_stat_user_tables)
+"""
+
+
+def normalize_query(sql_query):
+    return ' '.join(sql_query.split()).rstrip(';').rstrip()
+
+
+class PlanCache:
+    """
+    EXPLAIN results keyed by database, plan decoder (see plan_json.plan_decoder), planner state and
+    normalized query text.
+    The planner state (settings hash and last analyze time) is part of the key, so plans
+    made before a setting change or a fresh ANALYZE are never served again; it is re-read
+    from the server at most once every check_interval seconds.
+    """
+    def __init__(self, maxsize=512, ttl=3600.0, check_interval=30.0):
+        self.check_interval = check_interval
+        self._plans = LRUCache(maxsize, ttl)
+        self._states = LRUCache(64)
+
+    def get_plan(self, cursor, sql_query, explain):
+        key = (database_key(cursor), plan_decoder(cursor), self.planner_state(cursor), normalize_query(sql_query))
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = explain(cursor, sql_query)
+            self._plans.put(key, plan)
+        return plan
+
+    def planner_state(self, cursor):
+        db = database_key(cursor)
+        state = self._states.get(db)
+        if state is not None and time.monotonic() - state[1] < self.check_interval:
+            return state[0]
+        with default_metrics.span('db.planner_state'):
+            cursor.execute(PLANNER_STATE_QUERY)
+            current = tuple(cursor.fetchone())
+        if state is not None and state[0] != current:
+            logging.debug('planner state of %s changed, dropping its cached plans', db)
+            self._plans.prune(lambda key: key[0] == db)
+        self._states.put(db, (current, time.monotonic()))
+        return current
+
+    def clear(self):
+        self._plans.clear()
+        self._states.clear()
+
+    def stats(self):
+        return self._plans.stats()
+
+
+def writable_nodes(node, writable):
+    """
+    Collect the ids of containers that processing a query may write to, plus their ancestors.
+    preprocess_query_tree renames bare column strings wherever they appear; annotations are
+    kept outside the tree (see annotation.Annotations).
+    :return: whether node itself is writable
+    """
+    must_copy = False
+    if type(node) is dict:
+        items = node.items()
+    elif type(node) is list:
+        items = ((None, v) for v in node)
+    else:
+        return False
+    for key, val in items:
+        if key in ['literal', 'interval']:
+            continue
+        if type(val) is str:
+            must_copy |= '.' not in val
+        elif type(val) in [dict, list]:
+            must_copy |= writable_nodes(val, writable)
+    if must_copy:
+        writable.add(id(node))
+    return must_copy
+
+
+def copy_writable(node, writable):
+    if id(node) not in writable:
+        return node
+    if type(node) is dict:
+        return {key: copy_writable(val, writable) for key, val in node.items()}
+    return [copy_writable(val, writable) for val in node]
+
+
+class AstCache:
+    """
+    mo_sql_parsing parse trees keyed by normalized query text. The cached tree is never handed
+    out: each caller gets a copy-on-write view in which only the containers on a path to a
+    possible write are fresh, and every other subtree and leaf is shared with the cache.
+    Memory is bounded by the total number of containers held.
+    """
+    def __init__(self, maxsize=1024, max_nodes=500000):
+        self._trees = LRUCache(maxsize, weigh=lambda entry: entry[2], maxweight=max_nodes)
+
+    def parse(self, sql_query):
+        key = normalize_query(sql_query)
+        entry = self._trees.get(key)
+        if entry is None:
+            tree = parse(sql_query)
+            writable = set()
+            writable_nodes(tree, writable)
+            writable.add(id(tree))
+            entry = (tree, frozenset(writable), count_nodes(tree))
+            self._trees.put(key, entry)
+        return copy_writable(entry[0], entry[1])
+
+    def clear(self):
+        self._trees.clear()
+
+    def stats(self):
+        return self._trees.stats()
+
+
+def count_nodes(node):
+    if type(node) is dict:
+        return 1 + sum(count_nodes(v) for v in node.values())
+    if type(node) is list:
+        return 1 + sum(count_nodes(v) for v in node)
+    return 0
+
+
+default_plan_cache = PlanCache()
+default_ast_cache = AstCache()
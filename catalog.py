@@ -0,0 +1,103 @@
+import json
+import logging
+import time
+
+from metrics import default_metrics
+from util import LRUCache
+
+# Every user-visible relation with its live columns, in one round trip
+COLUMNS_QUERY = """
+SELECT c.relname, a.attname
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_catalog.pg_attribute a ON a.attrelid = c.oid
+WHERE c.relkind IN ('r', 'v', 'm', 'p', 'f')
+AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY c.relname, a.attnum
+"""
+
+# Any CREATE/DROP/ALTER touching columns inserts, deletes or rewrites pg_attribute rows,
+# so the row count and newest xmin together change whenever the column catalog does
+WATERMARK_QUERY = "SELECT count(*), max(xmin::text::bigint) FROM pg_catalog.pg_attribute"
+
+
+def database_key(cur):
+    info = cur.connection.info
+    return info.host, info.port, info.dbname
+
+
+class Schema:
+    def __init__(self, relations, watermark):
+        self.relations = relations
+        self.watermark = watermark
+        self.checked_at = time.monotonic()
+
+
+class SchemaCatalog:
+    """
+    Per-database relation -> columns mapping, loaded with a single pg_catalog query.
+    Databases are evicted least-recently-used, and a cached schema is only revalidated
+    against the DDL watermark once every check_interval seconds.
+    """
+    def __init__(self, max_databases=8, check_interval=30.0):
+        self.check_interval = check_interval
+        self._schemas = LRUCache(max_databases)
+
+    def relations(self, cur):
+        key = database_key(cur)
+        schema = self._schemas.get(key)
+        if schema is not None and time.monotonic() - schema.checked_at < self.check_interval:
+            return schema.relations
+        watermark = self._watermark(cur)
+        if schema is not None and schema.watermark == watermark:
+            schema.checked_at = time.monotonic()
+            return schema.relations
+        logging.debug('loading schema catalog for %s', key)
+        schema = Schema(self._load(cur), watermark)
+        self._schemas.put(key, schema)
+        return schema.relations
+
+    def invalidate(self, cur=None):
+        if cur is None:
+            self._schemas.clear()
+        else:
+            self._schemas.pop(database_key(cur))
+
+    def stats(self):
+        return self._schemas.stats()
+
+    @staticmethod
+    def _watermark(cur):
+        with default_metrics.span('db.catalog_watermark'):
+            cur.execute(WATERMARK_QUERY)
+            return tuple(cur.fetchone())
+
+    @staticmethod
+    def _load(cur):
+        with default_metrics.span('db.catalog'):
+            cur.execute(COLUMNS_QUERY)
+            rows = cur.fetchall()
+        relations = {}
+        for rel, col in rows:
+            columns = relations.setdefault(rel, [])
+            if col not in columns:  # same relation name in several schemas
+                columns.append(col)
+        return {rel: tuple(columns) for rel, columns in relations.items()}
+
+
+def save_snapshot(relations, path):
+    """
+    Write a relation -> columns mapping to a JSON file, for annotating without a database
+    """
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'relations': {rel: list(columns) for rel, columns in relations.items()}}, f, indent=1)
+
+
+def load_snapshot(path):
+    with open(path, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    return {rel: tuple(columns) for rel, columns in snapshot['relations'].items()}
+
+
+default_catalog = SchemaCatalog()
@@ -0,0 +1,281 @@
+"""
+Annotate SQL without the GUI, writing one JSON object per statement, e.g.
+python cli.py --db TPC-H queries/ nightly.sql > annotated.jsonl
+cat nightly.sql | python cli.py --db TPC-H --jobs 8 --fail-fast
+
+Without a database, from saved plans and a schema snapshot:
+python cli.py --db TPC-H --save-schema tpch.json
+python cli.py --schema tpch.json plans/ > annotated.jsonl
+where every plan file holds {"query": ..., "plan": EXPLAIN (VERBOSE, FORMAT JSON) output}
+or an auto_explain JSON entry with "Query Text" and "Plan"; .jsonl files and stdin hold one per line.
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+from collections import deque
+from functools import partial
+
+from annotation import connect_db, cpu_executor, db_connection, load_plan, process_many, submit_chunk
+from catalog import default_catalog, load_snapshot, save_snapshot
+from match_stats import default_coverage
+from metrics import default_metrics
+from plan_json import gc_paused, loads
+from pool import ConnectionPools
+from preprocessing import preprocess_query_string
+
+STATEMENT_END = ';'
+
+
+def split_statements(lines):
+    """
+    Split SQL text into statements on semicolons outside quotes and comments
+    :param lines: iterable of lines, read lazily
+    :return: generator of statement text, comments and surrounding whitespace removed
+    """
+    statement = []
+    quote = None  # the character closing the current quoted string, '*/' in a block comment
+    for line in lines:
+        i = 0
+        while i < len(line):
+            c = line[i]
+            if quote == '*/':
+                if line.startswith('*/', i):
+                    quote = None
+                    i += 1
+            elif quote is not None:
+                statement.append(c)
+                if c == quote:
+                    quote = None
+            elif line.startswith('--', i):
+                statement.append('\n')
+                break
+            elif line.startswith('/*', i):
+                statement.append(' ')
+                quote = '*/'
+                i += 1
+            elif c == STATEMENT_END:
+                text = ''.join(statement).strip()
+                if text:
+                    yield text
+                statement = []
+            else:
+                statement.append(c)
+                if c in ['"', "'"]:
+                    quote = c
+            i += 1
+    text = ''.join(statement).strip()
+    if text:
+        yield text
+
+
+def sql_files(paths, pattern='.sql'):
+    """
+    Expand directories into the files below them ending with pattern, in name order; '-' is stdin
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(pattern):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_statements(paths, pattern='.sql'):
+    """
+    :return: generator of (source, statement number within source, statement text)
+    """
+    for path in sql_files(paths, pattern):
+        if path == '-':
+            yield from ((path, n, text) for n, text in enumerate(split_statements(sys.stdin)))
+            continue
+        with open(path, encoding='utf-8') as f:
+            yield from ((path, n, text) for n, text in enumerate(split_statements(f)))
+
+
+def decoded(text):
+    """
+    :return: the JSON document in text, or the ValueError decoding it raised, so one bad document
+        is reported like any other instead of ending the run
+    """
+    try:
+        with gc_paused():
+            return loads(text)
+    except ValueError as e:
+        return e
+
+
+def read_plan_documents(paths, pattern=('.json', '.jsonl')):
+    """
+    :return: generator of (source, document number within source, document or decoding error)
+    """
+    for path in sql_files(paths, pattern):
+        if path == '-':
+            yield from ((path, n, decoded(line)) for n, line in enumerate(l for l in sys.stdin if l.strip()))
+        elif path.endswith('.jsonl'):
+            with open(path, encoding='utf-8') as f:
+                yield from ((path, n, decoded(line)) for n, line in enumerate(l for l in f if l.strip()))
+        else:
+            with open(path, encoding='utf-8') as f:
+                yield path, 0, decoded(f.read())
+
+
+def offline_job(document, relation_columns):
+    """
+    :return: (query text, (query, plan, relation_columns) for annotate_chunk)
+    """
+    if isinstance(document, ValueError):
+        raise document
+    if type(document) is not dict:
+        raise ValueError('expected a JSON object with a query and a plan')
+    text = document.get('query', document.get('Query Text'))
+    if type(text) is not str:
+        raise ValueError('no query text in plan document')
+    statements = list(split_statements(text.splitlines(keepends=True)))
+    if len(statements) != 1:
+        raise ValueError(f'expected one statement, found {len(statements)}')
+    return statements[0], (preprocess_query_string(statements[0]), load_plan(document.get('plan', document)),
+                            relation_columns)
+
+
+def annotate_offline(documents, relation_columns, jobs=4, processes=False, chunksize=1, fail_fast=False):
+    """
+    Annotate (source, number, plan document) tuples against a schema snapshot, with no database
+    :return: generator of output records, in input order
+    """
+    def start(chunk):
+        records, work = [], []
+        for source, number, document in chunk:
+            record = {'source': source, 'statement': number, 'query': None, 'lines': None, 'annotations': None,
+                      'error': None, 'coverage': None}
+            try:
+                record['query'], job = offline_job(document, relation_columns)
+                work.append(job)
+            except ValueError as e:
+                record['error'] = f'{type(e).__name__}: {e}'
+            records.append(record)
+        return records, submit_chunk(executor, work, processes)
+
+    def finish(records, annotated):
+        results = iter(annotated.result())
+        for record in records:
+            if record['error'] is None:
+                record['lines'], record['annotations'], error, stats = next(results)
+                record['error'] = None if error is None else f'{type(error).__name__}: {error}'
+                record['coverage'] = stats.as_dict()
+                default_coverage.add(stats)
+        return records
+
+    documents = iter(documents)
+    with cpu_executor(jobs, processes) as executor:
+        in_flight = deque()
+        for chunk in iter(lambda: list(itertools.islice(documents, chunksize)), []):
+            in_flight.append(start(chunk))
+            while in_flight and (len(in_flight) >= 2 * jobs or in_flight[0][1].done()):
+                for record in finish(*in_flight.popleft()):
+                    yield record
+                    if record['error'] is not None and fail_fast:
+                        return
+        while in_flight:
+            for record in finish(*in_flight.popleft()):
+                yield record
+                if record['error'] is not None and fail_fast:
+                    return
+
+
+def annotate_statements(db_name, statements, fail_fast=False, **options):
+    """
+    Annotate (source, number, text) tuples with process_many, holding only the statements in flight
+    :return: generator of output records
+    """
+    sources = {}
+
+    def queries():
+        for index, (source, number, text) in enumerate(statements):
+            sources[index] = (source, number, text)
+            yield text
+
+    results = process_many(db_name, queries(), **options)
+    try:
+        for item in results:
+            source, number, text = sources.pop(item['index'])
+            error = item['error']
+            yield {
+                'source': source,
+                'statement': number,
+                'query': text,
+                'lines': item['statements'],
+                'annotations': item['annotations'],
+                'error': None if error is None else f'{type(error).__name__}: {error}',
+                'coverage': None if item['stats'] is None else item['stats'].as_dict(),
+            }
+            if error is not None and fail_fast:
+                return
+    finally:
+        results.close()
+
+
+def main(argv=None, out=sys.stdout, pools=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', default=['-'], help="SQL files or directories, '-' for stdin")
+    parser.add_argument('--db', default=os.getenv('DB_NAME', 'TPC-H'), help='database to EXPLAIN against')
+    parser.add_argument('--pattern', help='suffix of the files read from directories (default .sql, or '
+                                          '.json and .jsonl with --schema)')
+    parser.add_argument('--schema', help='annotate saved plans against this schema snapshot, without a database')
+    parser.add_argument('--save-schema', metavar='PATH', help='write a schema snapshot of --db and exit')
+    parser.add_argument('--jobs', type=int, default=4, help='parse/match workers')
+    parser.add_argument('--connections', type=int, default=4, help='concurrent EXPLAINs')
+    parser.add_argument('--processes', action='store_true', help='use worker processes instead of threads')
+    parser.add_argument('--chunksize', type=int, default=1)
+    parser.add_argument('--unordered', action='store_true', help='write results as they complete')
+    parser.add_argument('--matched-plans', action='store_true', help='keep only the plan keys matching reads, '
+                                                                     'for plans over thousands of partitions')
+    policy = parser.add_mutually_exclusive_group()
+    policy.add_argument('--fail-fast', action='store_true', help='stop at the first statement that fails')
+    policy.add_argument('--keep-going', dest='fail_fast', action='store_false', help='report failures and go on '
+                                                                                       '(default)')
+    parser.add_argument('--metrics', metavar='PATH', help='write stage timings and counters in Prometheus text '
+                                                          'format to PATH at the end')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    if args.metrics:
+        default_metrics.enable()
+
+    if args.save_schema:
+        with db_connection(args.db) as conn:
+            save_snapshot(default_catalog.relations(conn.cursor()), args.save_schema)
+        return 0
+
+    count = failed = 0
+    if args.schema:
+        documents = read_plan_documents(args.paths, args.pattern or ('.json', '.jsonl'))
+        records = annotate_offline(documents, load_snapshot(args.schema), jobs=args.jobs, processes=args.processes,
+                                   chunksize=args.chunksize, fail_fast=args.fail_fast)
+    else:
+        if pools is None:
+            # the command line owns the process, so decodes may pause the collector
+            pools = ConnectionPools(partial(connect_db, matched_plans=args.matched_plans, pause_gc=True))
+        records = annotate_statements(args.db, read_statements(args.paths, args.pattern or '.sql'),
+                                      fail_fast=args.fail_fast, jobs=args.jobs, connections=args.connections,
+                                      processes=args.processes, chunksize=args.chunksize,
+                                      ordered=not args.unordered, pools=pools)
+    for record in records:
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+        count += 1
+        failed += record['error'] is not None
+    logging.info(f'{count} statements annotated, {failed} failed')
+    if args.metrics:
+        with open(args.metrics, 'w', encoding='utf-8') as f:
+            f.write(default_metrics.prometheus())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,403 @@
+"""
+Postgres prints plan conditions as deparsed expressions, e.g.
+((lineitem.l_shipdate >= '1994-01-01'::date) AND ((part.p_type)::text ~~ '%BRASS'::text))
+They are parsed into tuples with casts and redundant parentheses dropped, constants normalized,
+commutative operands ordered and '>'/'>=' flipped to '<'/'<=', so a comparison from the query
+matches a comparison in the plan exactly when their canonical tuples are equal.
+"""
+import functools
+import re
+from decimal import Decimal, DecimalException
+
+TOKEN = re.compile(r"""
+    \s+
+    | (?P<string>'(?:[^']|'')*')
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?)
+    | (?P<param>\$\d+)
+    | (?P<op>::|<=|>=|<>|!=|!~~\*?|~~\*?|!~\*?|~\*?|\|\||[=<>+\-*/%])
+    | (?P<punct>[(),\[\].:])
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+""", re.VERBOSE)
+
+COMPARISON_SYMBOLS = {'=', '<>', '!=', '<', '>', '<=', '>=', '~~', '!~~', '~~*', '!~~*', '~', '!~', '~*', '!~*'}
+FLIPPED = {'>': '<', '>=': '<='}
+COMMUTATIVE = {'=', '<>', '+', '*'}
+TYPE_WORDS = {'without', 'with', 'time', 'zone', 'varying', 'precision'}
+SUBPLAN_WORDS = {'SubPlan', 'InitPlan', 'hashed', 'alternatives', 'CTE'}
+
+# mo_sql_parsing operator names -> operator as printed in plans
+QUERY_OPERATORS = {
+    'gt': '>', 'lt': '<', 'eq': '=', 'neq': '<>', 'gte': '>=', 'lte': '<=', 'like': '~~', 'not_like': '!~~',
+    'add': '+', 'sub': '-', 'mul': '*', 'div': '/', 'mod': '%',
+}
+QUERY_CONSTANTS = {'date', 'time', 'timestamp'}
+CONSTANT = ('const', '*')
+# a plain decimal, the form of numeric constants in plans and string literals that stand for them
+PLAIN_NUMBER = re.compile(r'-?(?:\d+(?:\.\d*)?|\.\d+)')
+# a number token with an exponent small enough to be written out in full
+EXPONENT_NUMBER = re.compile(r'(?:\d+(?:\.\d*)?|\.\d+)[eE][-+]?\d{1,2}')
+PARAM = ('param',)
+
+
+class ConditionSyntaxError(ValueError):
+    pass
+
+
+def tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        m = TOKEN.match(text, pos)
+        if m is None:
+            raise ConditionSyntaxError(f'unexpected {text[pos:pos + 10]!r} in {text}')
+        pos = m.end()
+        if m.lastgroup is not None:
+            tokens.append((m.lastgroup, m.group(m.lastgroup)))
+    return tokens
+
+
+class ConditionParser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def parse(self):
+        node = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise ConditionSyntaxError(f'trailing {self.tokens[self.pos:]} in {self.text}')
+        return node
+
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.tokens[pos] if pos < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        if token[0] is None:
+            raise ConditionSyntaxError(f'unexpected end of {self.text}')
+        self.pos += 1
+        return token
+
+    def accept(self, value):
+        if self.peek()[1] == value:
+            self.pos += 1
+            return True
+        return False
+
+    def accept_word(self, word):
+        kind, value = self.peek()
+        if kind == 'word' and value.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, value):
+        if not self.accept(value):
+            raise ConditionSyntaxError(f'expected {value!r} at {self.peek()} in {self.text}')
+
+    def parse_or(self):
+        args = [self.parse_and()]
+        while self.accept_word('OR'):
+            args.append(self.parse_and())
+        return args[0] if len(args) == 1 else ('or', args)
+
+    def parse_and(self):
+        args = [self.parse_not()]
+        while self.accept_word('AND'):
+            args.append(self.parse_not())
+        return args[0] if len(args) == 1 else ('and', args)
+
+    def parse_not(self):
+        if self.accept_word('NOT'):
+            return ('not', self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_additive()
+        kind, value = self.peek()
+        if kind == 'op' and value in COMPARISON_SYMBOLS:
+            self.pos += 1
+            for quantifier in ['ANY', 'ALL']:
+                if self.accept_word(quantifier):
+                    self.expect('(')
+                    right = self.parse_or()
+                    self.expect(')')
+                    return ('op', f'{value} {quantifier}', left, right)
+            return ('op', value, left, self.parse_additive())
+        if self.accept_word('IS'):
+            negated = self.accept_word('NOT')
+            if self.accept_word('DISTINCT'):
+                self.accept_word('FROM')
+                return ('op', '=' if negated else '<>', left, self.parse_additive())
+            _, what = self.next()
+            return ('is', f"{'not ' if negated else ''}{what.lower()}", left)
+        return left
+
+    def parse_additive(self):
+        node = self.parse_multiplicative()
+        while self.peek()[1] in ['+', '-', '||']:
+            _, op = self.next()
+            node = ('op', op, node, self.parse_multiplicative())
+        return node
+
+    def parse_multiplicative(self):
+        node = self.parse_unary()
+        while self.peek()[1] in ['*', '/', '%']:
+            _, op = self.next()
+            node = ('op', op, node, self.parse_unary())
+        return node
+
+    def parse_unary(self):
+        if self.accept('-'):
+            node = self.parse_unary()
+            return ('const', f'-{node[1]}') if node[0] == 'const' else ('op', '-', ('const', '0'), node)
+        self.accept('+')
+        return self.parse_postfix()
+
+    def parse_postfix(self):
+        node = self.parse_primary()
+        while True:
+            if self.accept('::'):
+                self.skip_type()
+            elif self.peek()[1] == '[':
+                self.skip_balanced('[', ']')
+                node = ('subscript', node)
+            elif self.peek()[1] == '.' and self.peek(1)[0] in ['word', 'quoted']:
+                self.pos += 1
+                _, field = self.next()
+                node = node if node == PARAM else ('field', node, field)
+            else:
+                return node
+
+    def skip_type(self):
+        self.next()
+        while self.peek()[0] == 'word' and self.peek()[1] in TYPE_WORDS:
+            self.pos += 1
+        if self.peek()[1] == '(':
+            self.skip_balanced('(', ')')
+        while self.peek()[1] == '[':
+            self.skip_balanced('[', ']')
+
+    def skip_balanced(self, open_token, close_token):
+        depth = 0
+        while True:
+            _, value = self.next()
+            if value == open_token:
+                depth += 1
+            elif value == close_token:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def parse_primary(self):
+        kind, value = self.next()
+        if value == '(':
+            if self.peek()[0] == 'word' and self.peek()[1] in SUBPLAN_WORDS:
+                self.pos -= 1
+                self.skip_balanced('(', ')')
+                return PARAM
+            args = [self.parse_or()]
+            while self.accept(','):
+                args.append(self.parse_or())
+            self.expect(')')
+            return args[0] if len(args) == 1 else ('row', args)
+        if kind == 'string':
+            return ('const', value[1:-1].replace("''", "'"))
+        if kind == 'number':
+            return ('const', plain_number(value) if EXPONENT_NUMBER.fullmatch(value) else value)
+        if kind == 'param':
+            return PARAM
+        if value == '*':
+            return ('const', '*')
+        if kind not in ['word', 'quoted']:
+            raise ConditionSyntaxError(f'unexpected {value!r} in {self.text}')
+        if kind == 'word':
+            upper = value.upper()
+            if upper in ['NULL', 'TRUE', 'FALSE']:
+                return ('const', upper)
+            if upper == 'ARRAY':
+                self.skip_balanced('[', ']')
+                return ('array',)
+            if upper == 'CASE':
+                depth = 1
+                while depth:
+                    _, word = self.next()
+                    depth += {'CASE': 1, 'END': -1}.get(str(word).upper(), 0)
+                return ('case',)
+            if value in SUBPLAN_WORDS:
+                while self.peek()[0] in ['word', 'number'] and self.peek()[1] not in ['AND', 'OR']:
+                    self.pos += 1
+                return PARAM
+        name = unquote(value)
+        while self.peek()[1] == '.' and self.peek(1)[0] in ['word', 'quoted']:
+            self.pos += 1
+            name += '.' + unquote(self.next()[1])
+        if self.accept('('):
+            self.accept_word('DISTINCT')
+            args = []
+            if not self.accept(')'):
+                args.append(self.parse_or())
+                while self.accept(','):
+                    args.append(self.parse_or())
+                self.expect(')')
+            return ('func', name.lower(), args)
+        return ('col', name)
+
+
+def unquote(identifier):
+    if identifier.startswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def plain_number(value):
+    try:
+        return format(Decimal(value).normalize(), 'f')
+    except DecimalException:
+        return value
+
+
+def normalize_constant(value):
+    if value.endswith(' 00:00:00'):
+        value = value[:-len(' 00:00:00')]
+    # 500, '500'::numeric and 500.0 are the same constant; exact, so large keys stay apart.
+    # Only plain decimals: '1e5' or 'nan' in quotes is text, and must not take the key of another literal
+    if PLAIN_NUMBER.fullmatch(value):
+        return plain_number(value)
+    return value
+
+
+def canonical(node, bare=False, wild=False):
+    kind = node[0]
+    if kind == 'col':
+        return ('col', node[1].rsplit('.', 1)[-1]) if bare else node
+    if kind == 'const':
+        return CONSTANT if wild else ('const', normalize_constant(node[1]))
+    if kind == 'op':
+        op, left, right = node[1], canonical(node[2], bare, wild), canonical(node[3], bare, wild)
+        op = '<>' if op == '!=' else op
+        if op in FLIPPED:
+            op, left, right = FLIPPED[op], right, left
+        elif op in COMMUTATIVE and repr(right) < repr(left):
+            left, right = right, left
+        return ('op', op, left, right)
+    if kind in ['and', 'or']:
+        return (kind, tuple(sorted((canonical(arg, bare, wild) for arg in node[1]), key=repr)))
+    if kind in ['func', 'row']:
+        return (kind,) + node[1:-1] + (tuple(canonical(arg, bare, wild) for arg in node[-1]),)
+    if kind in ['not', 'subscript']:
+        return (kind, canonical(node[1], bare, wild))
+    if kind == 'is':
+        return ('is', node[1], canonical(node[2], bare, wild))
+    if kind == 'field':
+        return ('field', canonical(node[1], bare, wild), node[2])
+    return node
+
+
+def comparisons(node):
+    """
+    Yield the comparison atoms of a condition, looking through AND, OR and NOT
+    """
+    if node[0] in ['and', 'or']:
+        for arg in node[1]:
+            yield from comparisons(arg)
+    elif node[0] == 'not':
+        yield from comparisons(node[1])
+    elif node[0] == 'op' and node[1].split()[0] in COMPARISON_SYMBOLS:
+        yield node
+
+
+def parse_condition(text):
+    return ConditionParser(text).parse()
+
+
+@functools.lru_cache(maxsize=8192)
+def condition_keys(text):
+    """
+    Canonical keys of every comparison in a plan condition, in each variant a query comparison
+    may be keyed by (bare column names, folded constants). None if the condition can't be parsed.
+    """
+    try:
+        tree = parse_condition(text)
+    except ConditionSyntaxError:
+        return None
+    keys = set()
+    for atom in comparisons(tree):
+        for bare in [False, True]:
+            for wild in [False, True]:
+                keys.add(canonical(atom, bare, wild))
+    return frozenset(keys)
+
+
+def column_comparisons(text):
+    """
+    (left, operator, right) of every comparison between two plain columns in a plan condition
+    """
+    try:
+        tree = parse_condition(text)
+    except ConditionSyntaxError:
+        return []
+    return [(atom[2][1], atom[1], atom[3][1]) for atom in comparisons(tree)
+            if atom[2][0] == 'col' and atom[3][0] == 'col']
+
+
+def query_operand(operand):
+    """
+    Convert a mo_sql_parsing expression to the same tuples a plan condition parses to
+    """
+    if type(operand) is str:
+        return ('col', operand)
+    if type(operand) is bool:
+        return ('const', str(operand).upper())
+    if type(operand) in [int, float]:
+        return ('const', str(operand))
+    if type(operand) is not dict or len(operand) == 0:
+        raise NotImplementedError(f'{operand}')
+    if 'select' in operand or 'select_distinct' in operand or 'union' in operand or 'union_all' in operand:
+        return PARAM
+    op, val = next(iter(operand.items()))
+    if op == 'literal':
+        if type(val) is not str:
+            raise NotImplementedError(f'{operand}')
+        return ('const', val)
+    if op in QUERY_CONSTANTS and type(val) is dict and 'literal' in val:
+        return ('const', val['literal'])
+    if op == 'interval':
+        return ('interval',)
+    args = [query_operand(v) for v in (val if type(val) is list else [val])]
+    if op in QUERY_OPERATORS:
+        node = args[0]
+        for arg in args[1:]:
+            node = ('op', QUERY_OPERATORS[op], node, arg)
+        return node
+    return ('func', op.lower(), args)
+
+
+def is_constant(node):
+    if node[0] in ['const', 'interval']:
+        return True
+    if node[0] == 'op':
+        return is_constant(node[2]) and is_constant(node[3])
+    if node[0] == 'func':
+        return all(is_constant(arg) for arg in node[2])
+    return False
+
+
+def comparison_key(op, operands):
+    """
+    Canonical key of a query comparison, or None if it has no plan counterpart we can build
+    """
+    if op not in QUERY_OPERATORS or type(operands) is not list or len(operands) != 2:
+        return None
+    try:
+        left, right = (query_operand(operand) for operand in operands)
+    except NotImplementedError:
+        return None
+    # constant expressions are folded by the planner, so they can only match as "some constant"
+    wild = any(node[0] != 'const' and is_constant(node) for node in [left, right])
+    if wild:
+        left, right = (CONSTANT if is_constant(node) else node for node in [left, right])
+    bare = any(node[0] == 'col' and '.' not in node[1] for node in [left, right])
+    return canonical(('op', QUERY_OPERATORS[op], left, right), bare, wild)
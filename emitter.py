@@ -0,0 +1,192 @@
+"""
+SQL text for mo_sql_parsing trees, the same text mo_sql_parsing.format gives, written into one buffer.
+format checks every identifier against the SQL keyword grammar, which is most of the time spent reparsing;
+here that check runs once per distinct identifier. Nodes not handled natively (whole queries, joins,
+window clauses, CASE, ...) are handed to a mo_sql_parsing Formatter sharing the same check.
+"""
+from functools import lru_cache
+
+from mo_sql_parsing.formatting import Formatter, escape, should_quote
+from mo_sql_parsing.keywords import precedence
+from mo_sql_parsing.utils import binary_ops
+
+MAX_PRECEDENCE = 100
+
+# operator key -> (infix text, precedence), as mo_sql_parsing.formatting.Operator builds them
+INFIX = {
+    key: (f' {symbol} '.replace('_', ' ').upper(), precedence[binary_ops[symbol]])
+    for key, symbol in [
+        ('concat', '||'), ('mul', '*'), ('div', '/'), ('mod', '%'), ('add', '+'), ('sub', '-'),
+        ('neq', '<>'), ('gt', '>'), ('lt', '<'), ('gte', '>='), ('lte', '<='), ('eq', '='), ('in', 'in'),
+        ('nin', 'not in'), ('or', 'or'), ('and', 'and'), ('binary_and', '&'), ('binary_or', '|'),
+        ('like', 'like'), ('not_like', 'not like'), ('rlike', 'rlike'), ('not_rlike', 'not rlike'),
+    ]
+}
+# keys mo_sql_parsing treats as clauses or gives a method of its own, left to its Formatter
+DELEGATED = {'join', 'with', 'distinct_on', 'select_distinct', 'select', 'from', 'where', 'groupby', 'having',
+             'orderby', 'limit', 'offset', 'over', 'binary_not', 'collate', 'case', 'join_on', 'union',
+             'union_all', 'intersect', 'minus', 'except'}
+
+
+@lru_cache(maxsize=16384)
+def quoted(identifier):
+    return should_quote(identifier)
+
+
+@lru_cache(maxsize=16384)
+def identifier(name):
+    return escape(name, True, quoted)
+
+
+_formatter = Formatter(should_quote=quoted)
+
+
+def listwrap(value):
+    if value is None:
+        return []
+    return value if type(value) is list else [value]
+
+
+def emit(node, out, prec=MAX_PRECEDENCE):
+    """
+    Append the SQL of node to the list out
+    """
+    kind = type(node)
+    if kind is str:
+        out.append(identifier(node))
+    elif kind is dict:
+        emit_dict(node, out, prec)
+    elif kind is list:
+        # mo_sql_parsing always parenthesizes a bare list
+        out.append('(')
+        for i, element in enumerate(node):
+            if i:
+                out.append(', ')
+            emit(element, out)
+        out.append(')')
+    elif node is None:
+        out.append('NULL')
+    else:
+        out.append(str(node))
+
+
+def emit_dict(node, out, prec):
+    if len(node) == 0:
+        return
+    if 'value' in node:
+        if 'over' in node:
+            out.append(_formatter.dispatch(node, prec))
+            return
+        emit(node['value'], out, prec)
+        if 'name' in node:
+            out.append(' AS ')
+            emit(node['name'], out)
+        return
+    if len(node) > 1 or node.keys() & DELEGATED:
+        out.append(_formatter.dispatch(node, prec))
+        return
+    if 'null' in node:
+        out.append('NULL')
+        return
+    key, value = next(iter(node.items()))
+    if key in INFIX:
+        infix, op_prec = INFIX[key]
+        if type(value) is dict:
+            # {VARIABLE: VALUE} form
+            value = [next(iter(value)), {'literal': next(iter(value.values()))}]
+        if prec < op_prec:
+            out.append('(')
+        for i, operand in enumerate(listwrap(value)):
+            if i:
+                out.append(infix)
+            emit(operand, out, op_prec + 1 if i == 0 else op_prec)
+        if prec < op_prec:
+            out.append(')')
+    elif key == 'literal':
+        out.append(literal(value))
+    elif key in ('between', 'not_between'):
+        emit(value[0], out, precedence['between'])
+        out.append(' BETWEEN ' if key == 'between' else ' NOT BETWEEN ')
+        emit(value[1], out, precedence['between'])
+        out.append(' AND ')
+        emit(value[2], out, precedence['between'])
+    elif key in ('exists', 'missing'):
+        emit(value, out, precedence['is'])
+        out.append(' IS NOT NULL' if key == 'exists' else ' IS NULL')
+    elif key == 'distinct':
+        out.append('DISTINCT ')
+        for i, operand in enumerate(listwrap(value)):
+            if i:
+                out.append(', ')
+            emit(operand, out, precedence['select'])
+    elif key.startswith('_'):
+        out.append(_formatter.dispatch(node, prec))
+    elif type(value) is dict and len(value) == 0:
+        out.append(key.upper() + '()')
+    else:
+        # a function call
+        out.append(key.upper() + '(')
+        for i, operand in enumerate(listwrap(value)):
+            if i:
+                out.append(', ')
+            emit(operand, out)
+        out.append(')')
+
+
+def literal(value):
+    if type(value) is list:
+        return '(' + ', '.join(literal(v) for v in value) + ')'
+    elif type(value) is str:
+        return "'" + value.replace("'", "''") + "'"
+    return str(value)
+
+
+def sql(node):
+    """
+    :return: what mo_sql_parsing.format(node) returns
+    """
+    out = []
+    emit(node, out)
+    return ''.join(out)
+
+
+def clause(keyword, value, distinct_on=None):
+    """
+    One clause of a query on its own, e.g. clause('groupby', [{'value': 'a'}]) is 'GROUP BY a'
+    :param distinct_on: the query's distinct_on, for a select clause
+    """
+    if keyword in ('select', 'select_distinct'):
+        parts = []
+        if distinct_on is not None:
+            parts.append('SELECT DISTINCT ON (' + joined(distinct_on) + ')')
+        items = joined(value)
+        if keyword == 'select_distinct':
+            parts.append('SELECT DISTINCT ' + items)
+        elif distinct_on is None:
+            parts.append('SELECT ' + items)
+        elif items:
+            parts.append(items)
+        return ' '.join(parts)
+    elif keyword == 'groupby':
+        return ('GROUP BY ' + joined(value)).strip()
+    elif keyword == 'orderby':
+        return ('ORDER BY ' + ', '.join((sql_at(item['value'], precedence['order']) + ' ' +
+                                         item.get('sort', '').upper()).strip() for item in listwrap(value))).strip()
+    elif keyword == 'limit':
+        return ('LIMIT ' + sql_at(value, precedence['order'])).strip()
+    raise ValueError(f'clause {keyword}')
+
+
+def joined(values):
+    out = []
+    for i, value in enumerate(listwrap(values)):
+        if i:
+            out.append(', ')
+        emit(value, out)
+    return ''.join(out)
+
+
+def sql_at(node, prec):
+    out = []
+    emit(node, out, prec)
+    return ''.join(out)
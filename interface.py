@@ -3,8 +3,13 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 import sys
+import threading
 
-from annotation import process, init_conn
+from psycopg2.extensions import QueryCanceledError
+
+from annotation import annotate_lines, default_pools, explain_query
+from live import LiveAnnotator
+from preprocessing import preprocess_query_string
 
 
 class ScrollableLabel(QScrollArea):
@@ -25,6 +30,93 @@ class ScrollableLabel(QScrollArea):
         self.label.setText(text)
 
 
+class AnnotateSignals(QObject):
+    progress = pyqtSignal(str)
+    connected = pyqtSignal(str)
+    result = pyqtSignal(list, list)
+    lines = pyqtSignal(list, list)
+    error = pyqtSignal(str)
+    cancelled = pyqtSignal()
+    finished = pyqtSignal()
+
+
+class AnnotateWorker(QRunnable):
+    """
+    Annotates one query on a QThreadPool thread and reports back through signals.
+    A submitted query's output is sent as it is formatted, in batches that double in size,
+    so long queries start rendering early without redrawing the labels once per line.
+    cancel() asks the server to abort the statement the worker is running; the connection is cleared
+    under a lock before it goes back to the pool, so a late cancel never reaches another worker's statement.
+    """
+    FIRST_BATCH = 100
+
+    def __init__(self, db_name, query, annotator=None):
+        super(AnnotateWorker, self).__init__()
+        self.db_name = db_name
+        self.query = query
+        self.annotator = annotator
+        self.signals = AnnotateSignals()
+        self.conn = None
+        self.conn_lock = threading.Lock()
+        self.is_cancelled = False
+
+    def cancel(self):
+        self.is_cancelled = True
+        with self.conn_lock:
+            if self.conn is not None:
+                self.conn.cancel()
+
+    def emitLines(self, lines):
+        statements, annotations = [], []
+        batch = self.FIRST_BATCH
+        for statement, annotation in lines:
+            if self.is_cancelled:
+                raise QueryCanceledError()
+            statements.append(statement)
+            annotations.append(annotation)
+            if len(statements) == batch:
+                self.signals.lines.emit(statements, annotations)
+                statements, annotations = [], []
+                batch *= 2
+        self.signals.lines.emit(statements, annotations)
+        self.signals.result.emit([], [])
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.signals.progress.emit(f"Connecting to {self.db_name}...")
+            with default_pools.get(self.db_name).connection() as conn:
+                with self.conn_lock:
+                    self.conn = conn
+                try:
+                    self.signals.connected.emit(self.db_name)
+                    if self.is_cancelled:
+                        raise QueryCanceledError()
+                    if self.annotator is not None:
+                        self.signals.progress.emit("Annotating...")
+                        statements, annotations = self.annotator.annotate(conn.cursor(), self.query)
+                    else:
+                        self.signals.progress.emit("Running EXPLAIN...")
+                        query = preprocess_query_string(self.query)
+                        plan, relation_columns = explain_query(conn.cursor(), query)
+                finally:
+                    with self.conn_lock:
+                        self.conn = None
+            if self.is_cancelled:
+                raise QueryCanceledError()
+            if self.annotator is None:
+                self.signals.progress.emit("Annotating...")
+                self.emitLines(annotate_lines(query, plan, relation_columns))
+            else:
+                self.signals.result.emit(statements, annotations)
+        except QueryCanceledError:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.error.emit(f"ERROR - {e}")
+        finally:
+            self.signals.finished.emit()
+
+
 class MyWindow(QMainWindow):
     def __init__(self):
         super(MyWindow, self).__init__()
@@ -38,6 +130,10 @@ class MyWindow(QMainWindow):
         # Button for running algorithm
         self.submitButton = QtWidgets.QPushButton(self)
 
+        # Button for cancelling the running query, and its progress
+        self.cancelButton = QtWidgets.QPushButton(self)
+        self.statusLabel = ScrollableLabel(self)
+
         # Textbox for query and db name
         self.queryTextbox = QTextEdit(self)
         self.dbNameTextbox = QTextEdit(self)
@@ -51,9 +147,21 @@ class MyWindow(QMainWindow):
         self.initUI()  # Call initUI
 
         # Db connection settings
-        self.conn = None
         self.dbName = ''
 
+        # Annotation runs on a worker thread so the window stays responsive
+        self.threadPool = QThreadPool.globalInstance()
+        self.worker = None
+        self.outputLines, self.annotationLines = [], []
+
+        # Live annotation, once typing has paused for a while
+        self.liveAnnotator = LiveAnnotator()
+        self.liveTimer = QTimer(self)
+        self.liveTimer.setSingleShot(True)
+        self.liveTimer.setInterval(600)
+        self.liveTimer.timeout.connect(self.onLiveEdit)
+        self.queryTextbox.textChanged.connect(self.liveTimer.start)
+
     def initUI(self):
         self.queryOutput.setText("Output Query goes here")
         self.queryOutput.move(30, 400)
@@ -92,21 +200,87 @@ class MyWindow(QMainWindow):
         self.submitButton.move(820, 270)
         self.submitButton.resize(300, 100)
 
+        self.cancelButton.setText("Cancel")
+        self.cancelButton.setFont(QFont('Arial', 15))
+        self.cancelButton.clicked.connect(self.onCancel)
+        self.cancelButton.move(1140, 270)
+        self.cancelButton.resize(300, 100)
+        self.cancelButton.setEnabled(False)
+
+        self.statusLabel.move(1140, 140)
+        self.statusLabel.resize(300, 100)
+        self.statusLabel.setText("Ready")
+
     def onClick(self):
-        if self.dbName != self.dbNameTextbox.toPlainText():
-            try:
-                self.conn = init_conn(self.dbNameTextbox.toPlainText())
-                self.dbName = self.dbNameTextbox.toPlainText()
-                self.dbNameLabel.setText(f"Current DB Name: {self.dbName}")
-            except Exception as e:
-                self.error_dialog.showMessage(f"ERROR - {e}")
-        if self.conn is not None:
-            try:
-                query, annotation = process(self.conn, self.queryTextbox.toPlainText())
-                self.queryOutput.setText('\n'.join(query))
-                self.queryAnnotate.setText('\n'.join(annotation))
-            except Exception as e:
-                self.error_dialog.showMessage(f"ERROR - {e}")
+        self.liveTimer.stop()
+        self.startWorker(live=False)
+
+    def onLiveEdit(self):
+        # only once a database has been picked with Submit
+        if self.dbName != '' and self.queryTextbox.toPlainText().strip() != '':
+            self.startWorker(live=True)
+
+    def startWorker(self, live):
+        # a newer request makes the running one stale
+        if self.worker is not None:
+            self.worker.cancel()
+        db_name = self.dbName if live else self.dbNameTextbox.toPlainText()
+        # connections stay in the pool, switching back to a database does not reconnect
+        worker = AnnotateWorker(db_name, self.queryTextbox.toPlainText(), self.liveAnnotator if live else None)
+        worker.signals.progress.connect(lambda text: self.onProgress(worker, text))
+        worker.signals.connected.connect(self.onConnected)
+        worker.signals.lines.connect(lambda query, annotation: self.onLines(worker, query, annotation))
+        worker.signals.result.connect(lambda query, annotation: self.onResult(worker, query, annotation))
+        worker.signals.error.connect(lambda message: self.onError(worker, message, live))
+        worker.signals.cancelled.connect(lambda: self.onProgress(worker, "Cancelled"))
+        worker.signals.finished.connect(lambda: self.onFinished(worker))
+        self.worker = worker
+        self.outputLines, self.annotationLines = [], []
+        self.cancelButton.setEnabled(True)
+        self.threadPool.start(worker)
+
+    def onCancel(self):
+        if self.worker is not None:
+            self.statusLabel.setText("Cancelling...")
+            self.worker.cancel()
+
+    def onProgress(self, worker, text):
+        if worker is self.worker:
+            self.statusLabel.setText(text)
+
+    def onConnected(self, db_name):
+        self.dbName = db_name
+        self.dbNameLabel.setText(f"Current DB Name: {self.dbName}")
+
+    def onLines(self, worker, query, annotation):
+        if worker is not self.worker:
+            return
+        self.outputLines.extend(query)
+        self.annotationLines.extend(annotation)
+        self.queryOutput.setText('\n'.join(self.outputLines))
+        self.queryAnnotate.setText('\n'.join(self.annotationLines))
+
+    def onResult(self, worker, query, annotation):
+        if worker is not self.worker:
+            return
+        # streamed output arrived through onLines already
+        if query:
+            self.queryOutput.setText('\n'.join(query))
+            self.queryAnnotate.setText('\n'.join(annotation))
+        self.statusLabel.setText("Done")
+
+    def onError(self, worker, message, live):
+        if worker is not self.worker:
+            return
+        self.statusLabel.setText("Failed" if not live else message)
+        # half-typed queries fail all the time, only submitted ones get a dialog
+        if not live:
+            self.error_dialog.showMessage(message)
+
+    def onFinished(self, worker):
+        if worker is self.worker:
+            self.worker = None
+            self.cancelButton.setEnabled(False)
 
 
 def window():
@@ -0,0 +1,115 @@
+import copy
+import logging
+import threading
+
+from annotation import Annotations, explain_query, join_conditions, reparse_query, transverse_plan, transverse_query
+from cache import default_ast_cache, default_plan_cache, normalize_query
+from catalog import database_key
+from preprocessing import preprocess_query_string, preprocess_query_tree, rename_column_to_full_name
+
+# Plan nodes are only ever matched against these clauses
+MATCHED_CLAUSES = ['from', 'where']
+
+
+def plan_signature(plan: dict, index):
+    """
+    What matching sees of a plan. Output lists follow the SELECT list, so Nested Loops are reduced
+    to the join conditions they would be tried with.
+    """
+    signature = []
+    for result in transverse_plan(plan):
+        candidates = join_conditions(result, index) if result.lhs is not None else None
+        signature.append((result.kind, result.subtype, result.filter, result.name, result.alias, candidates))
+    return signature
+
+
+class LiveAnnotator:
+    """
+    Annotates successive versions of a query being edited, reusing work from the previous version:
+    - if only whitespace or case changed and the planner state (see PlanCache.planner_state) has not,
+      the previous result is returned as is
+    - if FROM, WHERE and what matching sees of the plan are unchanged, the annotated FROM and WHERE
+      are reused and only the changed clauses are renamed and reformatted
+    - otherwise the query is annotated from scratch
+    """
+    def __init__(self):
+        self.reused = 0
+        self.partial = 0
+        self.full = 0
+        self._last = None
+        self._lock = threading.Lock()
+
+    def annotate(self, cur, query):
+        """
+        :return: formatted_query, annotation
+        """
+        query = preprocess_query_string(query)
+        # statistics or planner settings may have changed under the same text
+        key = (database_key(cur), default_plan_cache.planner_state(cur), normalize_query(query))
+        with self._lock:
+            last = self._last
+            if last is not None and last['key'] == key:
+                self.reused += 1
+                return last['result']
+        plan, relation_columns = explain_query(cur, query)
+        raw = default_ast_cache.parse(query)
+        # the catalog hands out the same mapping until the schema changes
+        if last is not None and last['columns'] is relation_columns and all(
+                raw.get(clause) == last['raw'].get(clause) for clause in MATCHED_CLAUSES):
+            signature = plan_signature(plan[0][0]['Plan'], last['index'])
+            if signature == last['signature']:
+                self._count('partial')
+                return self._update(last, key, raw, signature)
+        self._count('full')
+        return self._annotate(key, raw, plan, relation_columns)
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _annotate(self, key, raw, plan, relation_columns):
+        parsed = copy.deepcopy(raw)
+        column_relation_dict = preprocess_query_tree(None, parsed, relation_columns=relation_columns)
+        annotations = Annotations()
+        index = transverse_query(parsed, plan[0][0]['Plan'], annotations=annotations)
+        state = {
+            'key': key,
+            'raw': raw,
+            'columns': relation_columns,
+            'column_relation_dict': column_relation_dict,
+            'index': index,
+            'signature': plan_signature(plan[0][0]['Plan'], index),
+            'annotated': parsed,
+            'annotations': annotations,
+        }
+        return self._finish(state)
+
+    def _update(self, last, key, raw, signature):
+        annotated = {}
+        for clause, val in raw.items():
+            if clause in last['annotated'] and val == last['raw'].get(clause):
+                annotated[clause] = last['annotated'][clause]
+            else:
+                logging.debug('live annotation: clause %s changed', clause)
+                renamed = {clause: copy.deepcopy(val)}
+                rename_column_to_full_name(renamed, last['column_relation_dict'])
+                annotated[clause] = renamed[clause]
+        annotations = last['annotations']
+        if type(annotated.get('from')) is str:
+            # a bare relation name is annotated in the slot of the clause dict, which is new
+            annotations = annotations.copy()
+            annotations.annotate(annotated, last['annotations'].note(last['annotated'], 'from'), 'from')
+        state = dict(last, key=key, raw=raw, signature=signature, annotated=annotated, annotations=annotations)
+        return self._finish(state)
+
+    def _finish(self, state):
+        result = []
+        reparse_query(result, state['annotated'], state['annotations'])
+        state['result'] = [q['statement'] for q in result], [q['annotation'] for q in result]
+        with self._lock:
+            self._last = state
+        return state['result']
+
+    def stats(self):
+        with self._lock:
+            return {'reused': self.reused, 'partial': self.partial, 'full': self.full}
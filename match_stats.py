@@ -0,0 +1,181 @@
+"""
+How much of a query and its plan an annotation covered, per request and aggregated across requests
+"""
+import threading
+import weakref
+
+# coverage histograms have a bucket per 10% and one for exactly 100%
+BUCKETS = 11
+
+
+class MatchStats:
+    """
+    Counts for one annotation: plan nodes visited and matched to the query, query relations and
+    comparisons that got an annotation, and the node types that matched nothing or are not implemented
+    """
+    def __init__(self):
+        self.plan_nodes = 0
+        self.matched_plan_nodes = 0
+        self.query_nodes = 0
+        self.annotated_query_nodes = 0
+        self.unmatched = {}
+        self.unimplemented = {}
+
+    def plan_node(self, node_type, matched):
+        self.plan_nodes += 1
+        if matched:
+            self.matched_plan_nodes += 1
+        else:
+            self.unmatched[node_type] = self.unmatched.get(node_type, 0) + 1
+
+    def query_node(self, annotated):
+        self.query_nodes += 1
+        if annotated:
+            self.annotated_query_nodes += 1
+
+    def unimplemented_node(self, node_type):
+        self.unimplemented[node_type] = self.unimplemented.get(node_type, 0) + 1
+
+    @property
+    def plan_coverage(self):
+        """
+        Fraction of plan nodes matched, None if the plan had none
+        """
+        return self.matched_plan_nodes / self.plan_nodes if self.plan_nodes else None
+
+    @property
+    def query_coverage(self):
+        """
+        Fraction of query relations and comparisons annotated, None if the query had none
+        """
+        return self.annotated_query_nodes / self.query_nodes if self.query_nodes else None
+
+    def needs_review(self, threshold=1.0):
+        """
+        True unless every plan node matched and query coverage reaches threshold
+        """
+        return self.plan_coverage != 1.0 or self.query_coverage is None or self.query_coverage < threshold
+
+    def as_dict(self):
+        return {
+            'plan_nodes': self.plan_nodes,
+            'matched_plan_nodes': self.matched_plan_nodes,
+            'query_nodes': self.query_nodes,
+            'annotated_query_nodes': self.annotated_query_nodes,
+            'plan_coverage': self.plan_coverage,
+            'query_coverage': self.query_coverage,
+            'unmatched': dict(self.unmatched),
+            'unimplemented': dict(self.unimplemented),
+        }
+
+    def __str__(self):
+        def percent(fraction):
+            return 'n/a' if fraction is None else f'{fraction * 100:.0f}%'
+        return f'{percent(self.plan_coverage)} of plan nodes, {percent(self.query_coverage)} of query nodes'
+
+
+class _Shard:
+    def __init__(self):
+        self.requests = 0
+        self.needs_review = 0
+        self.plan = [0] * BUCKETS
+        self.query = [0] * BUCKETS
+        self.empty = {'plan': 0, 'query': 0}
+        self.unmatched = {}
+        self.unimplemented = {}
+
+    def merge(self, other):
+        self.requests += other.requests
+        self.needs_review += other.needs_review
+        for name in ['plan', 'query']:
+            histogram = getattr(self, name)
+            for i, n in enumerate(list(getattr(other, name))):
+                histogram[i] += n
+            self.empty[name] += other.empty[name]
+        for name in ['unmatched', 'unimplemented']:
+            counts = getattr(self, name)
+            for node_type, n in dict(getattr(other, name)).items():
+                counts[node_type] = counts.get(node_type, 0) + n
+
+
+class _ShardOwner:
+    """
+    What a thread keeps in its thread-local; freed when the thread ends
+    """
+    def __init__(self, shard):
+        self.shard = shard
+
+
+def _bucket(fraction):
+    return BUCKETS - 1 if fraction >= 1.0 else int(fraction * (BUCKETS - 1))
+
+
+class CoverageHistograms:
+    """
+    Coverage of every request, aggregated into histograms. Each thread counts into a shard of its own,
+    so add() takes no lock; snapshot() sums the shards. The shard of a thread that has ended is merged
+    into one for retired threads, so short-lived worker pools do not leave a shard each behind.
+    """
+    def __init__(self, threshold=1.0):
+        self.threshold = threshold
+        self._local = threading.local()
+        self._shards = []
+        self._retired = _Shard()
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            owner = self._local.owner = _ShardOwner(_Shard())
+            with self._shards_lock:
+                self._shards.append(owner.shard)
+            weakref.finalize(owner, _retire, weakref.ref(self), owner.shard)
+        return owner.shard
+
+    def add(self, stats: MatchStats):
+        shard = self._shard()
+        shard.requests += 1
+        shard.needs_review += stats.needs_review(self.threshold)
+        for name, fraction, histogram in [('plan', stats.plan_coverage, shard.plan),
+                                          ('query', stats.query_coverage, shard.query)]:
+            if fraction is None:
+                shard.empty[name] += 1
+            else:
+                histogram[_bucket(fraction)] += 1
+        for node_type, n in stats.unmatched.items():
+            shard.unmatched[node_type] = shard.unmatched.get(node_type, 0) + n
+        for node_type, n in stats.unimplemented.items():
+            shard.unimplemented[node_type] = shard.unimplemented.get(node_type, 0) + n
+
+    def snapshot(self):
+        """
+        :return: request and review counts, plan and query coverage histograms keyed by bucket
+            ('0-10%' ... '90-100%', '100%', 'n/a') and unmatched and unimplemented node type counts
+        """
+        total = _Shard()
+        with self._shards_lock:
+            shards = list(self._shards)
+            total.merge(self._retired)
+        for shard in shards:
+            total.merge(shard)
+        labels = [f'{i * 10}-{i * 10 + 10}%' for i in range(BUCKETS - 1)] + ['100%']
+        return {
+            'requests': total.requests,
+            'needs_review': total.needs_review,
+            'plan_coverage': {**dict(zip(labels, total.plan)), 'n/a': total.empty['plan']},
+            'query_coverage': {**dict(zip(labels, total.query)), 'n/a': total.empty['query']},
+            'unmatched': total.unmatched,
+            'unimplemented': total.unimplemented,
+        }
+
+
+def _retire(histograms_ref, shard):
+    histograms = histograms_ref()
+    if histograms is None:
+        return
+    with histograms._shards_lock:
+        histograms._shards.remove(shard)
+        histograms._retired.merge(shard)
+
+
+default_coverage = CoverageHistograms()
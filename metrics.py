@@ -0,0 +1,157 @@
+"""
+Timing spans and event counters for the annotation pipeline, off unless enabled.
+Totals are exported in Prometheus text format; a request wrapped in trace() also gets
+a record of its own spans and counters.
+"""
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Upper bounds in seconds, the Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+_NO_SPAN = nullcontext()
+_current_trace = ContextVar('current_trace', default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(BUCKETS) and seconds > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+
+
+class Trace:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+
+    def record(self):
+        return {
+            'trace': self.name,
+            'started_at': self.started_at,
+            'duration_ms': (time.perf_counter() - self._start) * 1000,
+            'spans': [{'span': name, 'start_ms': (start - self._start) * 1000, 'duration_ms': seconds * 1000}
+                      for name, start, seconds in self.spans],
+            'counters': dict(self.counters),
+        }
+
+
+class Metrics:
+    """
+    Thread-safe span histograms and counters. While disabled, span() hands out a shared no-op
+    context manager and count() returns at once, so instrumented code pays one attribute check.
+    """
+    def __init__(self, enabled=False, namespace='annotator'):
+        self.enabled = enabled
+        self.namespace = namespace
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def span(self, name):
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name)
+
+    @contextmanager
+    def _span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                histogram = self._spans.get(name)
+                if histogram is None:
+                    histogram = self._spans[name] = Histogram()
+                histogram.observe(seconds)
+            trace = _current_trace.get()
+            if trace is not None:
+                trace.spans.append((name, start, seconds))
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.counters[name] = trace.counters.get(name, 0) + n
+
+    @contextmanager
+    def trace(self, name):
+        """
+        Collect the spans and counters of everything run in this context into a Trace;
+        its record() is only meaningful while metrics are enabled
+        """
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def merge(self, record):
+        """
+        Add the spans and counters of a Trace record to the totals, e.g. one made in a worker process
+        """
+        with self._lock:
+            for span in record['spans']:
+                histogram = self._spans.get(span['span'])
+                if histogram is None:
+                    histogram = self._spans[span['span']] = Histogram()
+                histogram.observe(span['duration_ms'] / 1000)
+            for name, n in record['counters'].items():
+                self._counters[name] = self._counters.get(name, 0) + n
+
+    def snapshot(self):
+        with self._lock:
+            spans = {name: {'count': sum(h.counts), 'sum_seconds': h.sum} for name, h in self._spans.items()}
+            return {'spans': spans, 'counters': dict(self._counters)}
+
+    def reset(self):
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+
+    def prometheus(self):
+        """
+        :return: the totals in Prometheus text exposition format
+        """
+        with self._lock:
+            spans = {name: (list(h.counts), h.sum) for name, h in self._spans.items()}
+            counters = dict(self._counters)
+        metric = f'{self.namespace}_span_seconds'
+        lines = [f'# HELP {metric} Time spent in each stage of the annotation pipeline.',
+                 f'# TYPE {metric} histogram']
+        for name, (counts, total) in sorted(spans.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float('inf'),), counts):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{metric}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{span="{name}"}} {total}')
+            lines.append(f'{metric}_count{{span="{name}"}} {cumulative}')
+        metric = f'{self.namespace}_events_total'
+        lines += [f'# HELP {metric} Plan nodes visited, matches, misses and fallbacks.',
+                  f'# TYPE {metric} counter']
+        for name, n in sorted(counters.items()):
+            lines.append(f'{metric}{{event="{name}"}} {n}')
+        return '\n'.join(lines) + '\n'
+
+
+default_metrics = Metrics()
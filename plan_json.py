@@ -0,0 +1,109 @@
+"""
+Decoding of EXPLAIN (FORMAT JSON) output. psycopg2 turns a json column into Python objects with json.loads;
+register_plan_decoder swaps that for orjson when it is installed, or for a decoder that keeps only the keys
+matching reads (MATCHED_KEYS), so plans over thousands of partitions hold only what matching needs.
+Pausing the garbage collector while decoding is opt-in (pause_gc), for processes that own the collector,
+such as the command line; the service and the GUI decode on shared threads and leave it alone.
+"""
+import gc
+import json
+import threading
+import weakref
+from contextlib import contextmanager
+
+from psycopg2.extras import register_default_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# every key transverse_plan and parameterized_conditions read, and the 'Plan' of the document around the root
+MATCHED_KEYS = frozenset(['Plan', 'Plans', 'Node Type', 'Output', 'Relation Name', 'Alias', 'Index Name', 'Filter',
+                          'Index Cond', 'Join Filter', 'Hash Cond', 'Merge Cond'])
+
+
+_gc_lock = threading.Lock()
+_gc_pauses = 0  # decodes in progress, on any thread
+_gc_was_enabled = False
+
+
+@contextmanager
+def gc_paused():
+    """
+    Decoding allocates a container per object and array, enough to set off a collection every few
+    hundred of them, each scanning everything decoded so far; a decoded document has no cycles to find.
+    The flag is process-wide: the first decode to start turns the collector off and the last to end
+    restores it as the first found it, so only callers that own the collector should use it.
+    """
+    global _gc_pauses, _gc_was_enabled
+    with _gc_lock:
+        if _gc_pauses == 0:
+            _gc_was_enabled = gc.isenabled()
+            gc.disable()
+        _gc_pauses += 1
+    try:
+        yield
+    finally:
+        with _gc_lock:
+            _gc_pauses -= 1
+            if _gc_pauses == 0 and _gc_was_enabled:
+                gc.enable()
+
+
+def loads(text):
+    """
+    The whole document, decoded with orjson if it is installed
+    """
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def matched_object(pairs):
+    return {key: value for key, value in pairs if key in MATCHED_KEYS}
+
+
+_matched_decoder = json.JSONDecoder(object_pairs_hook=matched_object)
+
+
+def loads_matched(text):
+    """
+    The document with every object reduced to MATCHED_KEYS. An object is reduced as soon as it is
+    decoded, so the keys left out never live longer than the object holding them.
+    """
+    return _matched_decoder.decode(text)
+
+
+def gc_paused_decoder(decode):
+    """
+    :return: decode with the collector paused while it runs, see gc_paused
+    """
+    def decode_paused(text):
+        with gc_paused():
+            return decode(text)
+    return decode_paused
+
+
+_matched = weakref.WeakSet()  # connections and cursors registered with loads_matched
+
+
+def register_plan_decoder(conn_or_curs, matched=False, pause_gc=False):
+    """
+    Decode json values fetched through a connection or cursor with loads, or loads_matched if matched
+    :param pause_gc: pause the collector while decoding, see gc_paused
+    """
+    if matched:
+        _matched.add(conn_or_curs)
+    else:
+        _matched.discard(conn_or_curs)
+    decode = loads_matched if matched else loads
+    register_default_json(conn_or_curs, loads=gc_paused_decoder(decode) if pause_gc else decode)
+
+
+def plan_decoder(cursor):
+    """
+    :return: 'matched' if json values fetched through cursor are decoded with loads_matched, else 'full',
+        so plans decoded either way are never mistaken for each other
+    """
+    return 'matched' if cursor in _matched or getattr(cursor, 'connection', None) in _matched else 'full'
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+PING_QUERY = 'SELECT 1'
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of connections to one database. connect() opens a connection with its
+    session already set up, so that is done once per connection and not once per query.
+    Connections idle for longer than health_check_interval are pinged before being handed out,
+    and idle connections above minconn are closed after idle_timeout seconds.
+    """
+    def __init__(self, connect, minconn=1, maxconn=8, idle_timeout=300.0, health_check_interval=30.0,
+                 timeout=30.0):
+        self.connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.timeout = timeout
+        self.created = 0
+        self.discarded = 0
+        self._idle = []  # (connection, returned at), most recently returned last
+        self._used = set()
+        self._opening = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def getconn(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolError('connection pool is closed')
+                self._expire_idle()
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    self._used.add(conn)
+                    break
+                if len(self._used) + self._opening < self.maxconn:
+                    conn, returned_at = None, None
+                    # reserve the slot while connecting outside the lock
+                    self._opening += 1
+                    break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise PoolError(f'connection pool exhausted ({self.maxconn} connections in use)')
+                self._cond.wait(remaining)
+        if conn is None:
+            return self._open()
+        if conn.closed or (time.monotonic() - returned_at > self.health_check_interval and not self._ping(conn)):
+            self._discard(conn)
+            return self.getconn()
+        return conn
+
+    def putconn(self, conn, close=False):
+        if not close and not conn.closed and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                close = True
+        with self._cond:
+            self._used.discard(conn)
+            if close or conn.closed or self._closed:
+                self.discarded += 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                conn.close()
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'idle': len(self._idle), 'used': len(self._used) + self._opening, 'maxconn': self.maxconn,
+                    'created': self.created, 'discarded': self.discarded}
+
+    def _open(self):
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._used.add(conn)
+            self.created += 1
+        return conn
+
+    def _ping(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute(PING_QUERY)
+            return True
+        except Exception as e:
+            logging.debug('dropping dead pooled connection: %s', e)
+            return False
+
+    def _discard(self, conn):
+        with self._cond:
+            self._used.discard(conn)
+            self.discarded += 1
+            self._cond.notify()
+        if not conn.closed:
+            conn.close()
+
+    def _expire_idle(self):
+        now = time.monotonic()
+        while len(self._idle) > self.minconn and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.pop(0)
+            self.discarded += 1
+            conn.close()
+
+
+class ConnectionPools:
+    """
+    One ConnectionPool per database name, created on first use with connect(db_name)
+    """
+    def __init__(self, connect, **pool_options):
+        self.connect = connect
+        self.pool_options = pool_options
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, db_name):
+        with self._lock:
+            pool = self._pools.get(db_name)
+            if pool is None:
+                pool = self._pools[db_name] = ConnectionPool(lambda: self.connect(db_name), **self.pool_options)
+            return pool
+
+    def closeall(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.closeall()
+            self._pools = {}
@@ -1,6 +1,8 @@
 import logging
 import typing
 
+from catalog import default_catalog
+
 
 def preprocess_query_string(query):
     return ' '.join([word.lower() if word[0] != '"' and word[0] != "'" else word for word in query.split()])
@@ -50,21 +52,18 @@ def rename_column_to_full_name(query_tree: typing.Union[dict, list], column_rela
         raise NotImplementedError(f"{query_tree}")
 
 
-def preprocess_query_tree(cur, query_tree):
+def preprocess_query_tree(cur, query_tree, catalog=None, relation_columns=None):
     rel_list = []
     column_relation_dict = {}
     collect_relation_list(query_tree, rel_list)
-    logging.debug(f'rel_list={rel_list}')
+    logging.debug('rel_list=%s', rel_list)
     # Collect column info
-    for rel in rel_list:
-        cur.execute(f"SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS WHERE table_name = '{rel}'")
-        res = cur.fetchall()
-        # pprint(res)
-        for col in res:
-            if col in column_relation_dict:
-                column_relation_dict[col[0]].append(rel)
-            else:
-                column_relation_dict[col[0]] = [rel]
-    logging.debug(f'column_relation_dict={column_relation_dict}')
+    if relation_columns is None:
+        relation_columns = (catalog or default_catalog).relations(cur)
+    for rel in dict.fromkeys(rel_list):  # self-joins list the same relation more than once
+        for col in relation_columns.get(rel, ()):
+            column_relation_dict.setdefault(col, []).append(rel)
+    logging.debug('column_relation_dict=%s', column_relation_dict)
     # For every column, if no dot, try to find in dict, if multiple relation raise exception, else rename
-    rename_column_to_full_name(query_tree, column_relation_dict)
\ No newline at end of file
+    rename_column_to_full_name(query_tree, column_relation_dict)
+    return column_relation_dict
\ No newline at end of file
@@ -0,0 +1,166 @@
+from condition import comparison_key, condition_keys
+from metrics import default_metrics
+
+COMPARISON_OPERATORS = {
+    'gt': (' > ', ' < '),
+    'lt': (' < ', ' > '),
+    'eq': (' = ', ' = '),
+    'neq': (' <> ', ' <> '),
+    'gte': (' >= ', ' <= '),
+    'lte': (' <= ', ' >= '),
+    'like': (' ~~ ', ' ~~ '),
+    'not_like': (' !~~ ', ' !~~ '),
+}
+
+def comparison_operands(operands):
+    """
+    Render the operands of a comparison the way they appear in a plan condition;
+    anything that is not a column or a constant becomes a '$' placeholder
+    """
+    arr = []
+    for subq in operands:
+        if type(subq) is str:
+            arr.append(subq)
+        elif type(subq) in [int, float]:
+            arr.append(str(subq))
+        elif type(subq) is dict:
+            if 'literal' in subq:
+                arr.append(f"'{subq['literal']}'")
+            elif 'date' in subq:
+                arr.append(f"'{subq['date']['literal']}'")
+            else:
+                arr.append('$')
+        else:
+            raise NotImplementedError(f'{subq}')
+    return arr
+
+
+class QueryIndex:
+    """
+    Lookup structures over the FROM and WHERE clauses of a parsed query, built once per query.
+    Comparisons are keyed by their canonical form (see condition.py), relations by (name, alias),
+    and every indexed node remembers its parent so a plan node only visits the paths leading to a match.
+    """
+    def __init__(self, query: dict):
+        self.parents = {}
+        self.expressions = {}
+        self.predicates = {}
+        self.unkeyed_predicates = []
+        self.relations = {}
+        self.column_pairs = {}
+        self.hot = set()
+        self._conditions = {}
+        self._index_query(query, None)
+
+    def prepare(self, result):
+        """
+        Mark the nodes find_query_node has to visit for this plan node
+        :param result: a PlanNode from annotation.transverse_plan
+        """
+        self.hot = set()
+        if result.filter != '':
+            for node in self.matching_predicates(result.filter):
+                self._mark(node)
+        elif result.lhs is not None:
+            for cond in result.parameterized or self.join_candidates(result.lhs, result.rhs):
+                for node in self.matching_predicates(cond):
+                    self._mark(node)
+        if result.kind == 'Scan':
+            for container in self.relations.get((result.name, result.alias), ()):
+                self._mark(container)
+
+    def join_candidates(self, lhs: list, rhs: list):
+        """
+        Equalities 'x = y' the query states between an output column x of the outer side and
+        an output column y of the inner side, found through the column pairs of its equality predicates
+        """
+        inner = {}
+        for y in rhs:
+            for name in {y, y.rsplit('.', 1)[-1]}:
+                inner.setdefault(name, []).append(y)
+        candidates = []
+        for x in lhs:
+            for name in {x, x.rsplit('.', 1)[-1]}:
+                for partner in self.column_pairs.get(name, ()):
+                    candidates.extend(f'{x} = {y}' for y in inner.get(partner, ()))
+        return list(dict.fromkeys(candidates))
+
+    def matching_predicates(self, condition: str):
+        matches = self._conditions.get(condition)
+        if matches is None:
+            keys = condition_keys(condition)
+            matches = {}
+            if keys is None:
+                # unparseable condition, fall back to looking for the comparison text
+                default_metrics.count('unparsed_condition')
+                candidates = [node for nodes in self.predicates.values() for node in nodes] + self.unkeyed_predicates
+            else:
+                for key in keys:
+                    for node in self.predicates.get(key, ()):
+                        matches[id(node)] = node
+                candidates = self.unkeyed_predicates
+            for node in candidates:
+                if any(x in condition for x in self.expressions[id(node)]):
+                    matches[id(node)] = node
+            self._conditions[condition] = matches
+        return matches.values()
+
+    def is_match(self, node: dict, condition: str) -> bool:
+        self.matching_predicates(condition)
+        return id(node) in self._conditions[condition]
+
+    def _mark(self, node):
+        while node is not None and id(node) not in self.hot:
+            self.hot.add(id(node))
+            node = self.parents.get(id(node))
+
+    def _index_query(self, query: dict, parent):
+        self.parents[id(query)] = parent
+        if 'where' in query and type(query['where']) is dict:
+            self._index_expr(query['where'], query)
+        if 'from' in query:
+            self._index_from(query['from'], query)
+
+    def _index_from(self, rel, parent):
+        if type(rel) is str:
+            self.relations.setdefault((rel, rel), []).append(parent)
+        elif type(rel) is dict:
+            self.parents[id(rel)] = parent
+            if type(rel.get('value')) is dict:
+                self._index_query(rel['value'], rel)
+            elif type(rel.get('value')) is str:
+                self.relations.setdefault((rel['value'], rel.get('name', '')), []).append(rel)
+        elif type(rel) is list:
+            self.parents[id(rel)] = parent
+            for r in rel:
+                self._index_from(r, rel)
+
+    def _index_expr(self, query: dict, parent):
+        self.parents[id(query)] = parent
+        op = list(query.keys())[0]
+        if op in ['and', 'or']:
+            for subq in query[op]:
+                if type(subq) is dict:
+                    self._index_expr(subq, query)
+        elif op in COMPARISON_OPERATORS:
+            arr = comparison_operands(query[op])
+            self.expressions[id(query)] = (COMPARISON_OPERATORS[op][0].join(arr),
+                                           COMPARISON_OPERATORS[op][1].join(reversed(arr)))
+            if op == 'eq' and all(type(subq) is str for subq in query[op]):
+                left, right = query[op]
+                self.column_pairs.setdefault(left, set()).add(right)
+                self.column_pairs.setdefault(right, set()).add(left)
+            key = comparison_key(op, query[op])
+            if key is not None:
+                self.predicates.setdefault(key, []).append(query)
+            else:
+                self.unkeyed_predicates.append(query)
+            for subq in query[op]:
+                if type(subq) is dict and not subq.keys() & {'literal', 'date', 'sub', 'add'}:
+                    self._index_query(subq, query)
+        elif op == 'exists' and type(query[op]) is dict:
+            self._index_query(query[op], query)
+        elif op == 'not' and type(query[op]) is dict:
+            self._index_expr(query[op], query)
+        elif op in ['in', 'nin'] and type(query[op][1]) is dict and 'literal' not in query[op][1]:
+            self._index_query(query[op][1], query)
@@ -0,0 +1,181 @@
+"""
+Record the database calls the annotator makes and serve them back without a database.
+A fixture is a JSON file of connection info plus, for every SQL statement, the rows it returned
+or the error it raised. Recording wraps live connections; replaying needs only the file.
+"""
+import atexit
+import copy
+import json
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import psycopg2
+import psycopg2.errors
+from psycopg2 import extensions
+
+from pool import PING_QUERY, ConnectionPools
+
+
+class ReplayMiss(LookupError):
+    pass
+
+
+class Fixture:
+    def __init__(self, info=None, calls=None):
+        self.info = info or {'host': 'replay', 'port': 0, 'dbname': ''}
+        self.calls = {PING_QUERY: {'rows': [[1]]}, **(calls or {})}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['info'], data['calls'])
+
+    def save(self, path):
+        with self._lock:
+            data = {'info': self.info, 'calls': dict(sorted(self.calls.items()))}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+
+    def record(self, sql, rows=None, error=None):
+        with self._lock:
+            if error is None:
+                self.calls[sql] = {'rows': [list(row) for row in rows]}
+            else:
+                self.calls[sql] = {'error': type(error).__name__, 'message': str(error)}
+
+    def lookup(self, sql):
+        call = self.calls.get(sql)
+        if call is None:
+            raise ReplayMiss(f'no recorded result for {sql}')
+        if 'error' in call:
+            raise getattr(psycopg2.errors, call['error'], psycopg2.Error)(call['message'])
+        # fresh objects on every call, as psycopg2 decodes each result anew
+        return [tuple(row) for row in copy.deepcopy(call['rows'])]
+
+
+class ReplayCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+
+    def execute(self, sql, args=None):
+        if self.connection.closed:
+            raise psycopg2.InterfaceError('connection already closed')
+        if args is not None:
+            sql = f'{sql} -- {json.dumps(args)}'
+        if self.connection.latency:
+            time.sleep(self.connection.latency)
+        self._rows = self.connection.fixture.lookup(sql)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class ReplayConnection:
+    """
+    Stands in for a psycopg2 connection, answering every statement from a Fixture after `latency` seconds
+    """
+    def __init__(self, fixture, latency=0.0):
+        self.fixture = fixture
+        self.latency = latency
+        self.closed = 0
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE, **fixture.info)
+
+    def cursor(self):
+        return ReplayCursor(self)
+
+    def cancel(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = 1
+
+
+class RecordingCursor:
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self._cursor = cursor
+        self._rows = []
+
+    def execute(self, sql, args=None):
+        key = sql if args is None else f'{sql} -- {json.dumps(args)}'
+        try:
+            self._cursor.execute(sql) if args is None else self._cursor.execute(sql, args)
+            self._rows = self._cursor.fetchall() if self._cursor.description is not None else []
+        except psycopg2.Error as e:
+            self.connection.fixture.record(key, error=e)
+            raise
+        self.connection.fixture.record(key, self._rows)
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RecordingConnection:
+    """
+    Wraps a live psycopg2 connection and records every statement run through its cursors
+    """
+    def __init__(self, conn, fixture):
+        self._conn = conn
+        self.fixture = fixture
+        fixture.info = {'host': conn.info.host, 'port': conn.info.port, 'dbname': conn.info.dbname}
+
+    def cursor(self):
+        return RecordingCursor(self, self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def fixture_pools(path, mode='replay', latency=0.0, connect=None):
+    """
+    ConnectionPools for tests and benchmarks
+    :param mode: 'replay' serves connections from the fixture at path, 'record' wraps connections
+        from connect(db_name) and writes what they did to path at exit, 'live' just uses connect
+    """
+    if connect is None:
+        from annotation import connect_db
+        connect = connect_db
+    if mode == 'live':
+        return ConnectionPools(connect)
+    if mode == 'record':
+        fixture = Fixture.load(path) if os.path.exists(path) else Fixture()
+        atexit.register(fixture.save, path)
+        return ConnectionPools(lambda db_name: RecordingConnection(connect(db_name), fixture))
+    if mode == 'replay':
+        fixture = Fixture.load(path)
+        return ConnectionPools(lambda db_name: ReplayConnection(fixture, latency))
+    raise ValueError(f'unknown database mode {mode}')
@@ -0,0 +1,129 @@
+"""
+Time, peak and retained memory of decoding EXPLAIN output with each decoder in plan_json.py, e.g.
+python scripts/bench_plan_json.py --partitions 1000 10000
+python scripts/bench_plan_json.py --partitions 10000 --repeat 3 plans/partitioned.json
+
+Plans are the EXPLAIN results recorded in the replay fixture, plus an Append over --partitions copies of
+the largest recorded scan standing in for a partitioned table; paths add saved EXPLAIN (FORMAT JSON) output.
+Every decoder has to give the same match records as json.loads.
+"""
+import argparse
+import copy
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import plan_json
+from annotation import load_plan, transverse_plan
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures', 'tpch.json')
+EXPLAIN = 'EXPLAIN'
+
+
+def recorded_plans(path):
+    """
+    :return: the EXPLAIN documents in a replay fixture, as EXPLAIN returns them
+    """
+    with open(path, encoding='utf-8') as f:
+        calls = json.load(f)['calls']
+    return [entry['rows'][0][0] for sql, entry in calls.items() if sql.startswith(EXPLAIN) and entry.get('rows')]
+
+
+def scans(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node['Node Type'].endswith('Scan'):
+            yield node
+        stack.extend(node.get('Plans', ()))
+
+
+def partitioned_plan(documents, partitions):
+    """
+    An Append over partitions copies of the recorded scan with the most keys, each its own relation
+    """
+    scan = max((node for document in documents for node in scans(document[0]['Plan'])), key=len)
+    children = []
+    for i in range(partitions):
+        child = copy.deepcopy(scan)
+        child['Relation Name'] = child['Alias'] = f"{scan['Relation Name']}_p{i}"
+        child['Output'] = [column.replace(scan['Alias'], child['Alias'], 1) for column in scan.get('Output', [])]
+        children.append(child)
+    return [{'Plan': {'Node Type': 'Append', 'Parallel Aware': False, 'Async Capable': False,
+                      'Output': scan.get('Output', []), 'Subplans Removed': 0, 'Plans': children},
+             'Planning Time': 1.0}]
+
+
+def records(document):
+    """
+    :return: what matching sees of document, or the error traversing it
+    """
+    try:
+        return [(r.kind, r.subtype, r.filter, r.name, r.alias, r.lhs, r.rhs, r.parameterized)
+                for r in transverse_plan(load_plan(document)[0][0]['Plan'])]
+    except AssertionError as e:
+        return repr(e)
+
+
+def measure(decode, text, repeat):
+    """
+    :return: best seconds per call, peak bytes while decoding, bytes held by the result
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        decode(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        result = decode(text)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return best, peak, current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('paths', nargs='*', help='files holding EXPLAIN (FORMAT JSON) output')
+    parser.add_argument('--fixture', default=FIXTURE)
+    parser.add_argument('--partitions', type=int, nargs='*', default=[1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    # json is what psycopg2 registers by default, loads is orjson when installed; the last two are what the
+    # command line registers, with the collector paused
+    decoders = {'json': json.loads, 'loads': plan_json.loads, 'matched': plan_json.loads_matched,
+                'loads+gc': plan_json.gc_paused_decoder(plan_json.loads),
+                'matched+gc': plan_json.gc_paused_decoder(plan_json.loads_matched)}
+    if plan_json.orjson is None:
+        print('orjson is not installed, loads uses json')
+
+    documents = recorded_plans(args.fixture)
+    texts = [(f'fixture ({len(documents)} plans)', [json.dumps(document) for document in documents])]
+    texts += [(f'{n} partitions', [json.dumps(partitioned_plan(documents, n))]) for n in args.partitions]
+    for path in args.paths:
+        with open(path, encoding='utf-8') as f:
+            texts.append((os.path.basename(path), [f.read()]))
+
+    print(f"{'plans':24}{'KiB':>9}{'decoder':>11}{'ms':>10}{'peak KiB':>10}{'held KiB':>10}")
+    for name, batch in texts:
+        expected = [records(json.loads(text)) for text in batch]
+        size = sum(len(text) for text in batch) / 1024
+        for decoder, decode in decoders.items():
+            assert [records(decode(text)) for text in batch] == expected, f'{decoder} changed the match records'
+            results = [measure(decode, text, args.repeat) for text in batch]
+            print(f"{name:24}{size:9.0f}{decoder:>11}{sum(r[0] for r in results) * 1000:10.2f}"
+                  f"{max(r[1] for r in results) / 1024:10.0f}{sum(r[2] for r in results) / 1024:10.0f}")
+
+
+if __name__ == '__main__':
+    main()
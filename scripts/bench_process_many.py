@@ -0,0 +1,57 @@
+"""
+Throughput of process_many with thread and process workers, e.g.
+python scripts/bench_process_many.py --db TPC-H --workers 1 2 4 8 --repeat 20
+
+Plans and the column catalog are cached by a warm-up pass first, so this measures the CPU stage.
+Queries default to the test cases in tests/test.py.
+"""
+import argparse
+import ast
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from annotation import process_many
+
+
+def test_queries():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'test.py')) as f:
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, 'attr', '') == 'parametrize':
+            return ast.literal_eval(node.args[1])
+    return []
+
+
+def run(db_name, queries, **options):
+    start = time.perf_counter()
+    errors = sum(item['error'] is not None for item in process_many(db_name, queries, **options))
+    return time.perf_counter() - start, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='TPC-H')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--chunksize', type=int, default=8)
+    parser.add_argument('--connections', type=int, default=4)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    queries = test_queries() * args.repeat
+    run(args.db, queries[:len(queries) // args.repeat], connections=args.connections)
+    print(f'{len(queries)} queries, {os.cpu_count()} cores')
+    for processes in [False, True]:
+        for workers in sorted(set(args.workers)):
+            elapsed, errors = run(args.db, queries, jobs=workers, connections=args.connections,
+                                  processes=processes, chunksize=args.chunksize)
+            print(f"{'processes' if processes else 'threads':9} {workers:3} workers "
+                  f"{len(queries) / elapsed:8.1f} queries/s ({errors} errors)")
+
+
+if __name__ == '__main__':
+    main()
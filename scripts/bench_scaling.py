@@ -0,0 +1,188 @@
+"""
+Annotator time and memory against query size, over the synthetic shapes in workload.py, e.g.
+python scripts/bench_scaling.py --shapes join or_chain --sizes 10 100 1000 10000 --plot scaling.png
+
+For every shape and size it reports the best of --repeat runs of each CPU stage, the tracemalloc peak
+of a whole annotation, and the growth exponent k of time ~ size^k since the previous size; k well above 1
+marks a stage going superlinear. A size that fails is a row too, with the exception type and the first size
+the shape failed at, and the next size is still tried; a shape stops growing once a run takes longer than --budget.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mo_sql_parsing import parse
+
+from annotation import Annotations, load_plan, process_offline, reparse_query, transverse_query, warm_up_worker
+from preprocessing import preprocess_query_string, preprocess_query_tree
+from workload import SHAPES, generate
+
+STAGES = ['parse', 'preprocess_query_tree', 'transverse_query', 'reparse_query']
+
+
+def time_stages(query, plan, relation_columns):
+    """
+    :return: {stage: seconds} for one annotation
+    """
+    timings = {}
+    start = time.perf_counter()
+    tree = parse(query)
+    timings['parse'] = time.perf_counter() - start
+    start = time.perf_counter()
+    preprocess_query_tree(None, tree, relation_columns=relation_columns)
+    timings['preprocess_query_tree'] = time.perf_counter() - start
+    start = time.perf_counter()
+    annotations = Annotations()
+    transverse_query(tree, plan[0][0]['Plan'], annotations=annotations)
+    timings['transverse_query'] = time.perf_counter() - start
+    start = time.perf_counter()
+    reparse_query([], tree, annotations)
+    timings['reparse_query'] = time.perf_counter() - start
+    return timings
+
+
+def peak_memory(query, plan_document, relation_columns):
+    tracemalloc.start()
+    try:
+        process_offline(query, plan_document, relation_columns)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(shape, size, repeat):
+    query, plan_document, relation_columns = generate(shape, size)
+    query = preprocess_query_string(query)
+    plan = load_plan(plan_document)
+    runs = [time_stages(query, plan, relation_columns) for _ in range(repeat)]
+    timings = {stage: min(run[stage] for run in runs) for stage in STAGES}
+    return {
+        'shape': shape,
+        'size': size,
+        'query_chars': len(query),
+        **{f'{stage}_ms': timings[stage] * 1000 for stage in STAGES},
+        'total_ms': sum(timings.values()) * 1000,
+        'peak_kib': peak_memory(query, plan_document, relation_columns) / 1024,
+        'error_type': None,
+        'error': None,
+        'first_failing_size': None,
+    }
+
+
+def growth(before, after, key):
+    """
+    Exponent k in time ~ size^k from row before to row after
+    """
+    if before is None or before[key] <= 0 or after[key] <= 0 or after['size'] == before['size']:
+        return None
+    return math.log(after[key] / before[key]) / math.log(after['size'] / before['size'])
+
+
+def run_shape(shape, sizes, repeat, budget):
+    """
+    :return: generator of rows in increasing size, stopping after a run over budget; growth is measured
+        from the last size that did not fail
+    """
+    previous = first_failing_size = None
+    for size in sorted(sizes):
+        start = time.perf_counter()
+        try:
+            row = measure(shape, size, repeat)
+        except Exception as e:
+            first_failing_size = size if first_failing_size is None else first_failing_size
+            yield {'shape': shape, 'size': size, 'error_type': type(e).__name__, 'error': str(e)[:200],
+                   'first_failing_size': first_failing_size}
+            continue
+        row['first_failing_size'] = first_failing_size
+        for key in ['total_ms'] + [f'{stage}_ms' for stage in STAGES]:
+            row[f'{key[:-3]}_k'] = growth(previous, row, key)
+        yield row
+        if (time.perf_counter() - start) / (repeat + 1) > budget:
+            return
+        previous = row
+
+
+HEADER = f"{'shape':9}{'size':>7}{'total ms':>11}{'k':>6}" + ''.join(f'{stage[:14]:>16}' for stage in STAGES) + \
+         f"{'peak KiB':>11}"
+
+
+def format_row(row):
+    if row['error'] is not None:
+        return f"{row['shape']:9}{row['size']:7}  failed: {row['error_type']}: {row['error']}"
+    k = '' if row['total_k'] is None else f"{row['total_k']:.2f}"
+    stages = ''.join(f"{row[f'{stage}_ms']:10.2f}" + ('' if row[f'{stage}_k'] is None else
+                                                     f" k{row[f'{stage}_k']:4.1f}").ljust(6) for stage in STAGES)
+    return f"{row['shape']:9}{row['size']:7}{row['total_ms']:11.2f}{k:>6}{stages}{row['peak_kib']:11.0f}"
+
+
+def failures(rows):
+    """
+    :return: {shape: (exception type at its first failing size, first failing size)}
+    """
+    failed = {}
+    for row in rows:
+        if row['error'] is not None and row['shape'] not in failed:
+            failed[row['shape']] = (row['error_type'], row['first_failing_size'])
+    return failed
+
+
+def plot(rows, path):
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        logging.error('--plot needs matplotlib, pip install matplotlib')
+        return
+    fig, (time_ax, memory_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    for shape in dict.fromkeys(row['shape'] for row in rows):
+        measured = [row for row in rows if row['shape'] == shape and row['error'] is None]
+        sizes = [row['size'] for row in measured]
+        time_ax.plot(sizes, [row['total_ms'] for row in measured], marker='o', label=shape)
+        memory_ax.plot(sizes, [row['peak_kib'] for row in measured], marker='o', label=shape)
+    for ax, label in [(time_ax, 'annotation time (ms)'), (memory_ax, 'peak memory (KiB)')]:
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('size')
+        ax.set_ylabel(label)
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2, 5, 10, 20, 50, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=10.0, help='seconds per annotation before a shape stops')
+    parser.add_argument('--output', help='write the rows as JSON to this file')
+    parser.add_argument('--plot', help='draw time and memory against size to this image, needs matplotlib')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    warm_up_worker(logging.ERROR)
+
+    rows = []
+    print(HEADER)
+    for shape in args.shapes:
+        for row in run_shape(shape, args.sizes, args.repeat, args.budget):
+            rows.append(row)
+            print(format_row(row), flush=True)
+    for shape, (error_type, size) in failures(rows).items():
+        print(f'{shape} fails from size {size} with {error_type}')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(rows, f, indent=1)
+    if args.plot:
+        plot(rows, args.plot)
+
+
+if __name__ == '__main__':
+    main()
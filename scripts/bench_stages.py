@@ -0,0 +1,196 @@
+"""
+Latency, allocations and throughput of every stage of process, per query, e.g.
+python scripts/bench_stages.py --repeat 50 --output baseline.json
+python scripts/bench_stages.py --repeat 50 --baseline baseline.json
+
+Queries are the test cases in tests/test.py, EXPLAINed from the replay fixture by default
+(--mode live uses the database, --latency adds simulated round-trip time to replayed calls).
+--synthetic N adds generated queries with N predicates; those need --mode live.
+Exits with status 1 when a stage's median or p90 is slower than the baseline by more than --threshold.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from mo_sql_parsing import parse
+
+from annotation import Annotations, get_query_execution_plan, reparse_query, transverse_query
+from bench_process_many import test_queries
+from catalog import default_catalog
+from preprocessing import preprocess_query_string, preprocess_query_tree
+from replay import fixture_pools
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'fixtures', 'tpch.json')
+STAGES = ['preprocess_query_string', 'explain', 'parse', 'preprocess_query_tree', 'transverse_query',
+          'reparse_query']
+PERCENTILES = [50, 90, 99]
+
+
+def synthetic_query(predicates):
+    """
+    A three-way join whose WHERE clause grows with predicates
+    """
+    ranges = ' OR '.join(f'(c_acctbal > {i * 10} AND n_nationkey = {i % 25})' for i in range(predicates))
+    return ('SELECT c_custkey, n_name, r_name FROM customer, nation, region '
+            f'WHERE c_nationkey = n_nationkey AND n_regionkey = r_regionkey AND ({ranges})')
+
+
+def run_stages(cur, query, relation_columns):
+    """
+    One pass of process over query, one stage at a time
+    :return: generator of (stage, step), each step working on the results of the ones before
+    """
+    state = {'annotations': Annotations()}
+    yield 'preprocess_query_string', lambda: state.update(query=preprocess_query_string(query))
+    yield 'explain', lambda: state.update(plan=get_query_execution_plan(cur, state['query']))
+    yield 'parse', lambda: state.update(tree=parse(state['query']))
+    yield 'preprocess_query_tree', lambda: preprocess_query_tree(None, state['tree'],
+                                                                 relation_columns=relation_columns)
+    yield 'transverse_query', lambda: transverse_query(state['tree'], state['plan'][0][0]['Plan'],
+                                                       annotations=state['annotations'])
+    yield 'reparse_query', lambda: reparse_query([], state['tree'], state['annotations'])
+
+
+def measure(cur, query, relation_columns, repeat):
+    """
+    :return: {stage: seconds per call}, {stage: peak bytes allocated}, error or None
+    """
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        for stage, step in run_stages(cur, query, relation_columns):
+            start = time.perf_counter()
+            try:
+                step()
+            except Exception as e:
+                return timings, {}, f'{stage}: {type(e).__name__}: {e}'
+            timings[stage].append(time.perf_counter() - start)
+
+    # a separate pass, tracing allocations distorts timings
+    allocations = {}
+    tracemalloc.start()
+    try:
+        for stage, step in run_stages(cur, query, relation_columns):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            step()
+            allocations[stage] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return timings, allocations, None
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, round(p / 100 * (len(values) - 1)))]
+
+
+def summarize(timings, allocations):
+    """
+    :param timings: {stage: [seconds]} over every query and repetition
+    :param allocations: {stage: [peak bytes]} per query
+    """
+    summary = {}
+    for stage in STAGES:
+        values = timings[stage]
+        if not values:
+            continue
+        total = sum(values)
+        summary[stage] = {
+            'calls': len(values),
+            'mean_ms': total / len(values) * 1000,
+            **{f'p{p}_ms': percentile(values, p) * 1000 for p in PERCENTILES},
+            'max_ms': max(values) * 1000,
+            'calls_per_s': len(values) / total if total else None,
+            'peak_kib': sum(allocations[stage]) / len(allocations[stage]) / 1024 if allocations[stage] else None,
+        }
+    return summary
+
+
+def compare(summary, baseline, threshold):
+    """
+    :return: list of (stage, metric, baseline value, current value) more than threshold slower
+    """
+    regressions = []
+    for stage, current in summary.items():
+        before = baseline.get('stages', {}).get(stage)
+        if before is None:
+            continue
+        for metric in ['p50_ms', 'p90_ms']:
+            if current[metric] > before[metric] * (1 + threshold):
+                regressions.append((stage, metric, before[metric], current[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='TPC-H')
+    parser.add_argument('--mode', choices=['replay', 'live'], default='replay')
+    parser.add_argument('--fixture', default=FIXTURE)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every replayed call')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--synthetic', type=int, nargs='*', default=[], metavar='N',
+                        help='also run generated queries with N predicates')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown, 0.2 is 20%%')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+
+    queries = test_queries() + [synthetic_query(n) for n in args.synthetic]
+    pools = fixture_pools(args.fixture, args.mode, args.latency)
+    timings = {stage: [] for stage in STAGES}
+    allocations = {stage: [] for stage in STAGES}
+    errors = []
+    with pools.get(args.db).connection() as conn:
+        cur = conn.cursor()
+        relation_columns = default_catalog.relations(cur)
+        for query in queries:
+            query_timings, query_allocations, error = measure(cur, query, relation_columns, args.repeat)
+            if error is not None:
+                errors.append({'query': query, 'error': error})
+                continue
+            for stage in STAGES:
+                timings[stage].extend(query_timings[stage])
+                allocations[stage].append(query_allocations[stage])
+
+    summary = summarize(timings, allocations)
+    print(f'{len(queries) - len(errors)} of {len(queries)} queries, {args.repeat} repetitions, {args.mode} database')
+    print(f"{'stage':24}{'mean':>9}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}{'calls/s':>10}{'peak KiB':>10}")
+    for stage, row in summary.items():
+        print(f"{stage:24}{row['mean_ms']:9.3f}{row['p50_ms']:9.3f}{row['p90_ms']:9.3f}{row['p99_ms']:9.3f}"
+              f"{row['max_ms']:9.3f}{row['calls_per_s'] or 0:10.0f}{row['peak_kib'] or 0:10.1f}")
+    for error in errors:
+        print(f"failed: {error['error']}")
+
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'mode': args.mode,
+        'latency': args.latency,
+        'repeat': args.repeat,
+        'queries': len(queries),
+        'stages': summary,
+        'errors': errors,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(summary, json.load(f), args.threshold)
+        for stage, metric, before, after in regressions:
+            print(f'REGRESSION {stage} {metric}: {before:.3f} ms -> {after:.3f} ms')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Long-running annotation service, e.g.
+python service.py --db TPC-H --port 8080
+curl -d '{"query": "SELECT * FROM nation"}' localhost:8080/annotate
+
+POST /annotate  {"query": ..., "db": optional, one of --db and --databases, "timeout": optional seconds}
+                -> {"result": [{"statement": ..., "annotation": ...}, ...], "coverage": {...}}
+                with "trace": true the reply also holds the request's timing spans and counters
+GET  /health    -> {"status": "ok", ...}
+GET  /metrics   -> counters, queue depth, cache and pool statistics
+GET  /metrics/prometheus -> pipeline spans and counters in Prometheus text format
+"""
+import argparse
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from psycopg2.extensions import QueryCanceledError
+
+from annotation import default_pools, process, warm_up_worker
+from cache import default_ast_cache, default_plan_cache
+from catalog import default_catalog
+from match_stats import MatchStats, default_coverage
+from metrics import default_metrics
+
+
+class Job:
+    def __init__(self, query, db_name, deadline, trace=False):
+        self.query = query
+        self.db_name = db_name
+        self.deadline = deadline
+        self.id = None
+        self.trace = trace
+        self.trace_record = None
+        self.result = None
+        self.coverage = None
+        self.error = None
+        self.cancelled = False
+        self.done = threading.Event()
+
+    def finish(self, result=None, error=None, coverage=None):
+        self.result = result
+        self.coverage = coverage
+        self.error = error
+        self.done.set()
+
+
+class AnnotationService:
+    """
+    Queue of annotation jobs served by a fixed set of worker threads. Connection pools, the catalog
+    and the plan and parse caches are module-level, so they stay warm across requests.
+    submit raises queue.Full when queue_size jobs are already waiting, and ValueError for a database
+    other than db_name and databases, so clients cannot open a pool per name they make up.
+    """
+    def __init__(self, db_name, workers=4, queue_size=64, timeout=30.0, pools=None, databases=()):
+        self.db_name = db_name
+        self.databases = frozenset([db_name, *databases])
+        self.workers = workers
+        self.timeout = timeout
+        self.pools = pools or default_pools
+        self.started_at = time.time()
+        self.counters = {'requests': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'expired': 0}
+        self.busy_seconds = 0.0
+        self._jobs = queue.Queue(queue_size)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._metrics_enabled = None
+
+    def start(self):
+        self._metrics_enabled = default_metrics.enabled
+        default_metrics.enable()
+        warm_up_worker(logging.getLogger().level)
+        try:
+            with self.pools.get(self.db_name).connection() as conn:
+                default_catalog.relations(conn.cursor())
+        except Exception as e:
+            logging.warning(f'could not warm up {self.db_name}: {e}')
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'annotate-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._metrics_enabled is not None:
+            default_metrics.enable(self._metrics_enabled)
+            self._metrics_enabled = None
+
+    def submit(self, query, db_name=None, timeout=None, trace=False):
+        if db_name is not None and db_name not in self.databases:
+            raise ValueError(f'database {db_name!r} is not served')
+        job = Job(query, db_name or self.db_name, time.monotonic() + (timeout or self.timeout), trace)
+        with self._lock:
+            self.counters['requests'] += 1
+            job.id = self.counters['requests']
+        try:
+            self._jobs.put_nowait(job)
+        except queue.Full:
+            self._count('rejected')
+            raise
+        return job
+
+    def health(self):
+        alive = sum(thread.is_alive() for thread in self._threads)
+        return {'status': 'ok' if alive == self.workers else 'degraded', 'workers': alive,
+                'queued': self._jobs.qsize(), 'queue_size': self._jobs.maxsize}
+
+    def metrics(self):
+        with self._lock:
+            counters = dict(self.counters)
+            busy_seconds = self.busy_seconds
+        return {
+            **counters,
+            'busy_seconds': round(busy_seconds, 3),
+            'uptime_seconds': round(time.time() - self.started_at, 3),
+            'queued': self._jobs.qsize(),
+            'plan_cache': default_plan_cache.stats(),
+            'ast_cache': default_ast_cache.stats(),
+            'catalog': default_catalog.stats(),
+            'pool': self.pools.get(self.db_name).stats(),
+            'pipeline': default_metrics.snapshot(),
+            'coverage': default_coverage.snapshot(),
+        }
+
+    def _count(self, name, busy_seconds=0.0):
+        with self._lock:
+            self.counters[name] += 1
+            self.busy_seconds += busy_seconds
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            remaining = job.deadline - time.monotonic()
+            if job.cancelled or remaining <= 0:
+                self._count('expired')
+                job.finish(error=TimeoutError('deadline passed while queued'))
+                continue
+            start = time.monotonic()
+            try:
+                with self.pools.get(job.db_name).connection() as conn, default_metrics.trace(job.id) as trace:
+                    # the deadline also covers EXPLAIN, which the server aborts on cancel
+                    timer = threading.Timer(remaining, conn.cancel)
+                    timer.start()
+                    try:
+                        stats = MatchStats()
+                        statements, annotations = process(conn, job.query, stats)
+                    finally:
+                        timer.cancel()
+                        # a cancel already under way must not reach the next job on this connection
+                        timer.join()
+                        if job.trace:
+                            job.trace_record = trace.record()
+            except QueryCanceledError:
+                self._count('expired', time.monotonic() - start)
+                job.finish(error=TimeoutError('deadline passed during EXPLAIN'))
+            except Exception as e:
+                logging.debug('annotation failed: %s', e)
+                self._count('failed', time.monotonic() - start)
+                job.finish(error=e)
+            else:
+                if time.monotonic() > job.deadline:
+                    self._count('expired', time.monotonic() - start)
+                    job.finish(error=TimeoutError('deadline passed during annotation'))
+                    continue
+                self._count('completed', time.monotonic() - start)
+                job.finish(result=[{'statement': s, 'annotation': a} for s, a in zip(statements, annotations)],
+                           coverage=stats.as_dict())
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    service = None
+    max_body = 1 << 20  # bytes
+
+    def do_GET(self):
+        if self.path == '/health':
+            health = self.service.health()
+            self.reply(200 if health['status'] == 'ok' else 503, health)
+        elif self.path == '/metrics':
+            self.reply(200, self.service.metrics())
+        elif self.path == '/metrics/prometheus':
+            self.reply(200, default_metrics.prometheus(), content_type='text/plain; version=0.0.4')
+        else:
+            self.reply(404, {'error': f'no such endpoint {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/annotate':
+            self.reply(404, {'error': f'no such endpoint {self.path}'})
+            return
+        try:
+            # a negative length would make read() wait for the client to close the connection
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError(f'Content-Length {length}')
+        except (ValueError, TypeError):
+            self.reply(400, {'error': 'bad request: Content-Length must be a length in bytes'})
+            return
+        if length > self.max_body:
+            self.reply(413, {'error': f'request body over {self.max_body} bytes'})
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+            query, db_name, timeout, trace = body['query'], body.get('db'), body.get('timeout'), body.get('trace')
+            if type(query) is not str or (timeout is not None and type(timeout) not in [int, float]):
+                raise ValueError('query must be a string and timeout a number')
+            job = self.service.submit(query, db_name, timeout, trace is True)
+        except (ValueError, KeyError, TypeError) as e:
+            self.reply(400, {'error': f'bad request: {e}'})
+            return
+        except queue.Full:
+            self.reply(429, {'error': 'too many queued requests'}, {'Retry-After': '1'})
+            return
+        if not job.done.wait(max(job.deadline - time.monotonic(), 0) + 1.0):
+            job.cancelled = True
+            self.reply(504, {'error': 'deadline exceeded'})
+        elif isinstance(job.error, TimeoutError):
+            self.reply(504, {'error': str(job.error)})
+        elif job.error is not None:
+            self.reply(422, {'error': f'{type(job.error).__name__}: {job.error}'})
+        elif job.trace_record is not None:
+            self.reply(200, {'result': job.result, 'coverage': job.coverage, 'trace': job.trace_record})
+        else:
+            self.reply(200, {'result': job.result, 'coverage': job.coverage})
+
+    def reply(self, status, body, headers=None, content_type='application/json'):
+        data = (body if type(body) is str else json.dumps(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug('%s ' + format, self.address_string(), *args)
+
+
+def make_server(service, host='127.0.0.1', port=8080):
+    handler = type('BoundServiceHandler', (ServiceHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default='TPC-H', help='database used when a request does not name one')
+    parser.add_argument('--databases', nargs='*', default=[], help='other databases requests may name')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=30.0, help='default per-request deadline in seconds')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    service = AnnotationService(args.db, args.workers, args.queue_size, args.timeout, databases=args.databases)
+    service.start()
+    server = make_server(service, args.host, args.port)
+    logging.info(f'serving on {args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == '__main__':
+    main()
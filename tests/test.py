@@ -1,6 +1,13 @@
+import os
+
 import pytest
 from annotation import *
 from preprocessing import preprocess_query_string, preprocess_query_tree
+from replay import fixture_pools
+
+# DB_MODE=live runs against a TPC-H database, DB_MODE=record does that and rewrites the fixture
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'tpch.json')
+pools = fixture_pools(FIXTURE, os.getenv('DB_MODE', 'replay'))
 
 
 @pytest.mark.parametrize("query", [
@@ -192,22 +199,22 @@ ORDER BY CNTRYCODE""",
     # "SELECT * FROM nation as n1, (SELECT n1.n_regionkey FROM nation as n1) as n2 WHERE n1.n_regionkey = n2.n_regionkey;",
     ])
 def test_query(query):
-    conn = init_conn("TPC-H")
-    cur = conn.cursor()
+    with pools.get("TPC-H").connection() as conn:
+        cur = conn.cursor()
 
-    query = preprocess_query_string(query)  # assume all queries are case insensitive
-    logging.debug(query)
-    plan = get_query_execution_plan(cur, query)
-    parsed_query = parse(query)
-    try:
-        preprocess_query_tree(cur, parsed_query)
-        transverse_query(parsed_query, plan[0][0]['Plan'])
-    except Exception as e:
-        logging.error(e, exc_info=True)
+        query = preprocess_query_string(query)  # assume all queries are case insensitive
         logging.debug(query)
-        logging.debug(parsed_query)
-        logging.debug(plan)
-        raise e
-    else:
-        pprint(parsed_query, sort_dicts=False)
-        pprint(plan, sort_dicts=False)
\ No newline at end of file
+        plan = get_query_execution_plan(cur, query)
+        parsed_query = parse(query)
+        try:
+            preprocess_query_tree(cur, parsed_query)
+            transverse_query(parsed_query, plan[0][0]['Plan'])
+        except Exception as e:
+            logging.error(e, exc_info=True)
+            logging.debug(query)
+            logging.debug(parsed_query)
+            logging.debug(plan)
+            raise e
+        else:
+            pprint(parsed_query, sort_dicts=False)
+            pprint(plan, sort_dicts=False)
\ No newline at end of file
@@ -0,0 +1,72 @@
+import copy
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from mo_sql_parsing import parse
+
+import workload
+from annotation import Annotations, Annotator, load_plan, reparse_lines, reparse_query, transverse_query
+from cache import AstCache, PlanCache
+from preprocessing import preprocess_query_string, preprocess_query_tree
+
+
+def prepared(shape, size):
+    query, plan_document, relation_columns = workload.generate(shape, size)
+    tree = parse(preprocess_query_string(query))
+    preprocess_query_tree(None, tree, relation_columns=relation_columns)
+    return tree, load_plan(plan_document)[0][0]['Plan']
+
+
+def annotate(tree, plan):
+    annotations = Annotations()
+    transverse_query(tree, plan, annotations=annotations)
+    result = []
+    reparse_query(result, tree, annotations)
+    return [(q['statement'], q['annotation']) for q in result]
+
+
+def test_annotation_leaves_the_tree_unchanged():
+    tree, plan = prepared('join', 3)
+    before = copy.deepcopy(tree)
+    result = annotate(tree, plan)
+    assert tree == before
+    assert ('t0,', 'Seq Scan t0') in result
+    assert ('t0.id = t1.ref', 'Hash Join on (t0.id = t1.ref)') in result
+
+
+def test_threads_annotate_a_shared_tree():
+    tree, plan = prepared('join', 20)
+    expected = annotate(tree, plan)
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: annotate(tree, plan), range(16)))
+    assert all(result == expected for result in results)
+
+
+def test_annotator_uses_its_own_caches():
+    annotator = Annotator(plan_cache=PlanCache(), ast_cache=AstCache())
+    query, plan_document, relation_columns = workload.generate('or_chain', 3)
+    query = preprocess_query_string(query)
+    first = annotator.annotate(query, load_plan(plan_document), relation_columns)
+    assert annotator.annotate(query, load_plan(plan_document), relation_columns) == first
+    assert annotator.ast_cache.stats()['hits'] == 1
+
+
+def peak_memory(run):
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_streamed_lines_hold_one_condition_at_a_time():
+    tree, plan = prepared('or_chain', 100)
+    annotations = Annotations()
+    transverse_query(tree, plan, annotations=annotations)
+    formatted = []
+    reparse_query(formatted, tree, annotations)
+    assert list(reparse_lines(tree, annotations)) == [(q['statement'], q['annotation']) for q in formatted]
+    collected = peak_memory(lambda: reparse_query([], tree, annotations))
+    streamed = peak_memory(lambda: sum(1 for _ in reparse_lines(tree, annotations)))
+    assert streamed * 5 < collected
@@ -0,0 +1,73 @@
+from mo_sql_parsing import parse
+
+import plan_json
+
+from cache import AstCache, PlanCache, PLANNER_STATE_QUERY, normalize_query
+from tests.test_catalog import FakeCursor
+
+
+class PlannerCursor(FakeCursor):
+    def __init__(self):
+        super().__init__()
+        self.state = ('settings', '2022-01-01')
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if sql == PLANNER_STATE_QUERY:
+            self._result = [self.state]
+
+
+def explain(cursor, sql_query):
+    cursor.executed.append(sql_query)
+    return [[{'Plan': {'Node Type': 'Result'}}]]
+
+
+def test_normalize_query():
+    assert normalize_query("select *  from\n nation ;") == 'select * from nation'
+
+
+def test_plan_cache_hits_on_normalized_query():
+    cache = PlanCache(check_interval=60)
+    cur = PlannerCursor()
+    first = cache.get_plan(cur, 'select * from nation;', explain)
+    assert cache.get_plan(cur, 'select *  from nation', explain) is first
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_plan_cache_drops_plans_when_statistics_change():
+    cache = PlanCache(check_interval=0)
+    cur = PlannerCursor()
+    cache.get_plan(cur, 'select * from nation', explain)
+    cur.state = ('settings', '2022-01-02')
+    cache.get_plan(cur, 'select * from nation', explain)
+    assert cur.executed.count('select * from nation') == 2
+    assert cache.stats()['size'] == 1
+
+
+def test_plan_cache_keeps_matched_plans_apart(monkeypatch):
+    monkeypatch.setattr(plan_json, 'register_default_json', lambda conn_or_curs, loads: None)
+    cache = PlanCache(check_interval=60)
+    full, matched = PlannerCursor(), PlannerCursor()
+    plan_json.register_plan_decoder(matched, matched=True)
+    first = cache.get_plan(matched, 'select * from nation', explain)
+    assert cache.get_plan(full, 'select * from nation', explain) is not first
+    assert cache.get_plan(matched, 'select * from nation', explain) is first
+    assert full.executed.count('select * from nation') == 1
+
+
+def test_ast_cache_views_do_not_leak_mutations():
+    cache = AstCache()
+    sql = "select n_name, max(n.n_nationkey) from nation as n where n.n_regionkey = 0 group by n_name"
+    view = cache.parse(sql)
+    view['select'][0]['value'] = 'nation.n_name'
+    view['groupby']['value'] = 'nation.n_name'
+    assert cache.parse(sql) == parse(sql)
+    assert cache.stats()['hits'] == 1
+
+
+def test_ast_cache_shares_read_only_subtrees():
+    cache = AstCache()
+    sql = "select max(n.n_nationkey) from nation as n"
+    first, second = cache.parse(sql), cache.parse(sql)
+    assert first['from'] is not second['from']
+    assert first['select'] is second['select']
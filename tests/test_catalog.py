@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from catalog import SchemaCatalog, COLUMNS_QUERY, WATERMARK_QUERY, load_snapshot, save_snapshot
+from preprocessing import preprocess_query_tree
+
+
+class FakeCursor:
+    def __init__(self, dbname='TPC-H'):
+        self.connection = SimpleNamespace(info=SimpleNamespace(host='localhost', port=5432, dbname=dbname))
+        self.watermark = (100, 1)
+        self.executed = []
+        self._result = None
+
+    def execute(self, sql):
+        self.executed.append(sql)
+        if sql == COLUMNS_QUERY:
+            self._result = [('nation', 'n_nationkey'), ('nation', 'n_regionkey'), ('region', 'r_regionkey')]
+        elif sql == WATERMARK_QUERY:
+            self._result = [self.watermark]
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+def test_catalog_loads_once_per_database():
+    catalog = SchemaCatalog(check_interval=60)
+    cur = FakeCursor()
+    assert catalog.relations(cur)['nation'] == ('n_nationkey', 'n_regionkey')
+    catalog.relations(cur)
+    assert cur.executed == [WATERMARK_QUERY, COLUMNS_QUERY]
+
+
+def test_catalog_reloads_when_watermark_moves():
+    catalog = SchemaCatalog(check_interval=0)
+    cur = FakeCursor()
+    catalog.relations(cur)
+    catalog.relations(cur)
+    assert cur.executed.count(COLUMNS_QUERY) == 1
+    cur.watermark = (101, 2)
+    catalog.relations(cur)
+    assert cur.executed.count(COLUMNS_QUERY) == 2
+
+
+def test_catalog_evicts_least_recently_used_database():
+    catalog = SchemaCatalog(max_databases=1, check_interval=60)
+    a, b = FakeCursor('a'), FakeCursor('b')
+    catalog.relations(a)
+    catalog.relations(b)
+    catalog.relations(a)
+    assert a.executed.count(COLUMNS_QUERY) == 2
+
+
+def test_preprocess_query_tree_uses_catalog():
+    query_tree = {'select': '*', 'from': ['nation', 'region'], 'where': {'eq': ['n_regionkey', 'r_regionkey']}}
+    preprocess_query_tree(FakeCursor(), query_tree, SchemaCatalog())
+    assert query_tree['where'] == {'eq': ['nation.n_regionkey', 'region.r_regionkey']}
+
+
+def test_snapshot_round_trip(tmp_path):
+    relations = SchemaCatalog().relations(FakeCursor())
+    save_snapshot(relations, tmp_path / 'schema.json')
+    assert load_snapshot(tmp_path / 'schema.json') == relations
@@ -0,0 +1,72 @@
+import io
+import json
+
+import annotation
+from cli import main, split_statements
+from tests.test_process_many import FakePools, fake_explain
+
+
+def test_split_statements_ignores_semicolons_in_quotes_and_comments():
+    sql = ["select 'a;b' from t; -- trailing; comment\n",
+           'select "x;y" /* block; comment\n',
+           ' still comment */ from u;\n',
+           '\n',
+           '-- only a comment;\n',
+           'select 1']
+    assert list(split_statements(sql)) == ["select 'a;b' from t", 'select "x;y"   from u', 'select 1']
+
+
+def test_cli_streams_json_lines(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    (tmp_path / 'a.sql').write_text('select * from nation where n_regionkey = 0;\nselect * from missing;\n')
+    (tmp_path / 'b.sql').write_text('select * from region')
+    (tmp_path / 'notes.txt').write_text('select * from missing')
+    out = io.StringIO()
+    assert main([str(tmp_path)], out, FakePools()) == 1
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r['source'][-5:], r['statement']) for r in records] == [('a.sql', 0), ('a.sql', 1), ('b.sql', 0)]
+    assert records[1]['error'].startswith('LookupError') and records[2]['error'] is None
+    assert 'Seq Scan region' in records[2]['annotations']
+
+
+def test_cli_fail_fast_stops_at_first_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    (tmp_path / 'a.sql').write_text('select * from missing; select * from region;')
+    out = io.StringIO()
+    assert main([str(tmp_path / 'a.sql'), '--fail-fast', '--connections', '1'], out, FakePools()) == 1
+    assert len(out.getvalue().splitlines()) == 1
+
+
+def test_cli_annotates_saved_plans_offline(tmp_path):
+    node = {'Node Type': 'Seq Scan', 'Relation Name': 'nation', 'Alias': 'nation',
+            'Filter': '(nation.n_regionkey = 0)'}
+    query = 'select * from nation where n_regionkey = 0;'
+    (tmp_path / 'schema.json').write_text(json.dumps({'relations': {'nation': ['n_nationkey', 'n_regionkey']}}))
+    plans = tmp_path / 'plans'
+    plans.mkdir()
+    (plans / 'explain.json').write_text(json.dumps({'query': query, 'plan': [{'Plan': node}]}))
+    (plans / 'auto_explain.jsonl').write_text(json.dumps({'Query Text': query, 'Plan': node}) + '\n' +
+                                              json.dumps({'Query Text': query}) + '\n')
+    out = io.StringIO()
+    assert main([str(plans), '--schema', str(tmp_path / 'schema.json')], out) == 1
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [r['error'] for r in records] == [None, 'ValueError: not an EXPLAIN (FORMAT JSON) document', None]
+    assert records[0]['annotations'] == records[2]['annotations'] == ['', '', 'Seq Scan nation', '',
+                                                                      'Filtered on Seq Scan of nation']
+
+
+def test_cli_reports_malformed_plan_documents_and_goes_on(tmp_path):
+    node = {'Node Type': 'Seq Scan', 'Relation Name': 'nation', 'Alias': 'nation'}
+    line = json.dumps({'Query Text': 'select * from nation', 'Plan': node})
+    (tmp_path / 'schema.json').write_text(json.dumps({'relations': {'nation': ['n_nationkey']}}))
+    plans = tmp_path / 'plans'
+    plans.mkdir()
+    (plans / 'a.json').write_text(line[:-10])
+    (plans / 'b.jsonl').write_text(line + '\n' + line[:-10] + '\n' + line + '\n')
+    out = io.StringIO()
+    assert main([str(plans), '--schema', str(tmp_path / 'schema.json'), '--keep-going'], out) == 1
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [(r['source'][-7:], r['statement']) for r in records] == [('/a.json', 0), ('b.jsonl', 0), ('b.jsonl', 1),
+                                                                     ('b.jsonl', 2)]
+    assert [r['error'] is None for r in records] == [False, True, False, True]
+    assert records[0]['error'].startswith('JSONDecodeError') and records[2]['error'].startswith('JSONDecodeError')
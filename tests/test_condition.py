@@ -0,0 +1,75 @@
+import pytest
+
+from condition import comparison_key, condition_keys, parse_condition, canonical
+
+
+@pytest.mark.parametrize("plan, query", [
+    ("(nation.n_regionkey = region.r_regionkey)", ('eq', ['region.r_regionkey', 'nation.n_regionkey'])),
+    ("(0 < n.n_nationkey)", ('gt', ['n.n_nationkey', 0])),
+    ("(customer.c_acctbal > '500'::numeric)", ('gt', ['customer.c_acctbal', 500])),
+    ("(customer.c_acctbal > 500.00)", ('gt', ['customer.c_acctbal', 500])),
+    ("((part.p_type)::text ~~ '%BRASS'::text)", ('like', ['part.p_type', {'literal': '%BRASS'}])),
+    ("(lineitem.l_shipdate >= '1994-01-01'::date)", ('gte', ['lineitem.l_shipdate', {'date': {'literal': '1994-01-01'}}])),
+    ("(lineitem.l_shipdate < '1995-01-01 00:00:00'::timestamp without time zone)",
+     ('lt', ['lineitem.l_shipdate', {'add': [{'date': {'literal': '1994-01-01'}}, {'interval': [1, 'year']}]}])),
+    ("(partsupp.ps_supplycost = (SubPlan 1))", ('eq', ['partsupp.ps_supplycost', {'select': {'value': 'x'}, 'from': 't'}])),
+    ("($1 = nation.n_nationkey)", ('eq', [{'select': {'value': 'x'}, 'from': 't'}, 'nation.n_nationkey'])),
+    ("((l3.l_receiptdate > l3.l_commitdate) AND (l3.l_suppkey <> l1.l_suppkey))", ('neq', ['l1.l_suppkey', 'l3.l_suppkey'])),
+    ("(lineitem.l_orderkey = orders.o_orderkey)", ('eq', ['l_orderkey', 'orders.o_orderkey'])),
+])
+def test_plan_condition_matches_query_comparison(plan, query):
+    assert comparison_key(*query) in condition_keys(plan)
+
+
+@pytest.mark.parametrize("plan, query", [
+    ("(nation.n_regionkey = 10)", ('eq', ['nation.n_regionkey', 1])),
+    ("(nation.n_regionkey < 3)", ('gt', ['nation.n_regionkey', 3])),
+    ("(n1.n_regionkey = n2.n_regionkey)", ('eq', ['n1.n_regionkey', 'n22.n_regionkey'])),
+    ("(orders.o_orderkey = '12345678901234567891'::numeric)", ('eq', ['orders.o_orderkey', 12345678901234567890])),
+    ("(orders.o_totalprice > 0.30000000000000001)", ('gt', ['orders.o_totalprice', 0.3])),
+])
+def test_plan_condition_rejects_substring_lookalikes(plan, query):
+    assert comparison_key(*query) not in condition_keys(plan)
+
+
+def test_parse_condition_strips_casts_and_subplans():
+    tree = parse_condition("((customer.c_acctbal > $0) AND (\"substring\"((customer.c_phone)::text, 1, 2) = "
+                           "ANY ('{13,31}'::text[])) AND (NOT (hashed SubPlan 1)))")
+    assert canonical(tree) == ('and', (
+        ('not', ('param',)),
+        ('op', '<', ('param',), ('col', 'customer.c_acctbal')),
+        ('op', '= ANY', ('func', 'substring', (('col', 'customer.c_phone'), ('const', '1'), ('const', '2'))),
+         ('const', '{13,31}')),
+    ))
+
+
+def test_unparseable_condition_has_no_keys():
+    assert condition_keys("(a.b = ") is None
+
+
+@pytest.mark.parametrize("plan, query", [
+    ("(orders.o_totalprice > 1e9999999)", ('gt', ['orders.o_totalprice', 0])),
+    ("(orders.o_totalprice > '1e9999999'::double precision)", ('gt', ['orders.o_totalprice', 0])),
+])
+def test_out_of_range_constant_keeps_its_text(plan, query):
+    keys = condition_keys(plan)
+    assert keys is not None and comparison_key(*query) not in keys
+    assert all(len(repr(key)) < 100 for key in keys)
+
+
+def test_huge_exponent_is_not_written_out():
+    tree = canonical(parse_condition("(orders.o_totalprice > 1e999999)"))
+    assert tree == ('op', '<', ('const', '1e999999'), ('col', 'orders.o_totalprice'))
+
+
+def test_small_exponent_is_written_out():
+    tree = canonical(parse_condition("(orders.o_totalprice > 1.5e3)"))
+    assert tree == ('op', '<', ('const', '1500'), ('col', 'orders.o_totalprice'))
+
+
+@pytest.mark.parametrize("plan, other", [
+    ("((part.p_name)::text = '1e5'::text)", "((part.p_name)::text = '100000'::text)"),
+    ("((part.p_name)::text = 'nan'::text)", "((part.p_name)::text = 'NaN'::text)"),
+])
+def test_quoted_strings_are_not_read_as_numbers(plan, other):
+    assert condition_keys(plan) != condition_keys(other)
@@ -0,0 +1,79 @@
+import json
+import os
+
+from mo_sql_parsing import format, parse
+
+from annotation import annotate_plan, get_query_execution_plan
+from catalog import SchemaCatalog
+from emitter import clause, sql
+from preprocessing import preprocess_query_string
+from replay import fixture_pools
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+QUERIES = [
+    "SELECT l_returnflag, SUM(l_extendedprice * (1 - l_discount) * (1 + l_tax)) AS sum_charge, COUNT(*) "
+    "FROM lineitem WHERE l_shipdate <= date '1998-12-01' + interval '-90 day' "
+    "GROUP BY l_returnflag ORDER BY l_returnflag DESC, 2 LIMIT 10",
+    "SELECT DISTINCT p_brand, \"select\", \"Mixed Case\".x FROM part WHERE p_type LIKE '%BRASS' "
+    "AND p_size IN (1, 2, 3) AND p_container NOT IN ('SM CASE', 'it''s') AND NOT (p_size = 4) "
+    "AND p_retailprice BETWEEN 10 AND 20 AND p_comment IS NOT NULL AND p_name IS NULL",
+    "SELECT CASE WHEN a = 1 THEN 'one' ELSE 'other' END, -a, a / b % c, a - (b - c), (a || b) FROM t "
+    "WHERE (a = 1 OR b = 2) AND c > (SELECT max(c) FROM t) AND EXISTS (SELECT * FROM u WHERE u.a = t.a)",
+    "SELECT a, rank() OVER (PARTITION BY b ORDER BY c) FROM t JOIN u ON t.a = u.a",
+]
+
+
+def subtrees(node):
+    yield node
+    for child in node.values() if type(node) is dict else node if type(node) is list else []:
+        yield from subtrees(child)
+
+
+def formatted(node):
+    try:
+        return format(node)
+    except Exception as e:
+        return type(e)
+
+
+def emitted(node):
+    try:
+        return sql(node)
+    except Exception as e:
+        return type(e)
+
+
+def test_emitter_matches_format():
+    for query in QUERIES:
+        for node in subtrees(parse(query)):
+            assert emitted(node) == formatted(node), node
+
+
+def test_clauses_match_format():
+    tree = parse(QUERIES[0])
+    for keyword in ['groupby', 'orderby', 'limit']:
+        assert clause(keyword, tree[keyword]) == format({keyword: tree[keyword], 'from': ''}).split('""', 1)[1].strip()
+    tree = parse(QUERIES[1])
+    assert clause('select_distinct', tree['select_distinct']) == format({'select_distinct': tree['select_distinct']})
+
+
+def test_annotation_output_is_unchanged():
+    """
+    Golden output for the queries in test.py, annotated from the replay fixture
+    """
+    with open(os.path.join(FIXTURES, 'annotated.json'), encoding='utf-8') as f:
+        expected = json.load(f)
+    pools = fixture_pools(os.path.join(FIXTURES, 'tpch.json'))
+    with pools.get('TPC-H').connection() as conn:
+        cur = conn.cursor()
+        catalog = SchemaCatalog()
+        for case in expected:
+            query = preprocess_query_string(case['query'])
+            try:
+                statements, annotations = annotate_plan(query, get_query_execution_plan(cur, query),
+                                                        catalog.relations(cur))
+            except Exception as e:
+                assert type(e).__name__ == case.get('error'), case['query']
+                continue
+            assert [list(line) for line in zip(statements, annotations)] == case['lines'], case['query']
@@ -0,0 +1,86 @@
+from contextlib import contextmanager
+
+import pytest
+
+pytest.importorskip('PyQt5')
+
+import interface
+from interface import AnnotateWorker
+
+
+class FakeConnection:
+    def __init__(self):
+        self.cancels = 0
+        self.returned = False
+
+    def cursor(self):
+        return None
+
+    def cancel(self):
+        self.cancels += 1
+
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConnection()
+        self.on_return = None
+
+    @contextmanager
+    def connection(self):
+        try:
+            yield self.conn
+        finally:
+            self.conn.returned = True
+            if self.on_return is not None:
+                self.on_return()
+
+
+class FakePools:
+    def __init__(self, pool):
+        self.pool = pool
+
+    def get(self, db_name):
+        return self.pool
+
+
+class FakeAnnotator:
+    def __init__(self, annotate):
+        self.worker = None
+        self._annotate = annotate
+
+    def annotate(self, cur, query):
+        return self._annotate(self.worker)
+
+
+def run_worker(monkeypatch, annotate, cancel_on_return=False):
+    pool = FakePool()
+    monkeypatch.setattr(interface, 'default_pools', FakePools(pool))
+    annotator = FakeAnnotator(annotate)
+    worker = annotator.worker = AnnotateWorker('tpch', 'select 1', annotator)
+    if cancel_on_return:
+        pool.on_return = worker.cancel
+    worker.run()
+    return worker, pool.conn
+
+
+def test_cancel_reaches_the_running_statement(monkeypatch):
+    def annotate(worker):
+        worker.cancel()
+        return [], []
+
+    worker, conn = run_worker(monkeypatch, annotate)
+    assert conn.cancels == 1
+
+
+@pytest.mark.parametrize('error', [None, RuntimeError('statement failed')])
+def test_cancel_does_not_reach_a_returned_connection(monkeypatch, error):
+    def annotate(worker):
+        if error is not None:
+            raise error
+        return [], []
+
+    # a Cancel click landing as the pool takes the connection back, and one after the worker is done
+    worker, conn = run_worker(monkeypatch, annotate, cancel_on_return=True)
+    worker.cancel()
+    assert conn.returned
+    assert conn.cancels == 0
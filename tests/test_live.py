@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import live
+from annotation import annotate_plan
+from live import LiveAnnotator
+from preprocessing import preprocess_query_string
+
+RELATIONS = {'nation': ('n_nationkey', 'n_name', 'n_regionkey'), 'region': ('r_regionkey', 'r_name')}
+CURSOR = SimpleNamespace(connection=SimpleNamespace(info=SimpleNamespace(host='localhost', port=5432, dbname='TPC-H')))
+
+
+def fake_explain(cur, query):
+    output = ['nation.n_name', 'region.r_name'] if 'select n_name' in query else ['nation.n_nationkey']
+    plan = {'Node Type': 'Hash Join', 'Hash Cond': '(nation.n_regionkey = region.r_regionkey)', 'Output': output,
+            'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'nation', 'Alias': 'nation'},
+                {'Node Type': 'Seq Scan', 'Relation Name': 'region', 'Alias': 'region',
+                 'Filter': "(region.r_name = 'ASIA'::bpchar)"},
+            ]}
+    return [[{'Plan': plan}]], RELATIONS
+
+
+class FakePlanCache:
+    state = ('settings', '2024-01-01')
+
+    def planner_state(self, cursor):
+        return self.state
+
+
+def full(query):
+    query = preprocess_query_string(query)
+    return annotate_plan(query, *fake_explain(None, query))
+
+
+def test_live_annotation_matches_full_annotation(monkeypatch):
+    monkeypatch.setattr(live, 'explain_query', fake_explain)
+    monkeypatch.setattr(live, 'default_plan_cache', FakePlanCache())
+    annotator = LiveAnnotator()
+    where = "FROM nation, region WHERE n_regionkey = r_regionkey AND r_name = 'ASIA'"
+    for query in [f"SELECT * {where}",
+                  f"select *  {where}",
+                  f"SELECT n_name, r_name {where}",
+                  f"SELECT n_name, r_name {where} ORDER BY n_name",
+                  f"SELECT n_name {where.replace('ASIA', 'EUROPE')}"]:
+        assert annotator.annotate(CURSOR, query) == full(query)
+    assert annotator.stats() == {'reused': 1, 'partial': 2, 'full': 2}
+
+
+def test_planner_state_change_annotates_again(monkeypatch):
+    monkeypatch.setattr(live, 'explain_query', fake_explain)
+    plan_cache = FakePlanCache()
+    monkeypatch.setattr(live, 'default_plan_cache', plan_cache)
+    annotator = LiveAnnotator()
+    query = "SELECT * FROM nation, region WHERE n_regionkey = r_regionkey"
+    annotator.annotate(CURSOR, query)
+    annotator.annotate(CURSOR, query)
+    plan_cache.state = ('settings', '2024-01-02')  # after ANALYZE
+    assert annotator.annotate(CURSOR, query) == full(query)
+    # the plan matching sees is the same, so only the matching is reused
+    assert annotator.stats() == {'reused': 1, 'partial': 1, 'full': 1}
@@ -0,0 +1,72 @@
+import threading
+
+import annotation
+import workload
+from annotation import process_many, process_offline
+from match_stats import CoverageHistograms, MatchStats
+from tests.test_process_many import QUERIES, FakePools, fake_explain
+
+
+def test_empty_stats():
+    stats = MatchStats()
+    assert str(stats) == 'n/a of plan nodes, n/a of query nodes'
+    assert stats.needs_review()
+
+
+def test_offline_annotation_coverage():
+    stats = MatchStats()
+    process_offline(*workload.generate('join', 3), stats)
+    # three scans and two hash joins match the three relations and two join conditions
+    assert (stats.plan_nodes, stats.matched_plan_nodes, stats.query_nodes, stats.annotated_query_nodes) == (5, 5, 5, 5)
+    assert stats.unimplemented == {'Hash': 2} and not stats.needs_review()
+
+    stats = MatchStats()
+    process_offline(*workload.generate('nested', 3), stats)
+    # only the outer scan matches, the matcher does not look for scans inside IN subqueries
+    assert stats.unmatched == {'Hash Join': 2, 'Seq Scan': 2} and stats.plan_coverage == 0.2
+    assert (stats.query_nodes, stats.annotated_query_nodes) == (3, 1) and stats.needs_review()
+
+
+def test_process_many_returns_stats(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    items = list(process_many('TPC-H', QUERIES, pools=FakePools()))
+    assert items[0]['stats'].as_dict()['plan_coverage'] == 1.0
+    assert items[1]['stats'] is None
+
+
+def test_histograms_count_every_request_across_threads():
+    histograms = CoverageHistograms()
+    full, partial = MatchStats(), MatchStats()
+    full.plan_node('Seq Scan', True)
+    full.query_node(True)
+    partial.plan_node('Seq Scan', True)
+    partial.plan_node('Hash Join', False)
+
+    def add():
+        for _ in range(1000):
+            histograms.add(full)
+            histograms.add(partial)
+
+    threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = histograms.snapshot()
+    assert snapshot['requests'] == 16000 and snapshot['needs_review'] == 8000
+    assert snapshot['plan_coverage']['100%'] == 8000 and snapshot['plan_coverage']['50-60%'] == 8000
+    assert snapshot['query_coverage']['n/a'] == 8000
+    assert snapshot['unmatched'] == {'Hash Join': 8000}
+
+
+def test_shards_of_ended_threads_are_merged(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    histograms = CoverageHistograms()
+    monkeypatch.setattr(annotation, 'default_coverage', histograms)
+    annotated = 0
+    for _ in range(20):
+        # every call runs its own executor, whose threads end when it returns
+        annotated += sum(item['stats'] is not None for item in process_many('TPC-H', QUERIES, jobs=4,
+                                                                               pools=FakePools()))
+    assert len(histograms._shards) <= 1
+    assert annotated and histograms.snapshot()['requests'] == annotated
@@ -0,0 +1,53 @@
+import annotation
+import workload
+from annotation import process_many, process_offline
+from metrics import Metrics, default_metrics
+from tests.test_process_many import QUERIES, FakePools, fake_explain
+
+
+def test_disabled_metrics_record_nothing():
+    metrics = Metrics()
+    assert metrics.span('parse') is metrics.span('match')
+    with metrics.span('parse'):
+        metrics.count('plan_nodes')
+    assert metrics.snapshot() == {'spans': {}, 'counters': {}}
+
+
+def test_pipeline_spans_counters_and_traces(monkeypatch):
+    monkeypatch.setattr(default_metrics, 'enabled', True)
+    default_metrics.reset()
+    query, plan, relation_columns = workload.generate('join', 3)
+    with default_metrics.trace('join-3') as trace:
+        process_offline(query, plan, relation_columns)
+    record = trace.record()
+    default_metrics.reset()
+
+    assert [span['span'] for span in record['spans']] == ['parse', 'preprocess', 'match', 'reparse']
+    # two hash joins and three scans, the two Hash nodes in between are not implemented
+    assert record['counters'] == {'unimplemented_node': 2, 'plan_nodes': 5, 'matches': 5}
+
+
+def test_prometheus_text():
+    metrics = Metrics(enabled=True)
+    with metrics.span('parse'):
+        pass
+    metrics.count('misses', 3)
+    text = metrics.prometheus()
+    assert 'annotator_span_seconds_bucket{span="parse",le="0.005"} 1\n' in text
+    assert 'annotator_span_seconds_bucket{span="parse",le="+Inf"} 1\n' in text
+    assert 'annotator_span_seconds_count{span="parse"} 1\n' in text
+    assert '# TYPE annotator_events_total counter\nannotator_events_total{event="misses"} 3\n' in text
+
+
+def test_worker_process_metrics_are_merged(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    monkeypatch.setattr(default_metrics, 'enabled', True)
+    default_metrics.reset()
+    items = list(process_many('TPC-H', QUERIES, jobs=1, connections=1, chunksize=2, processes=True,
+                              pools=FakePools()))
+    snapshot = default_metrics.snapshot()
+    default_metrics.reset()
+    annotated = sum(item['error'] is None for item in items)
+    assert annotated == 2
+    assert all(snapshot['spans'][name]['count'] == annotated for name in ['parse', 'match', 'reparse'])
+    assert snapshot['counters']['matches'] >= annotated
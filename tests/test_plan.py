@@ -0,0 +1,45 @@
+import logging
+
+from annotation import PlanNode, transverse_plan
+from match_stats import MatchStats
+
+
+def seq_scan(name):
+    return {'Node Type': 'Seq Scan', 'Relation Name': name, 'Alias': name, 'Output': [f'{name}.id']}
+
+
+def test_traversal_is_pre_order_and_skips_leaves_without_plans():
+    plan = {
+        'Node Type': 'Hash Join', 'Hash Cond': '(a.id = b.id)',
+        'Plans': [
+            {'Node Type': 'Merge Join', 'Merge Cond': '(a.id = c.id)', 'Plans': [seq_scan('a'), seq_scan('c')]},
+            {'Node Type': 'Hash', 'Plans': [seq_scan('b')]},
+        ],
+    }
+    assert [r.name or r.subtype for r in transverse_plan(plan)] == ['Hash Join', 'Merge Join', 'a', 'c', 'b']
+    stats = MatchStats()
+    assert list(transverse_plan({'Node Type': 'Result'}, stats)) == []
+    assert stats.unimplemented == {'Result': 1}
+
+
+def test_wide_and_deep_plans(caplog):
+    caplog.set_level(logging.ERROR)
+    # a partitioned table, 20000 partitions under one Append
+    wide = {'Node Type': 'Append', 'Plans': [seq_scan(f'p{i}') for i in range(20000)]}
+    assert [r.name for r in transverse_plan(wide)] == [f'p{i}' for i in range(20000)]
+    # 10000 levels, far past the recursion limit
+    deep = seq_scan('t')
+    for i in range(5000):
+        deep = {'Node Type': 'Hash Join', 'Hash Cond': f'(t.id = {i})',
+                'Plans': [{'Node Type': 'Materialize', 'Plans': [deep]}, seq_scan(f'u{i}')]}
+    records = list(transverse_plan(deep))
+    assert len(records) == 10001
+    assert records[0].filter == '(t.id = 4999)' and records[5000].name == 't' and records[-1].name == 'u4999'
+
+
+def test_plan_nodes_are_compact_and_parse_their_filter_once():
+    node = next(transverse_plan({'Node Type': 'Seq Scan', 'Relation Name': 't', 'Alias': 't', 'Filter': '(t.a > 1)'}))
+    assert not hasattr(node, '__dict__')
+    assert node.keys() is node.keys()
+    guess = PlanNode('Join', 'Nested Loop', lhs=['t.a'], rhs=['u.a']).with_filter('t.a = u.a')
+    assert (guess.filter, guess.lhs) == ('t.a = u.a', ['t.a'])
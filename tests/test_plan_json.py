@@ -0,0 +1,123 @@
+import gc
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import plan_json
+from annotation import load_plan, transverse_plan
+from plan_json import MATCHED_KEYS, gc_paused, gc_paused_decoder, loads, loads_matched
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'tpch.json')
+
+
+def explain_documents():
+    with open(FIXTURE, encoding='utf-8') as f:
+        calls = json.load(f)['calls']
+    return [entry['rows'][0][0] for sql, entry in calls.items() if sql.startswith('EXPLAIN') and entry.get('rows')]
+
+
+def records(document):
+    try:
+        return [(r.kind, r.subtype, r.filter, r.name, r.alias, r.lhs, r.rhs, r.parameterized)
+                for r in transverse_plan(load_plan(document)[0][0]['Plan'])]
+    except AssertionError as e:
+        return str(e)
+
+
+def objects(node):
+    if type(node) is dict:
+        yield node
+    for child in node.values() if type(node) is dict else node if type(node) is list else []:
+        yield from objects(child)
+
+
+def test_decoders_give_the_same_match_records():
+    documents = explain_documents()
+    assert documents
+    for document in documents:
+        text = json.dumps(document)
+        assert loads(text) == document
+        matched = loads_matched(text)
+        assert all(node.keys() <= MATCHED_KEYS for node in objects(matched))
+        assert records(matched) == records(document)
+
+
+def test_gc_is_restored_after_decoding():
+    assert gc.isenabled()
+    with gc_paused():
+        assert not gc.isenabled()
+    assert gc.isenabled()
+    gc.disable()
+    try:
+        gc_paused_decoder(loads)('[]')
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+
+
+def test_only_paused_decoders_touch_the_collector(monkeypatch):
+    calls = []
+
+    class RecordingGc:
+        def isenabled(self):
+            return True
+
+        def disable(self):
+            calls.append('disable')
+
+        def enable(self):
+            calls.append('enable')
+
+    monkeypatch.setattr(plan_json, 'gc', RecordingGc())
+    text = json.dumps(explain_documents()[0])
+    loads(text)
+    loads_matched(text)
+    assert calls == []
+    gc_paused_decoder(loads_matched)(text)
+    assert calls == ['disable', 'enable']
+
+
+def test_gc_is_restored_after_overlapping_decodes(monkeypatch):
+    # b reads the flag while a is decoding, and a finishes before b acts on what it read
+    inside, b_inside, a_done = threading.Event(), threading.Event(), threading.Event()
+
+    class RacingGc:
+        def isenabled(self):
+            enabled = gc.isenabled()
+            if threading.current_thread() is b:
+                b_inside.set()
+                a_done.wait(5)
+            return enabled
+
+        def __getattr__(self, name):
+            return getattr(gc, name)
+
+    def decode_a():
+        with gc_paused():
+            inside.set()
+            b_inside.wait(5)
+        a_done.set()
+
+    def decode_b():
+        inside.wait(5)
+        with gc_paused():
+            b_inside.set()
+
+    monkeypatch.setattr(plan_json, 'gc', RacingGc())
+    a, b = threading.Thread(target=decode_a), threading.Thread(target=decode_b)
+    a.start()
+    b.start()
+    a.join()
+    b.join()
+    enabled = gc.isenabled()
+    gc.enable()
+    assert enabled
+
+
+def test_gc_is_restored_after_decoding_on_many_threads():
+    texts = [json.dumps(document) for document in explain_documents()]
+    with ThreadPoolExecutor(8) as pool:
+        decoders = [gc_paused_decoder(loads_matched), gc_paused_decoder(loads)]
+        list(pool.map(lambda i: decoders[i % 2](texts[i % len(texts)]), range(256)))
+    assert gc.isenabled()
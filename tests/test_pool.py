@@ -0,0 +1,103 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+import annotation
+from pool import ConnectionPool, ConnectionPools
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.alive = True
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            def execute(self, sql):
+                if not conn.alive:
+                    raise Exception('server closed the connection unexpectedly')
+        return Cursor()
+
+    def rollback(self):
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+def test_pool_reuses_connections():
+    opened = []
+    pool = ConnectionPool(lambda: opened.append(FakeConnection()) or opened[-1])
+    with pool.connection() as a:
+        pass
+    with pool.connection() as b:
+        pass
+    assert a is b and len(opened) == 1
+
+
+def test_pool_replaces_dead_connection():
+    pool = ConnectionPool(FakeConnection, health_check_interval=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.alive = False
+    assert pool.getconn() is not conn
+    assert conn.closed and pool.stats()['discarded'] == 1
+
+
+def test_pool_rolls_back_returned_transaction():
+    pool = ConnectionPool(FakeConnection)
+    conn = pool.getconn()
+    conn.info.transaction_status = extensions.TRANSACTION_STATUS_INERROR
+    pool.putconn(conn)
+    assert conn.info.transaction_status == extensions.TRANSACTION_STATUS_IDLE and pool.getconn() is conn
+
+
+def test_pool_blocks_at_maxconn():
+    pool = ConnectionPool(FakeConnection, maxconn=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+    threading.Timer(0.01, pool.putconn, [conn]).start()
+    pool.timeout = 5
+    assert pool.getconn() is conn
+
+
+def test_pool_closes_idle_connections_above_minconn():
+    pool = ConnectionPool(FakeConnection, minconn=1, idle_timeout=0)
+    a, b = pool.getconn(), pool.getconn()
+    pool.putconn(a)
+    pool.putconn(b)
+    assert pool.getconn() is b
+    assert a.closed and pool.stats()['idle'] == 0
+
+
+def test_pools_are_keyed_by_database():
+    pools = ConnectionPools(lambda db_name: FakeConnection())
+    assert pools.get('TPC-H') is pools.get('TPC-H')
+    assert pools.get('TPC-H') is not pools.get('other')
+
+
+def test_init_conn_returns_a_connection_the_caller_owns(monkeypatch):
+    monkeypatch.setattr(annotation, 'connect_db', lambda db_name: FakeConnection())
+    monkeypatch.setattr(annotation, 'default_pools', ConnectionPools(lambda db_name: FakeConnection(), maxconn=1,
+                                                                     timeout=0.01))
+    for _ in range(3):
+        annotation.init_conn('TPC-H').close()
+    conn = annotation.checkout_conn('TPC-H')
+    with pytest.raises(PoolError):
+        annotation.checkout_conn('TPC-H')
+    conn.info.dbname = 'TPC-H'
+    annotation.release_conn(conn)
+    annotation.release_conn(annotation.checkout_conn('TPC-H'))
@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+
+import annotation
+from annotation import process_many
+
+RELATIONS = {'nation': ('n_nationkey', 'n_regionkey'), 'region': ('r_regionkey',)}
+
+
+def scan_plan(relation, delay):
+    time.sleep(delay)
+    return [[{'Plan': {'Node Type': 'Seq Scan', 'Relation Name': relation, 'Alias': relation,
+                       'Filter': f'({relation}.n_regionkey = 0)' if relation == 'nation' else ''}}]]
+
+
+class FakePools:
+    def get(self, db_name):
+        return self
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return None
+
+
+def fake_explain(cur, query):
+    if 'missing' in query:
+        raise LookupError('relation "missing" does not exist')
+    relation = query.split()[3]
+    # later queries finish first, so ordered results have to wait for earlier ones
+    return scan_plan(relation, 0.05 if relation == 'nation' else 0), RELATIONS
+
+
+QUERIES = ['select * from nation where n_regionkey = 0', 'select * from missing', 'select * from region']
+
+
+def test_process_many_keeps_input_order(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    items = list(process_many('TPC-H', QUERIES, jobs=2, connections=3, pools=FakePools()))
+    assert [item['index'] for item in items] == [0, 1, 2]
+    assert items[0]['annotations'][items[0]['statements'].index('nation')] == 'Seq Scan nation'
+    assert 'Filtered on Seq Scan of nation' in items[0]['annotations']
+    assert isinstance(items[1]['error'], LookupError) and items[1]['statements'] is None
+    assert items[2]['error'] is None
+
+
+def test_process_many_as_completed(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    items = list(process_many('TPC-H', QUERIES, jobs=2, connections=3, ordered=False, pools=FakePools()))
+    assert sorted(item['index'] for item in items) == [0, 1, 2]
+    assert items[-1]['index'] == 0
+
+
+def test_process_many_in_worker_processes(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    threaded = list(process_many('TPC-H', QUERIES, jobs=1, connections=1, chunksize=2, pools=FakePools()))
+    spawned = list(process_many('TPC-H', QUERIES, jobs=1, connections=1, chunksize=2, processes=True,
+                                pools=FakePools()))
+    assert [item['index'] for item in spawned] == [0, 1, 2]
+    assert [item['annotations'] for item in spawned] == [item['annotations'] for item in threaded]
+    assert isinstance(spawned[1]['error'], LookupError)
@@ -0,0 +1,68 @@
+import copy
+
+from mo_sql_parsing import parse
+
+from annotation import Annotations, PlanNode, annotate_query, find_query_node, transverse_plan
+from query_index import QueryIndex
+
+QUERY = "select * from nation as n, region as r, (select * from customer as c where c.c_acctbal > 500) as cs " \
+        "where n.n_regionkey = r.r_regionkey and cs.c_nationkey = n.n_nationkey and r.r_name = 'asia'"
+
+
+def annotate(query, results, use_index, annotations=None):
+    annotations = Annotations() if annotations is None else annotations
+    index = QueryIndex(query) if use_index else None
+    for result in results:
+        if index is not None:
+            index.prepare(result)
+        find_query_node(query, result, annotations, index)
+    return annotate_query(query, annotations)
+
+
+RESULTS = [
+    PlanNode('Join', 'Hash Join', '(n.n_regionkey = r.r_regionkey)'),
+    PlanNode('Scan', 'Seq Scan', "(r.r_name = 'asia'::bpchar)", 'region', 'r'),
+    PlanNode('Scan', 'Seq Scan', '(c.c_acctbal > 500)', 'customer', 'c'),
+    PlanNode('Scan', 'Seq Scan', '', 'nation', 'n'),
+]
+
+
+def test_indexed_matching_equals_full_walk():
+    parsed = parse(QUERY)
+    assert annotate(copy.deepcopy(parsed), RESULTS, True) == annotate(copy.deepcopy(parsed), RESULTS, False)
+
+
+def test_index_only_visits_paths_to_matches():
+    parsed = parse(QUERY)
+    index = QueryIndex(parsed)
+    index.prepare(RESULTS[0])
+    assert id(parsed['where']['and'][0]) in index.hot
+    assert id(parsed['where']['and'][1]) not in index.hot
+    assert id(parsed['from'][2]) not in index.hot
+
+
+def test_join_candidates_intersect_equality_pairs():
+    index = QueryIndex(parse(QUERY))
+    lhs = ['n.n_nationkey', 'n.n_name', 'n.n_regionkey', 'n.n_comment']
+    rhs = ['r.r_regionkey', 'r.r_name', 'r.r_comment']
+    assert index.join_candidates(lhs, rhs) == ['n.n_regionkey = r.r_regionkey']
+    assert index.join_candidates(rhs, ['cs.c_custkey', 'cs.c_nationkey']) == []
+
+
+def test_nested_loop_prefers_parameterized_inner_scan():
+    plan = {
+        'Node Type': 'Nested Loop',
+        'Plans': [
+            {'Node Type': 'Seq Scan', 'Relation Name': 'nation', 'Alias': 'n',
+             'Output': ['n.n_nationkey', 'n.n_regionkey']},
+            {'Node Type': 'Index Scan', 'Relation Name': 'region', 'Alias': 'r', 'Output': ['r.r_regionkey'],
+             'Index Cond': '((r.r_regionkey = n.n_regionkey) AND (r.r_regionkey > 0))'},
+        ],
+    }
+    join = next(transverse_plan(plan))
+    assert join.parameterized == ['r.r_regionkey = n.n_regionkey']
+    query = parse(QUERY)
+    annotations = Annotations()
+    annotate(query, [join], True, annotations)
+    assert annotations.note(query['where']['and'][0]) == 'Nested Loop on r.r_regionkey = n.n_regionkey'
+    assert join.filter == ''
@@ -0,0 +1,77 @@
+import os
+import time
+from types import SimpleNamespace
+
+import psycopg2
+import pytest
+
+from annotation import process, process_many
+from catalog import SchemaCatalog, WATERMARK_QUERY
+from replay import Fixture, RecordingConnection, ReplayConnection, ReplayMiss, fixture_pools
+from tests.test_catalog import FakeCursor
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'tpch.json')
+QUERIES = [
+    "SELECT * FROM nation, region WHERE nation.n_regionkey = region.r_regionkey and nation.n_regionkey = 0;",
+    "SELECT * FROM supplier WHERE s_nationkey IN (SELECT n_nationkey FROM nation WHERE n_regionkey = 3);",
+    "SELECT * FROM customer as c, nation as n, region as r WHERE n.n_nationkey > 7 and n.n_nationkey < 15 and "
+    " n.n_regionkey = r.r_regionkey  and c.c_nationkey = n.n_nationkey;",
+]
+
+
+class LiveCursor(FakeCursor):
+    description = [('column',)]
+
+    def execute(self, sql):
+        if sql.startswith('EXPLAIN'):
+            raise psycopg2.errors.UndefinedTable('relation "nowhere" does not exist')
+        super().execute(sql)
+
+    def close(self):
+        pass
+
+
+class LiveConnection:
+    info = SimpleNamespace(host='localhost', port=5432, dbname='TPC-H')
+
+    def cursor(self):
+        return LiveCursor()
+
+
+def test_recorded_calls_replay_without_a_database(tmp_path):
+    fixture = Fixture()
+    recording = RecordingConnection(LiveConnection(), fixture)
+    recorded = SchemaCatalog().relations(recording.cursor())
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        recording.cursor().execute('EXPLAIN SELECT * FROM nowhere')
+    fixture.save(tmp_path / 'fixture.json')
+
+    replay = ReplayConnection(Fixture.load(tmp_path / 'fixture.json'))
+    assert SchemaCatalog().relations(replay.cursor()) == recorded
+    assert replay.info.dbname == 'TPC-H'
+    with pytest.raises(psycopg2.errors.UndefinedTable):
+        replay.cursor().execute('EXPLAIN SELECT * FROM nowhere')
+    with pytest.raises(ReplayMiss):
+        replay.cursor().execute('SELECT 2')
+
+
+def test_replay_latency(tmp_path):
+    fixture = Fixture(calls={WATERMARK_QUERY: {'rows': [[100, 1]]}})
+    fixture.save(tmp_path / 'fixture.json')
+    with fixture_pools(tmp_path / 'fixture.json', latency=0.05).get('TPC-H').connection() as conn:
+        cur = conn.cursor()
+        start = time.monotonic()
+        cur.execute(WATERMARK_QUERY)
+        assert time.monotonic() - start >= 0.05
+        assert cur.fetchone() == (100, 1)
+        assert cur.fetchone() is None
+
+
+def test_fixture_replays_process_end_to_end():
+    pools = fixture_pools(FIXTURE)
+    with pools.get('TPC-H').connection() as conn:
+        expected = [process(conn, query) for query in QUERIES]
+    assert all(statements and annotations for statements, annotations in expected)
+    results = list(process_many('TPC-H', QUERIES, jobs=2, connections=2, pools=pools))
+    assert [item['error'] for item in results] == [None] * len(QUERIES)
+    assert [(item['statements'], item['annotations']) for item in results] == expected
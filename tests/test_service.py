@@ -0,0 +1,151 @@
+import http.client
+import json
+import queue
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+import annotation
+from metrics import default_metrics
+from service import AnnotationService, ServiceHandler, make_server
+from tests.test_process_many import FakePools, fake_explain
+
+
+class CancellablePools(FakePools):
+    def __init__(self):
+        self.requested = set()
+
+    def get(self, db_name):
+        self.requested.add(db_name)
+        return self
+
+    def cancel(self):
+        pass
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(annotation, 'explain_query', fake_explain)
+    service = AnnotationService('TPC-H', workers=1, queue_size=1, timeout=5, pools=CancellablePools())
+    service.start()
+    server = make_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield service, f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def request(url, body=None):
+    data = None if body is None else json.dumps(body).encode()
+    try:
+        with urllib.request.urlopen(url, data) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_annotate_returns_statement_annotation_pairs(server):
+    service, url = server
+    status, body = request(f'{url}/annotate', {'query': 'select * from region'})
+    assert status == 200
+    assert {'statement': 'region', 'annotation': 'Seq Scan region'} in body['result']
+    assert request(f'{url}/annotate', {'query': 'select * from missing'})[0] == 422
+    assert request(f'{url}/annotate', {'sql': 'select 1'})[0] == 400
+    assert request(f'{url}/health') == (200, {'status': 'ok', 'workers': 1, 'queued': 0, 'queue_size': 1})
+    metrics = request(f'{url}/metrics')[1]
+    assert (metrics['requests'], metrics['completed'], metrics['failed']) == (2, 1, 1)
+
+
+def test_saturated_service_rejects_and_expires_requests(server, monkeypatch):
+    service, url = server
+    started, release = threading.Event(), threading.Event()
+
+    def blocked_explain(cur, query):
+        started.set()
+        release.wait(5)
+        return fake_explain(cur, query)
+
+    monkeypatch.setattr(annotation, 'explain_query', blocked_explain)
+    running = service.submit('select * from region')
+    assert started.wait(5)
+    queued = service.submit('select * from region', timeout=0.01)
+    with pytest.raises(queue.Full):
+        service.submit('select * from region')
+    assert request(f'{url}/annotate', {'query': 'select * from region'})[0] == 429
+    time.sleep(0.05)  # let the queued request's deadline pass
+    release.set()
+    assert running.done.wait(5) and running.error is None
+    assert queued.done.wait(5) and isinstance(queued.error, TimeoutError)
+    assert service.metrics()['rejected'] == 2 and service.metrics()['expired'] == 1
+
+
+def test_deadline_covers_annotation_after_explain(server, monkeypatch):
+    service, url = server
+
+    def slow_explain(cur, query):
+        time.sleep(0.1)  # the connection ignores cancel, as one does once EXPLAIN has returned
+        return fake_explain(cur, query)
+
+    monkeypatch.setattr(annotation, 'explain_query', slow_explain)
+    job = service.submit('select * from region', timeout=0.05)
+    assert job.done.wait(5) and isinstance(job.error, TimeoutError) and job.result is None
+    assert service.metrics()['expired'] == 1 and service.metrics()['completed'] == 0
+
+
+def test_request_traces_and_prometheus_metrics(server):
+    service, url = server
+    status, body = request(f'{url}/annotate', {'query': 'select * from region', 'trace': True})
+    assert status == 200
+    assert [span['span'] for span in body['trace']['spans']][-1] == 'process'
+    assert body['trace']['counters']['matches'] >= 1
+    with urllib.request.urlopen(f'{url}/metrics/prometheus') as response:
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert 'annotator_span_seconds_count{span="process"}' in response.read().decode()
+
+
+def test_stop_restores_metrics_state():
+    assert not default_metrics.enabled
+    service = AnnotationService('TPC-H', workers=1, pools=CancellablePools())
+    service.start()
+    assert default_metrics.enabled
+    service.stop()
+    assert not default_metrics.enabled
+
+
+def post(url, headers, body=b''):
+    host, port = url[len('http://'):].split(':')
+    conn = http.client.HTTPConnection(host, int(port), timeout=5)
+    try:
+        conn.putrequest('POST', '/annotate')
+        for key, val in headers.items():
+            conn.putheader(key, val)
+        conn.endheaders(body)
+        return conn.getresponse().status
+    finally:
+        conn.close()
+
+
+def test_bad_content_length_is_rejected(server):
+    service, url = server
+    body = json.dumps({'query': 'select * from region'}).encode()
+    assert post(url, {'Content-Length': '-1'}, body) == 400
+    assert post(url, {}, body) == 400
+    assert post(url, {'Content-Length': 'ten'}, body) == 400
+    assert post(url, {'Content-Length': str(ServiceHandler.max_body + 1)}) == 413
+    assert post(url, {'Content-Length': str(len(body))}, body) == 200
+
+
+def test_only_configured_databases_get_a_pool(server):
+    service, url = server
+    status, body = request(f'{url}/annotate', {'query': 'select * from region', 'db': 'made_up'})
+    assert status == 400 and 'made_up' in body['error']
+    assert request(f'{url}/annotate', {'query': 'select * from region', 'db': 'TPC-H'})[0] == 200
+    assert service.pools.requested == {'TPC-H'}
+    assert service.metrics()['requests'] == 1
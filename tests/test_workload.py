@@ -0,0 +1,37 @@
+import io
+import json
+
+import pytest
+
+import workload
+from annotation import process_offline
+from cli import main
+from scripts import bench_scaling
+
+
+@pytest.mark.parametrize('shape', ['join', 'nested', 'or_chain', 'in_list', pytest.param('union', marks=pytest.mark.xfail(
+    raises=KeyError, strict=True, reason="preprocessing expects a 'from' in every query tree, a UNION has none"))])
+def test_synthetic_queries_annotate_offline(shape):
+    query, plan, relation_columns = workload.generate(shape, 5)
+    statements, annotations = process_offline(query, plan, relation_columns)
+    assert 'Seq Scan t0' in annotations
+    if shape == 'join':
+        assert annotations.count('Hash Join on (t3.id = t4.ref)') == 1
+
+
+def test_bench_scaling_records_failures_as_rows():
+    rows = list(bench_scaling.run_shape('union', [5, 2], repeat=1, budget=10))
+    assert [(row['size'], row['error_type'], row['first_failing_size']) for row in rows] == \
+        [(2, 'KeyError', 2), (5, 'KeyError', 2)]
+    rows += list(bench_scaling.run_shape('join', [2, 5], repeat=1, budget=10))
+    assert [row['error'] for row in rows[2:]] == [None, None]
+    assert bench_scaling.failures(rows) == {'union': ('KeyError', 2)}
+
+
+def test_generated_files_run_through_the_cli(tmp_path):
+    workload.main(['--shapes', 'join', 'or_chain', '--sizes', '3', '20', '--out', str(tmp_path)])
+    out = io.StringIO()
+    assert main(['--schema', str(tmp_path / 'schema.json'), str(tmp_path / 'plans.jsonl')], out) == 0
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert len(records) == 4
+    assert all('Seq Scan t0' in record['annotations'] for record in records)
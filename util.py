@@ -1,29 +1,74 @@
-class Singleton(type):
-    _instances = {}
+import threading
+import time
+from collections import OrderedDict
 
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
-        return cls._instances[cls]
 
+class LRUCache:
+    """
+    Thread-safe mapping with least-recently-used eviction and optional per-entry time to live.
+    When weigh is given, entries are also evicted until their total weight fits in maxweight.
+    """
+    def __init__(self, maxsize=128, ttl=None, weigh=None, maxweight=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.maxweight = maxweight
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
 
-class NodeCoverage(metaclass=Singleton):
-    def __init__(self):
-        self._plan_node_count = 0
-        self._query_node_count = 0
-        self._total_node_count = 0
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] is not None and item[1] < time.monotonic():
+                self._remove(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
 
-    def inc_p(self):
-        self._plan_node_count += 1
-        self._total_node_count += 1
+    def put(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        weight = 0 if self.weigh is None else self.weigh(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, expires, weight)
+            self.weight += weight
+            while len(self._data) > self.maxsize or (
+                    self.maxweight is not None and self.weight > self.maxweight and len(self._data) > 1):
+                self._remove(next(iter(self._data)))
 
-    def inc_q(self):
-        self._query_node_count += 1
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._remove(key)
+        return default if item is None else item[0]
 
-    def inc_t(self):
-        self._total_node_count += 1
+    def prune(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.weight = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data), 'maxsize': self.maxsize,
+                'weight': self.weight}
+
+    def _remove(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.weight -= item[2]
+        return item
+
+    def __len__(self):
+        return len(self._data)
 
-    def __str__(self):
-        # TODO: query node should be compared to total node in query node, not in plan node
-        return f"{self._plan_node_count / self._total_node_count * 100}%," \
-               f" {self._query_node_count / self._total_node_count * 100}%"
@@ -0,0 +1,138 @@
+"""
+Synthetic queries that scale in one dimension, each with a matching EXPLAIN (VERBOSE, FORMAT JSON) plan,
+for annotating offline at sizes no real database schema has, e.g.
+python workload.py --shapes join or_chain --sizes 10 100 1000 --out workload/
+python cli.py --schema workload/schema.json workload/plans.jsonl > annotated.jsonl
+"""
+import argparse
+import json
+import os
+
+from catalog import save_snapshot
+
+COLUMNS = ('id', 'ref', 'val')
+
+
+def relation(i):
+    return f't{i}'
+
+
+def schema(tables):
+    """
+    :return: relation -> columns for t0 .. t{tables - 1}, the shape of catalog.SchemaCatalog.relations
+    """
+    return {relation(i): COLUMNS for i in range(tables)}
+
+
+def seq_scan(i, filter=None):
+    node = {
+        'Node Type': 'Seq Scan',
+        'Relation Name': relation(i),
+        'Alias': relation(i),
+        'Output': [f'{relation(i)}.{col}' for col in COLUMNS],
+    }
+    if filter is not None:
+        node['Filter'] = filter
+    return node
+
+
+def hash_join(outer, inner, cond):
+    return {
+        'Node Type': 'Hash Join',
+        'Hash Cond': f'({cond})',
+        'Output': outer['Output'] + inner['Output'],
+        'Plans': [outer, {'Node Type': 'Hash', 'Output': inner['Output'], 'Plans': [inner]}],
+    }
+
+
+def join(size):
+    """
+    size tables joined in a chain, planned as a left-deep tree of hash joins
+    """
+    tables = ', '.join(relation(i) for i in range(size))
+    conds = ' AND '.join(f'{relation(i - 1)}.id = {relation(i)}.ref' for i in range(1, size))
+    query = f'SELECT t0.val FROM {tables}' + (f' WHERE {conds}' if conds else '')
+    plan = seq_scan(0)
+    for i in range(1, size):
+        plan = hash_join(plan, seq_scan(i), f'{relation(i - 1)}.id = {relation(i)}.ref')
+    return query, plan, schema(size)
+
+
+def nested(size):
+    """
+    size levels of IN subqueries, planned as a right-deep tree of hash joins
+    """
+    query = f'SELECT {relation(size - 1)}.ref FROM {relation(size - 1)}'
+    plan = seq_scan(size - 1)
+    for i in reversed(range(size - 1)):
+        query = f'SELECT {relation(i)}.ref FROM {relation(i)} WHERE {relation(i)}.id IN ({query})'
+        plan = hash_join(seq_scan(i), plan, f'{relation(i)}.id = {relation(i + 1)}.ref')
+    return query, plan, schema(size)
+
+
+def or_chain(size):
+    """
+    one table filtered by size ORed equalities
+    """
+    terms = [f't0.val = {i}' for i in range(size)]
+    filter = '(' + ' OR '.join(f'({term})' for term in terms) + ')' if size > 1 else f'({terms[0]})'
+    return f"SELECT t0.id FROM t0 WHERE {' OR '.join(terms)}", seq_scan(0, filter), schema(1)
+
+
+def in_list(size):
+    """
+    one table filtered by an IN list of size constants
+    """
+    values = [str(i) for i in range(size)]
+    filter = f"(t0.val = ANY ('{{{','.join(values)}}}'::integer[]))"
+    return f"SELECT t0.id FROM t0 WHERE t0.val IN ({', '.join(values)})", seq_scan(0, filter), schema(1)
+
+
+def union(size):
+    """
+    size filtered SELECTs combined with UNION
+    """
+    query = ' UNION '.join(f'SELECT {relation(i)}.id FROM {relation(i)} WHERE {relation(i)}.val = {i}'
+                           for i in range(size))
+    plan = {
+        'Node Type': 'HashAggregate',
+        'Output': ['t0.id'],
+        'Plans': [{
+            'Node Type': 'Append',
+            'Plans': [seq_scan(i, f'({relation(i)}.val = {i})') for i in range(size)],
+        }],
+    }
+    return query, plan, schema(size)
+
+
+SHAPES = {'join': join, 'nested': nested, 'or_chain': or_chain, 'in_list': in_list, 'union': union}
+
+
+def generate(shape, size):
+    """
+    :return: (query, plan document as process_offline takes it, relation -> columns)
+    """
+    query, plan, relation_columns = SHAPES[shape](size)
+    return query, [{'Plan': plan}], relation_columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', nargs='+', choices=list(SHAPES), default=list(SHAPES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--out', default='workload', help='directory for plans.jsonl and schema.json')
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.out, exist_ok=True)
+    relation_columns = {}
+    with open(os.path.join(args.out, 'plans.jsonl'), 'w', encoding='utf-8') as f:
+        for shape in args.shapes:
+            for size in args.sizes:
+                query, plan, columns = generate(shape, size)
+                relation_columns.update(columns)
+                f.write(json.dumps({'query': query, 'plan': plan}) + '\n')
+    save_snapshot(relation_columns, os.path.join(args.out, 'schema.json'))
+
+
+if __name__ == '__main__':
+    main()